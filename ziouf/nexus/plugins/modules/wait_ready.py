@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+DOCUMENTATION = r'''
+module: wait_ready
+author: Cyril Marin (@ziouf)
+short_description: Wait until Nexus can serve requests
+description:
+    - Runs on the Nexus host and polls the C(status/writable) endpoint until it answers 200, at sub-second intervals
+      growing up to I(max_interval).
+    - When I(log_path) is set, the Nexus log is tailed meanwhile, and polling goes back to I(interval) as soon as the
+      C(Started Sonatype Nexus) marker is logged. Lines logged before the module started are ignored.
+    - Returns the measured time to ready.
+version_added: "1.0.0"
+options:
+    url:
+        description: Base URL of Nexus, context path included
+        type: str
+        default: http://localhost:8081/
+    log_path:
+        description: Nexus log file (sonatype-work/nexus3/log/nexus.log)
+        type: path
+    marker:
+        description: Log line content telling that Nexus has started
+        type: str
+        default: Started Sonatype Nexus
+    timeout:
+        description: Seconds to wait before failing
+        type: int
+        default: 300
+    interval:
+        description: Seconds between the first polls, and between polls once the marker is logged
+        type: float
+        default: 0.2
+    max_interval:
+        description: Maximum seconds between polls, intervals grow by half after every failed poll
+        type: float
+        default: 2.0
+    request_timeout:
+        description: Timeout in seconds of every poll
+        type: float
+        default: 5
+    validate_certs:
+        description: Validate the SSL certificate of Nexus
+        type: bool
+        default: true
+'''
+
+EXAMPLES = r'''
+- name: Wait until Nexus is ready
+  ziouf.nexus.wait_ready:
+    url: "http://localhost:8081/"
+    log_path: /opt/nexus/sonatype-work/nexus3/log/nexus.log
+  register: nexus_ready
+
+- debug: msg="Nexus ready after {{ nexus_ready.elapsed }}s"
+'''
+
+RETURN = r'''
+elapsed:
+    description: Seconds from the start of the module until Nexus was writable
+    returned: always
+    type: float
+    sample: 42.7
+started:
+    description: Seconds from the start of the module until the marker was logged, null if not seen
+    returned: always
+    type: float
+attempts:
+    description: Number of polls of the status endpoint
+    returned: always
+    type: int
+status:
+    description: HTTP status of the last poll, null when Nexus did not answer
+    returned: always
+    type: int
+'''
+
+import os
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import open_url
+
+try:
+    from urllib.error import HTTPError      # Python 3+
+except ImportError:
+    from urllib2 import HTTPError           # Python 2.x
+
+STATUS_PATH = 'service/rest/v1/status/writable'
+
+
+class LogTail():
+    """Lines appended to a file since this object was created"""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = self._size()
+        self.partial = b''
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def lines(self):
+        size = self._size()
+        if size < self.offset:
+            # Rotated or truncated: read the new file from its start
+            self.offset = 0
+            self.partial = b''
+        if size == self.offset:
+            return []
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = self.partial + f.read(size - self.offset)
+        self.offset = size
+
+        lines = data.split(b'\n')
+        self.partial = lines.pop()
+        return [line.decode('utf-8', 'replace') for line in lines]
+
+
+def probe(url, timeout, validate_certs):
+    """Return the HTTP status of the status endpoint, None when Nexus does not answer"""
+    try:
+        r = open_url(url, method='GET', timeout=timeout, validate_certs=validate_certs)
+        return r.getcode()
+    except HTTPError as e:
+        return e.code
+    except Exception:
+        return None
+
+
+def wait_ready(module):
+    params = module.params
+    url = '{base}/{path}'.format(base=params['url'].rstrip('/'), path=STATUS_PATH)
+    tail = LogTail(params['log_path']) if params['log_path'] else None
+
+    start = time.time()
+    deadline = start + params['timeout']
+    interval = params['interval']
+    result = dict(changed=False, url=url, elapsed=None, started=None, attempts=0, status=None)
+
+    while True:
+        if tail is not None and result['started'] is None:
+            if any(params['marker'] in line for line in tail.lines()):
+                result['started'] = round(time.time() - start, 3)
+                interval = params['interval']
+
+        now = time.time()
+        result['attempts'] += 1
+        result['status'] = probe(url, max(min(params['request_timeout'], deadline - now), 0.1),
+                                 params['validate_certs'])
+        if result['status'] == 200:
+            result['elapsed'] = round(time.time() - start, 3)
+            return result
+
+        now = time.time()
+        if now >= deadline:
+            module.fail_json(msg='Nexus is not ready after {t}s ({u} answered {s})'.format(
+                t=params['timeout'], u=url, s=result['status'] or 'nothing'), **result)
+
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * 1.5, params['max_interval'])
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            url=dict(type='str', default='http://localhost:8081/'),
+            log_path=dict(type='path'),
+            marker=dict(type='str', default='Started Sonatype Nexus'),
+            timeout=dict(type='int', default=300),
+            interval=dict(type='float', default=0.2),
+            max_interval=dict(type='float', default=2.0),
+            request_timeout=dict(type='float', default=5),
+            validate_certs=dict(type='bool', default=True),
+        ),
+        supports_check_mode=True,
+    )
+
+    module.exit_json(**wait_ready(module))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible_collections.ziouf.nexus.plugins.modules import wait_ready
+from ansible_collections.ziouf.nexus.plugins.modules.wait_ready import LogTail
+
+PARAMS = {
+    'url': 'http://localhost:8081/',
+    'log_path': None,
+    'marker': 'Started Sonatype Nexus',
+    'timeout': 10,
+    'interval': 0.2,
+    'max_interval': 2.0,
+    'request_timeout': 5,
+    'validate_certs': True,
+}
+
+
+class FailJson(Exception):
+    pass
+
+
+def fail_json(**kwargs):
+    raise FailJson(kwargs)
+
+
+class Clock():
+    """time.time and time.sleep of a clock that only moves when slept on"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+class TestLogTail(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'nexus.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def append(self, data, mode='ab'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def test_earlier_lines_are_ignored(self):
+        self.append(b'Started Sonatype Nexus\n')
+        tail = LogTail(self.path)
+
+        self.assertListEqual([], tail.lines())
+        self.append(b'first\nsecond\n')
+        self.assertListEqual(['first', 'second'], tail.lines())
+        self.assertListEqual([], tail.lines())
+
+    def test_partial_line_waits_for_its_end(self):
+        tail = LogTail(self.path)
+        self.append(b'first\nStarted Sonatype')
+
+        self.assertListEqual(['first'], tail.lines())
+        self.append(b' Nexus\n')
+        self.assertListEqual(['Started Sonatype Nexus'], tail.lines())
+
+    def test_missing_file(self):
+        tail = LogTail(self.path)
+
+        self.assertListEqual([], tail.lines())
+        self.append(b'created\n')
+        self.assertListEqual(['created'], tail.lines())
+
+    def test_rotated_file_is_read_from_its_start(self):
+        self.append(b'a long line logged before the module started\n')
+        tail = LogTail(self.path)
+
+        # Rotated: a new, shorter file
+        self.append(b'new\n', mode='wb')
+        self.assertListEqual(['new'], tail.lines())
+
+
+class TestWaitReady(TestCase):
+    def run_module(self, statuses, lines=None, **params):
+        module = MagicMock(params=dict(PARAMS, **params))
+        module.fail_json.side_effect = fail_json
+        clock = Clock()
+        tail = MagicMock()
+        tail.lines.side_effect = lines or (lambda: [])
+
+        with patch.object(wait_ready.time, 'time', new=clock.time), \
+             patch.object(wait_ready.time, 'sleep', new=clock.sleep), \
+             patch.object(wait_ready, 'LogTail', return_value=tail), \
+             patch.object(wait_ready, 'probe', side_effect=statuses) as probe:
+            try:
+                return wait_ready.wait_ready(module), clock, probe
+            except FailJson as e:
+                return e.args[0], clock, probe
+
+    def test_ready(self):
+        result, clock, probe = self.run_module([None, 503, 200])
+
+        self.assertEqual(200, result['status'])
+        self.assertEqual(3, result['attempts'])
+        self.assertEqual(0.5, result['elapsed'])
+        self.assertEqual('http://localhost:8081/service/rest/v1/status/writable', probe.call_args[0][0])
+
+    def test_intervals_grow_up_to_max_interval(self):
+        dummy, clock, dummy = self.run_module([None] * 8 + [200])
+
+        self.assertListEqual([0.2, 0.3, 0.45, 0.675, 1.013, 1.519, 2.0, 2.0], clock.sleeps)
+
+    def test_marker_resets_interval(self):
+        lines = iter([[]] * 4 + [['Started Sonatype Nexus']] + [[]] * 10)
+        result, clock, dummy = self.run_module([None] * 5 + [200], lines=lambda: next(lines),
+                                               log_path='/opt/nexus/sonatype-work/nexus3/log/nexus.log')
+
+        self.assertListEqual([0.2, 0.3, 0.45, 0.675, 0.2], clock.sleeps)
+        self.assertEqual(1.625, result['started'])
+
+    def test_timeout(self):
+        result, clock, dummy = self.run_module([None] * 100, timeout=3)
+
+        self.assertIn('not ready after 3s', result['msg'])
+        self.assertIsNone(result['elapsed'])
+        self.assertEqual(1003.0, clock.now)
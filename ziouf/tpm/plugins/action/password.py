@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ..module_utils.base_action import TpmActionBase
+from ..modules import password
+
+
+class ActionModule(TpmActionBase):
+    """Run the ziouf.tpm.password module on the controller"""
+
+    module = password
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+DOCUMENTATION = r'''
+name: metrics
+author: Cyril Marin (@ziouf)
+type: aggregate
+short_description: Report the latency of Team Password Manager requests
+description:
+    - Aggregates the requests sent to Team Password Manager by the ziouf.tpm plugins, per task and per host.
+    - For every play, prints the totals and the slowest requests with their timings by phase
+      (throttle, connect, tls, sign, wait, transfer, decode).
+    - Ansible has no end of play event, the report of a play is printed when the next play starts, the report of
+      the last play at the end of the playbook.
+    - Requests are collected from the worker processes through a temporary spool directory.
+requirements:
+    - enable in configuration, C(callbacks_enabled = ziouf.tpm.metrics) in ansible.cfg
+options:
+    top:
+        description: Number of slowest requests printed
+        type: int
+        default: 10
+        env:
+            - name: TPM_METRICS_TOP
+        ini:
+            - section: callback_tpm_metrics
+              key: top
+    output:
+        description: File the requests are appended to as JSON lines, for offline analysis
+        type: path
+        env:
+            - name: TPM_METRICS_OUTPUT
+        ini:
+            - section: callback_tpm_metrics
+              key: output
+'''
+
+import os
+import json
+import shutil
+import tempfile
+
+from ansible.plugins.callback import CallbackBase
+from ..module_utils.metrics import (
+    SPOOL_DIR_ENV,
+    TASK_ENV,
+    TASK_NAME_ENV,
+)
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'ziouf.tpm.metrics'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.spool = tempfile.mkdtemp(prefix='ziouf.tpm.metrics.')
+        # Inherited by the worker processes forked from now on
+        os.environ[SPOOL_DIR_ENV] = self.spool
+
+    def v2_playbook_on_play_start(self, play):
+        self.report()
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        os.environ[TASK_ENV] = task._uuid
+        os.environ[TASK_NAME_ENV] = task.get_name()
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.v2_playbook_on_task_start(task, False)
+
+    def v2_playbook_on_stats(self, stats):
+        self.report()
+        shutil.rmtree(self.spool, ignore_errors=True)
+        os.environ.pop(SPOOL_DIR_ENV, None)
+
+    def collect(self):
+        """Return the requests spooled since the previous report, and empty the spool"""
+        requests = []
+        for name in sorted(os.listdir(self.spool)):
+            path = os.path.join(self.spool, name)
+            # Renamed first, so that a worker still running appends to a new file
+            claimed = '{p}.{n}'.format(p=path, n=len(requests))
+            try:
+                os.rename(path, claimed)
+                with open(claimed) as f:
+                    requests.extend(json.loads(line) for line in f if line.strip())
+                os.remove(claimed)
+            except (IOError, OSError, ValueError) as e:
+                self._display.warning('Failed to read TPM metrics {p}: {e}'.format(p=path, e=e))
+
+        return requests
+
+    def report(self):
+        requests = self.collect()
+        if not requests:
+            return
+
+        if self.get_option('output'):
+            with open(os.path.expanduser(self.get_option('output')), 'a') as f:
+                for request in requests:
+                    f.write(json.dumps(request) + '\n')
+
+        self._display.banner('TPM REQUESTS')
+
+        tasks = self.aggregate(requests, lambda r: r.get('task_name') or r.get('task') or '-')
+        hosts = self.aggregate(requests, lambda r: r.get('host') or 'localhost')
+        for title, groups in (('task', tasks), ('host', hosts)):
+            self._display.display('By {t}:'.format(t=title))
+            for key, total in sorted(groups.items(), key=lambda i: -i[1]['time']):
+                self._display.display(
+                    '  {k}: {n} requests, {p} pages, {r} retries, {b} bytes, {t:.3f}s'.format(
+                        k=key, n=total['requests'], p=total['pages'], r=total['retries'],
+                        b=total['bytes'], t=total['time']))
+
+        self._display.display('Slowest requests:')
+        for r in sorted(requests, key=lambda r: -r['total'])[:self.get_option('top')]:
+            self._display.display('  {t:.3f}s {m} {p} [{h}] ({task}) {phases}'.format(
+                t=r['total'], m=r['method'], p=r['path'], h=r.get('host') or 'localhost',
+                task=r.get('task_name') or '-',
+                phases=' '.join('{k}={v:.3f}'.format(k=k, v=v) for k, v in r['timings'].items() if v)))
+
+    @staticmethod
+    def aggregate(requests, key):
+        groups = {}
+        for r in requests:
+            total = groups.setdefault(key(r), dict(requests=0, pages=0, retries=0, bytes=0, time=0.0))
+            total['requests'] += 1
+            total['pages'] += 1 if r.get('page') else 0
+            total['retries'] += r.get('retries') or 0
+            total['bytes'] += (r.get('bytes_sent') or 0) + (r.get('bytes_received') or 0)
+            total['time'] += r['total']
+        return groups
@@ -39,17 +39,219 @@ options:
         required: False
         default: password
     id:
-        description: Id of wanted secret
+        description: Id, or list of ids, of wanted secrets
+        type: raw
         required: False
     wantlist:
         description: Return all results
         required: False
         type: bool
         default: False
+    workers:
+        description: |
+            Number of concurrent requests: password details when a query matches several passwords,
+            and distinct queries or ids when several are given, shared out between the queries
+        type: int
+        default: 4
+    timeout:
+        description: Timeout in seconds of every request sent to TPM
+        type: int
+        default: 10
+    pool_size:
+        description: Maximum number of idle keep-alive connections kept open to the TPM host
+        type: int
+        default: 4
+    pool_idle_timeout:
+        description: Seconds after which an idle keep-alive connection is dropped
+        type: int
+        default: 30
+    retries:
+        description: |
+            Number of times a request is sent again when TPM answers 429 or 5xx
+            Retries wait for an exponential backoff with jitter, or the delay asked by a Retry-After header
+        type: int
+        default: 3
+    rate_limit:
+        description: |
+            Maximum number of requests per second sent to TPM, shared by every fork of the controller (0 for unlimited)
+            The rate is halved whenever TPM answers 429 or 5xx, then grows back to this limit
+        type: float
+        default: 0
+    rate_burst:
+        description: Number of requests sent at once before I(rate_limit) applies
+        type: int
+        default: 10
+    breaker_threshold:
+        description: |
+            Number of consecutive failed requests (connection errors, timeouts, 5xx) after which TPM is considered unavailable,
+            shared by every fork of the controller: requests then fail at once for I(breaker_reset_timeout) seconds (0 to disable)
+            Its state is kept under the C(TPM_STATE_DIR) directory, C(~/.cache/ziouf.tpm.state) by default
+            Meanwhile, cached results are returned however old, when I(cache) is enabled
+        type: int
+        default: 5
+    breaker_reset_timeout:
+        description: Seconds requests fail fast before a single one probes TPM again
+        type: int
+        default: 30
+    broker:
+        description: |
+            Send the requests through a broker daemon shared by every fork of the controller, started on demand
+            It holds the connections and caches GET responses for I(broker_cache_ttl) seconds, and identical requests
+            in flight are sent to TPM once
+        type: bool
+        default: false
+        env:
+            - name: TPM_LOOKUP_BROKER
+        vars:
+            - name: tpm_lookup_broker
+    broker_socket:
+        description: Unix socket of the broker (defaults to ~/.cache/ziouf.tpm.broker/broker.sock)
+        type: path
+        env:
+            - name: TPM_LOOKUP_BROKER_SOCKET
+        vars:
+            - name: tpm_lookup_broker_socket
+    broker_cache_ttl:
+        description: |
+            Seconds GET responses are cached by the broker, writes done by this collection on the controller expire them
+            Applies when the broker is started
+        type: int
+        default: 60
+    broker_idle_timeout:
+        description: Seconds without request after which the broker exits
+        type: int
+        default: 300
+    negative_cache_ttl:
+        description: |
+            Seconds a search matching nothing is remembered by every fork of the controller, so that probing for a
+            missing secret costs a single request (0 to disable)
+            Passwords created or updated by this collection on the controller forget every password search,
+            project writes forget them all
+            Misses are kept under the C(TPM_NEGATIVE_CACHE_DIR) directory, C(~/.cache/ziouf.tpm.misses) by default
+        type: int
+        default: 10
+        env:
+            - name: TPM_LOOKUP_NEGATIVE_CACHE_TTL
+        vars:
+            - name: tpm_lookup_negative_cache_ttl
+    cache:
+        description: |
+            Memoize lookup results, keyed by TPM host, auth identity, query and options
+            Entries related to a TPM host are dropped whenever this process writes to it through the API
+        type: bool
+        default: False
+        env:
+            - name: TPM_LOOKUP_CACHE
+        vars:
+            - name: tpm_lookup_cache
+    cache_ttl:
+        description: Seconds a cached lookup result stays valid
+        type: int
+        default: 300
+        env:
+            - name: TPM_LOOKUP_CACHE_TTL
+        vars:
+            - name: tpm_lookup_cache_ttl
+    cache_max_entries:
+        description: Maximum number of cached lookup results, least recently used results are evicted first
+        type: int
+        default: 1024
+        env:
+            - name: TPM_LOOKUP_CACHE_MAX_ENTRIES
+        vars:
+            - name: tpm_lookup_cache_max_entries
+    cache_backend:
+        description: |
+            Where cached lookup results are stored
+            memory keeps them in the process running the lookup
+            file keeps them encrypted on disk, shared by every fork and by later playbook runs
+        type: str
+        choices: [memory, file]
+        default: memory
+        env:
+            - name: TPM_LOOKUP_CACHE_BACKEND
+        vars:
+            - name: tpm_lookup_cache_backend
+    cache_dir:
+        description: Directory of the file cache backend (defaults to ~/.cache/ziouf.tpm)
+        type: path
+        env:
+            - name: TPM_LOOKUP_CACHE_DIR
+        vars:
+            - name: tpm_lookup_cache_dir
+    cache_stale_ttl:
+        description: |
+            Seconds an expired result is still served while it is refreshed in the background
+            (stale-while-revalidate). 0 disables it
+        type: int
+        default: 0
+        env:
+            - name: TPM_LOOKUP_CACHE_STALE_TTL
+        vars:
+            - name: tpm_lookup_cache_stale_ttl
+    source:
+        description: |
+            Where queries and ids are resolved
+            api queries Team Password Manager, snapshot evaluates them against a local encrypted copy of every
+            readable password, pulled in bulk once missing and refreshed once older than I(snapshot_max_age)
+            Queries using a search field other than name, username, email, access, notes, tag and project are
+            always sent to Team Password Manager
+        type: str
+        choices: [api, snapshot]
+        default: api
+        env:
+            - name: TPM_LOOKUP_SOURCE
+        vars:
+            - name: tpm_lookup_source
+    snapshot_path:
+        description: Snapshot file, defaults to a file per TPM host and identity under C(~/.cache/ziouf.tpm.snapshots)
+        type: path
+        env:
+            - name: TPM_LOOKUP_SNAPSHOT_PATH
+        vars:
+            - name: tpm_lookup_snapshot_path
+    snapshot_max_age:
+        description: |
+            Age in seconds after which the snapshot is refreshed
+            Writes done by this collection on the controller refresh it as well, whatever its age
+        type: int
+        default: 3600
+        env:
+            - name: TPM_LOOKUP_SNAPSHOT_MAX_AGE
+        vars:
+            - name: tpm_lookup_snapshot_max_age
+    snapshot_sync:
+        description: |
+            How an expired snapshot is refreshed
+            incremental reads the password listing and only fetches the entries whose updated_on changed,
+            full fetches every entry again
+        type: str
+        choices: [incremental, full]
+        default: incremental
+        env:
+            - name: TPM_LOOKUP_SNAPSHOT_SYNC
+        vars:
+            - name: tpm_lookup_snapshot_sync
     generate:
         description: generate a new password from Team Password Manager API
         type: bool
         default: False
+    generator:
+        description: |
+            How new passwords are generated
+            remote asks the Team Password Manager generator, local generates them following I(password_policy)
+        type: str
+        choices: [remote, local]
+        default: remote
+    generator_batch:
+        description: Number of passwords requested concurrently from the Team Password Manager generator and kept for the next calls
+        type: int
+        default: 1
+    password_policy:
+        description: |
+            Policy of locally generated passwords, should match the one configured in Team Password Manager
+            Keys are length, lower, upper, digits, symbols and symbol_chars
+        type: dict
 '''
 
 EXAMPLES = r'''
@@ -79,9 +281,23 @@ EXAMPLES = r'''
 - debug: msg="{{ lookup('ziouf.tpm.password', id=1234, field='password') }}"
 # returns : str
 
+# Several queries or ids are resolved in one call, each distinct one only once
+- debug: msg="{{ query('ziouf.tpm.password', 'name:db tag:prd', 'name:ldap tag:prd', field='password') }}"
+# returns : [str, str]
+- debug: msg="{{ query('ziouf.tpm.password', id=[1234, 5678]) }}"
+# returns : [dict, dict]
+- debug: msg="{{ query('ziouf.tpm.password', id=[1234, 5678], field='password') }}"
+# returns : [str, str]
+
+# Resolve queries offline, against a local snapshot pulled at most once an hour
+- debug: msg="{{ query('ziouf.tpm.password', 'username:admin tag:nexus,prd', source='snapshot', field='password') }}"
+# returns : str
+
 # Generate a new password
 - debug: msg="{{ lookup('ziouf.tpm.password', generate=True) }}"
 # returns : str
+- debug: msg="{{ lookup('ziouf.tpm.password', generate=True, generator='local', password_policy={'length': 24, 'symbols': False}) }}"
+# returns : str
 '''
 
 RETURN = r'''
@@ -92,20 +308,26 @@ RETURN = r'''
     elements: json
 '''
 
+from collections import OrderedDict
+
 from ansible.errors import AnsibleError
 from ansible.utils.display import Display
 from ansible.plugins.lookup import LookupBase
 from ansible.module_utils.common.dict_transformations import dict_merge
 from ..module_utils.api import TpmPasswordApi
 from ..module_utils.base_lookup import TpmLookupBase
+from ..module_utils.broker import default_path as broker_path
+from ..module_utils.concurrency import parallel_map
+from ..module_utils.snapshot import TpmSnapshotStore
 
 
-class LookupModule(LookupBase, TpmPasswordApi):
+class LookupModule(LookupBase, TpmLookupBase, TpmPasswordApi):
     display = Display()
 
     def run(self, terms, variables=None, **kwargs):
         self.set_options(task_keys=TpmLookupBase.task_keys(
             variables), var_options=variables, direct=kwargs)
+        self.label_metrics(variables)
 
         self.config = dict_merge(TpmPasswordApi.default_config(), {
             'tpm_hostname': self.get_option('hostname'),
@@ -114,15 +336,61 @@ class LookupModule(LookupBase, TpmPasswordApi):
             'tpm_username': self.get_option('username'),
             'tpm_password': self.get_option('password'),
             'use_hmac': all([self.get_option('public_key'), self.get_option('private_key')]),
+            'tpm_timeout': self.get_option('timeout'),
+            'tpm_pool_size': self.get_option('pool_size'),
+            'tpm_pool_idle_timeout': self.get_option('pool_idle_timeout'),
+            'tpm_retries': self.get_option('retries'),
+            'tpm_rate_limit': self.get_option('rate_limit'),
+            'tpm_rate_burst': self.get_option('rate_burst'),
+            'tpm_breaker_threshold': self.get_option('breaker_threshold'),
+            'tpm_breaker_reset_timeout': self.get_option('breaker_reset_timeout'),
+            'tpm_broker': (self.get_option('broker_socket') or broker_path()) if self.get_option('broker') else None,
+            'tpm_broker_cache_ttl': self.get_option('broker_cache_ttl'),
+            'tpm_broker_idle_timeout': self.get_option('broker_idle_timeout'),
+            'tpm_negative_cache_ttl': self.get_option('negative_cache_ttl'),
+            'tpm_generator': self.get_option('generator'),
+            'tpm_generator_batch': self.get_option('generator_batch'),
+            'tpm_password_policy': self.get_option('password_policy'),
+            'tpm_snapshot_max_age': self.get_option('snapshot_max_age'),
+            'tpm_snapshot_sync': self.get_option('snapshot_sync'),
         })
 
+        if self.get_option('source') == 'snapshot':
+            self.config['tpm_snapshot'] = self.get_option('snapshot_path') or TpmSnapshotStore.default_path(
+                self.config.get('tpm_hostname'),
+                self.config.get('tpm_public_key') or self.config.get('tpm_username'))
+
         if self.get_option('generate') or False:
             return [self.generate()['password']]
 
         if self.get_option('id') or False:
-            return [self.getById(id=self.get_option('id'))]
+            ids = self.get_option('id')
+            ids = ids if isinstance(ids, list) else [ids]
+
+            # Every distinct id is fetched once, concurrently
+            entries = self.fn_batch(lambda id: self.cached(self.cache_key('id', id), self.getById, id=id), ids)
+            # Whole entries, unless a field is asked for
+            if 'field' not in kwargs:
+                return [entries[id] for id in ids]
+            return [self.fn_map(entries[id]) for id in ids]
+
+        # Every distinct query is resolved once, concurrently
+        results = self.fn_batch(lambda query: self.cached(
+            self.cache_key('find', query, self.get_option('wantlist') or False),
+            self.fn_find, query), terms)
+
+        return [self.fn_map(item) for query in terms for item in results[query]]
+
+    def fn_batch(self, fn, inputs):
+        """Return {input: fn(input)} for every distinct input, computed concurrently
 
-        return [self.fn_map(item) for item in self.fn_find(next(query for query in terms))]
+        The threads left to each call (see fn_find) are shared out, so that at
+        most `workers` requests are sent at once overall.
+        """
+        unique = list(OrderedDict.fromkeys(inputs))
+        workers = self.get_option('workers')
+        self.call_workers = max(1, workers // max(1, min(workers, len(unique))))
+        return dict(zip(unique, parallel_map(fn, unique, workers=workers)))
 
     def fn_map(self, item):
         if self.get_option('field') == 'all':
@@ -136,9 +404,10 @@ class LookupModule(LookupBase, TpmPasswordApi):
             self.display.vv(
                 msg='Searching matching passwords for query : "{q}"'.format(q=query))
 
-            # Find matching passwords
-            result = [self.getById(id=r['id'])
-                      for r in self.find(query_str=query)]
+            # Find matching passwords, then fetch their details concurrently
+            result = parallel_map(lambda r: self.getById(id=r['id']),
+                                  self.find(query_str=query, fields=('id',)),
+                                  workers=getattr(self, 'call_workers', self.get_option('workers')))
             result.sort(key=lambda x: x['name'])
 
             self.display.vv(msg='Found {l} results for query "{q}"'.format(
@@ -44,6 +44,153 @@ options:
         required: False
         type: bool
         default: False
+    path:
+        description: |
+            Terms are project paths (parent/child), or names, resolved exactly from an index of the project tree
+            built from a single project listing, instead of server side searches
+            Returned projects carry their path
+        type: bool
+        default: False
+    subtree:
+        description: With I(path), return the project followed by all its descendants, parents first
+        type: bool
+        default: False
+    timeout:
+        description: Timeout in seconds of every request sent to TPM
+        type: int
+        default: 10
+    pool_size:
+        description: Maximum number of idle keep-alive connections kept open to the TPM host
+        type: int
+        default: 4
+    pool_idle_timeout:
+        description: Seconds after which an idle keep-alive connection is dropped
+        type: int
+        default: 30
+    retries:
+        description: |
+            Number of times a request is sent again when TPM answers 429 or 5xx
+            Retries wait for an exponential backoff with jitter, or the delay asked by a Retry-After header
+        type: int
+        default: 3
+    rate_limit:
+        description: |
+            Maximum number of requests per second sent to TPM, shared by every fork of the controller (0 for unlimited)
+            The rate is halved whenever TPM answers 429 or 5xx, then grows back to this limit
+        type: float
+        default: 0
+    rate_burst:
+        description: Number of requests sent at once before I(rate_limit) applies
+        type: int
+        default: 10
+    breaker_threshold:
+        description: |
+            Number of consecutive failed requests (connection errors, timeouts, 5xx) after which TPM is considered unavailable,
+            shared by every fork of the controller: requests then fail at once for I(breaker_reset_timeout) seconds (0 to disable)
+            Its state is kept under the C(TPM_STATE_DIR) directory, C(~/.cache/ziouf.tpm.state) by default
+            Meanwhile, cached results are returned however old, when I(cache) is enabled
+        type: int
+        default: 5
+    breaker_reset_timeout:
+        description: Seconds requests fail fast before a single one probes TPM again
+        type: int
+        default: 30
+    broker:
+        description: |
+            Send the requests through a broker daemon shared by every fork of the controller, started on demand
+            It holds the connections and caches GET responses for I(broker_cache_ttl) seconds, and identical requests
+            in flight are sent to TPM once
+        type: bool
+        default: false
+        env:
+            - name: TPM_LOOKUP_BROKER
+        vars:
+            - name: tpm_lookup_broker
+    broker_socket:
+        description: Unix socket of the broker (defaults to ~/.cache/ziouf.tpm.broker/broker.sock)
+        type: path
+        env:
+            - name: TPM_LOOKUP_BROKER_SOCKET
+        vars:
+            - name: tpm_lookup_broker_socket
+    broker_cache_ttl:
+        description: |
+            Seconds GET responses are cached by the broker, writes done by this collection on the controller expire them
+            Applies when the broker is started
+        type: int
+        default: 60
+    broker_idle_timeout:
+        description: Seconds without request after which the broker exits
+        type: int
+        default: 300
+    negative_cache_ttl:
+        description: |
+            Seconds a search matching nothing is remembered by every fork of the controller, so that probing for a
+            missing secret costs a single request (0 to disable)
+            Passwords created or updated by this collection on the controller forget every password search,
+            project writes forget them all
+            Misses are kept under the C(TPM_NEGATIVE_CACHE_DIR) directory, C(~/.cache/ziouf.tpm.misses) by default
+        type: int
+        default: 10
+        env:
+            - name: TPM_LOOKUP_NEGATIVE_CACHE_TTL
+        vars:
+            - name: tpm_lookup_negative_cache_ttl
+    cache:
+        description: |
+            Memoize lookup results, keyed by TPM host, auth identity, query and options
+            Entries related to a TPM host are dropped whenever this process writes to it through the API
+        type: bool
+        default: False
+        env:
+            - name: TPM_LOOKUP_CACHE
+        vars:
+            - name: tpm_lookup_cache
+    cache_ttl:
+        description: Seconds a cached lookup result stays valid
+        type: int
+        default: 300
+        env:
+            - name: TPM_LOOKUP_CACHE_TTL
+        vars:
+            - name: tpm_lookup_cache_ttl
+    cache_max_entries:
+        description: Maximum number of cached lookup results, least recently used results are evicted first
+        type: int
+        default: 1024
+        env:
+            - name: TPM_LOOKUP_CACHE_MAX_ENTRIES
+        vars:
+            - name: tpm_lookup_cache_max_entries
+    cache_backend:
+        description: |
+            Where cached lookup results are stored
+            memory keeps them in the process running the lookup
+            file keeps them encrypted on disk, shared by every fork and by later playbook runs
+        type: str
+        choices: [memory, file]
+        default: memory
+        env:
+            - name: TPM_LOOKUP_CACHE_BACKEND
+        vars:
+            - name: tpm_lookup_cache_backend
+    cache_dir:
+        description: Directory of the file cache backend (defaults to ~/.cache/ziouf.tpm)
+        type: path
+        env:
+            - name: TPM_LOOKUP_CACHE_DIR
+        vars:
+            - name: tpm_lookup_cache_dir
+    cache_stale_ttl:
+        description: |
+            Seconds an expired result is still served while it is refreshed in the background
+            (stale-while-revalidate). 0 disables it
+        type: int
+        default: 0
+        env:
+            - name: TPM_LOOKUP_CACHE_STALE_TTL
+        vars:
+            - name: tpm_lookup_cache_stale_ttl
 '''
 
 EXAMPLES = r'''
@@ -58,6 +205,12 @@ EXAMPLES = r'''
 # returns : [dict, ...]
 - debug: msg="{{ lookup('ziouf.tpm.project', 'myproject', all=True, field='name') }}"
 # returns : [str, ...]
+
+# Exact project path, and every project below it
+- debug: msg="{{ lookup('ziouf.tpm.project', 'infra/prod/nexus', path=True) }}"
+# returns : int
+- debug: msg="{{ lookup('ziouf.tpm.project', 'infra/prod', path=True, subtree=True, field='path') }}"
+# returns : [str, ...]
 '''
 
 RETURN = r'''
@@ -74,14 +227,16 @@ from ansible.plugins.lookup import LookupBase
 from ansible.module_utils.common.dict_transformations import dict_merge
 from ..module_utils.api import TpmProjectApi
 from ..module_utils.base_lookup import TpmLookupBase
+from ..module_utils.broker import default_path as broker_path
 
 
-class LookupModule(LookupBase, TpmProjectApi):
+class LookupModule(LookupBase, TpmLookupBase, TpmProjectApi):
     display = Display()
 
     def run(self, terms, variables=None, **kwargs):
         self.set_options(task_keys=TpmLookupBase.task_keys(
             variables), var_options=variables, direct=kwargs)
+        self.label_metrics(variables)
 
         self.config = dict_merge(TpmProjectApi.default_config(), {
             'tpm_hostname': self.get_option('hostname'),
@@ -90,9 +245,29 @@ class LookupModule(LookupBase, TpmProjectApi):
             'tpm_username': self.get_option('username'),
             'tpm_password': self.get_option('password'),
             'use_hmac': all([self.get_option('public_key'), self.get_option('private_key')]),
+            'tpm_timeout': self.get_option('timeout'),
+            'tpm_pool_size': self.get_option('pool_size'),
+            'tpm_pool_idle_timeout': self.get_option('pool_idle_timeout'),
+            'tpm_retries': self.get_option('retries'),
+            'tpm_rate_limit': self.get_option('rate_limit'),
+            'tpm_rate_burst': self.get_option('rate_burst'),
+            'tpm_breaker_threshold': self.get_option('breaker_threshold'),
+            'tpm_breaker_reset_timeout': self.get_option('breaker_reset_timeout'),
+            'tpm_broker': (self.get_option('broker_socket') or broker_path()) if self.get_option('broker') else None,
+            'tpm_broker_cache_ttl': self.get_option('broker_cache_ttl'),
+            'tpm_broker_idle_timeout': self.get_option('broker_idle_timeout'),
+            'tpm_negative_cache_ttl': self.get_option('negative_cache_ttl'),
         })
 
-        return [self.fn_map(item) for item in self.fn_find(next(query for query in terms))]
+        query = next(query for query in terms)
+        if self.get_option('path'):
+            result = self.cached(self.cache_key('path', query, self.get_option('subtree')),
+                                 self.fn_path, query)
+        else:
+            result = self.cached(self.cache_key('find', query, self.get_option('wantlist') or False),
+                                 self.fn_find, query)
+
+        return [self.fn_map(item) for item in result]
 
     def fn_map(self, item):
         print(self._options)
@@ -102,6 +277,20 @@ class LookupModule(LookupBase, TpmProjectApi):
             return item[self.get_option('field')]
         return item
 
+    def fn_path(self, query):
+        try:
+            self.display.vv(
+                msg='Resolving project path "{q}"'.format(q=query))
+
+            project = self.getByPath(query)
+            if self.get_option('subtree'):
+                return list(self.projectTree().subtree(project['id']))
+            return [project]
+
+        except Exception as e:
+            msg = 'Project path "{q}" did not match any project'.format(q=query)
+            raise AnsibleError(e, msg)
+
     def fn_find(self, query):
         try:
             self.display.vv(
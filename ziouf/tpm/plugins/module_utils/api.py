@@ -5,18 +5,41 @@ __metaclass__ = type
 import re
 import hmac
 import hashlib
+import base64
 import codecs
 import json
 import time
+import threading
 
 try:
     from urllib import quote        # Python 2.x
+    from urlparse import urlsplit
 except ImportError:
-    from urllib.parse import quote  # Python 3+
+    from urllib.parse import quote, urlsplit  # Python 3+
 
-from ansible.module_utils.urls import open_url
 from ansible.module_utils.common.dict_transformations import dict_merge
 
+from .breaker import CircuitOpenError, get_circuit_breaker
+from .broker import request as broker_request
+from .cache import invalidate_caches
+from .connection import get_pool
+from .generator import generate_password, get_password_pool
+from .jsonstream import iter_array, project
+from .metrics import TpmRequestMetrics
+from .negative_cache import forget_misses, get_negative_cache
+from .project_tree import AmbiguousProjectError, ProjectNotFoundError, TpmProjectTree
+from .snapshot import QueryError, get_snapshot
+from .throttle import (
+    IDEMPOTENT_METHODS,
+    THROTTLED_STATUSES,
+    backoff_delay,
+    get_rate_limiter,
+    retry_after,
+)
+
+
+NEXT_PAGE_LINK = re.compile(r'<https?://[^>]+?/index\.php/([^>]+)>; *rel="next"')
+
 
 class OpenUrlError(Exception):
     """Failed to open given url"""
@@ -69,17 +92,38 @@ class TpmApiBase():
     def default_config():
         return {
             'tpm_ssl_verify': True,
+            'tpm_timeout': 10,
+            'tpm_pool_size': 4,
+            'tpm_pool_idle_timeout': 30,
+            'tpm_return_mode': 'full',
+            'tpm_generator': 'remote',
+            'tpm_generator_batch': 1,
+            'tpm_password_policy': None,
+            'tpm_snapshot': None,
+            'tpm_snapshot_max_age': 3600,
+            'tpm_snapshot_sync': 'incremental',
+            'tpm_retries': 3,
+            'tpm_retry_backoff': 0.5,
+            'tpm_retry_max_delay': 30,
+            'tpm_rate_limit': 0,
+            'tpm_rate_burst': 10,
+            'tpm_breaker_threshold': 5,
+            'tpm_breaker_reset_timeout': 30,
+            'tpm_broker': None,
+            'tpm_broker_cache_ttl': 60,
+            'tpm_broker_idle_timeout': 300,
+            'tpm_negative_cache_ttl': 10,
         }
 
     def __init__(self, config = None):
         self.config = dict_merge(TpmApiBase.default_config(), config or {})
 
         # Determine which login method to use
-        if all([config.get('tpm_public_key', None),
-                config.get('tpm_private_key', None)]):
+        if all([self.config.get('tpm_public_key', None),
+                self.config.get('tpm_private_key', None)]):
             self.config['use_hmac'] = True
-            self.config.pop('tpm_username')
-            self.config.pop('tpm_password')
+            self.config.pop('tpm_username', None)
+            self.config.pop('tpm_password', None)
 
     def __get_headers(self, path, data = None):
         if self.config.get('use_hmac', False):
@@ -103,59 +147,258 @@ class TpmApiBase():
             msg=codecs.encode(msg),
         ).hexdigest()
 
-    def __get_url(self, path):
-        return 'https://{host}/index.php/{path}'.format(
-            host=self.config.get('tpm_hostname'),
-            path=path
-        )
+    def __get_auth_headers(self):
+        if self.config.get('use_hmac', False) or not self.config.get('tpm_username'):
+            return {}
+
+        credentials = '{u}:{p}'.format(u=self.config.get('tpm_username'),
+                                       p=self.config.get('tpm_password') or '')
+        return {
+            "Authorization": 'Basic {c}'.format(
+                c=codecs.decode(base64.b64encode(codecs.encode(credentials)))),
+        }
+
+    def _request_headers(self, path, body = None):
+        """Return the headers of a request: HMAC signature or Basic credentials"""
+        return dict_merge(self.__get_headers(path, data=body), self.__get_auth_headers())
+
+    def _location(self):
+        # tpm_hostname is 'hostname.domain:port/app-path-if-needed'
+        location = urlsplit('https://{host}'.format(host=self.config.get('tpm_hostname')))
+        return location.hostname, location.port, location.path.rstrip('/')
+
+    def __get_pool(self):
+        hostname, port, dummy = self._location()
+        return get_pool(hostname, port,
+                        ssl_verify=self.config.get('tpm_ssl_verify', True),
+                        timeout=self.config.get('tpm_timeout', 10),
+                        maxsize=self.config.get('tpm_pool_size', 4),
+                        idle_timeout=self.config.get('tpm_pool_idle_timeout', 30))
+
+    def _rate_limiter(self):
+        """Return the rate limiter shared by the processes talking to TPM, if tpm_rate_limit is set"""
+        if not self.config.get('tpm_rate_limit'):
+            return None
+        return get_rate_limiter(self.config.get('tpm_hostname'), self.config.get('tpm_rate_limit'),
+                                burst=self.config.get('tpm_rate_burst', 10))
+
+    def _circuit_breaker(self):
+        """Return the circuit breaker shared by the processes talking to TPM, unless tpm_breaker_threshold is 0"""
+        if not self.config.get('tpm_breaker_threshold'):
+            return None
+        return get_circuit_breaker(self.config.get('tpm_hostname'), self.config.get('tpm_breaker_threshold'),
+                                   reset_timeout=self.config.get('tpm_breaker_reset_timeout', 30))
+
+    def _retry_delay(self, method, r, attempt):
+        """Return the seconds to wait before sending a request again, None when it must not be
+
+        429 and 503 are retried whatever the method, other 5xx for idempotent
+        methods only, up to tpm_retries times with a jittered exponential
+        backoff. A Retry-After longer than tpm_retry_max_delay is not waited for.
+        """
+        if r.status != 429 and r.status < 500:
+            return None
+        if r.status not in THROTTLED_STATUSES and method not in IDEMPOTENT_METHODS:
+            return None
+        if attempt >= self.config.get('tpm_retries', 3):
+            return None
+
+        max_delay = self.config.get('tpm_retry_max_delay', 30)
+        delay = backoff_delay(attempt, self.config.get('tpm_retry_backoff', 0.5), max_delay)
+        after = retry_after(r)
+        if after is not None:
+            if after > max_delay:
+                return None
+            delay = max(delay, after)
+        return delay
+
+    def _http_request(self, method, path, body = None, page = None, decode = True):
+        """Send a request to TPM on a pooled keep-alive connection
+
+        Throttled and failed (5xx) requests are retried (see _retry_delay),
+        under the shared rate limit when tpm_rate_limit is set. While the
+        circuit breaker is open, it fails at once with CircuitOpenError. Its
+        phase timings and counters are recorded (see metrics.py), the JSON
+        body is decoded once here so that decoding is timed as well, unless
+        `decode` is false (streamed pages, see _http_iter).
+        With tpm_broker set, the request is sent through the broker instead.
+        """
+        if self.config.get('tpm_broker'):
+            return self._broker_request(method, path, body=body, page=page, decode=decode)
+
+        dummy, dummy, prefix = self._location()
+        metrics = TpmRequestMetrics(method, path, page=page)
+        limiter = self._rate_limiter()
+        breaker = self._circuit_breaker()
+        payload = codecs.encode(json.dumps(body)) if body else None
+
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.allow()
+            if limiter is not None:
+                with metrics.timer('throttle'):
+                    time.sleep(limiter.reserve())
+
+            # Signed again on retry: the timestamp is part of the signature
+            with metrics.timer('sign'):
+                headers = self._request_headers(path, body=body)
 
-    def _http_get(self, path):
-        r = open_url(self.__get_url(path), method='GET',
-                     headers=self.__get_headers(path),
-                     url_username=self.config.get('tpm_username', None),
-                     url_password=self.config.get('tpm_password', None),
-                     force_basic_auth='tpm_username' in self.config,
-                     validate_certs=self.config.get('tpm_ssl_verify'),
-                     )
-
-        if r.status == 200:
             try:
-                next_page_link = r.getHeader('Link', default=None)
-                if next_page_link:
-                    matcher = re.search('<https://.+/index.php/(.+)>; rel="next"', next_page_link)
-                    next_page = self._http_get(matcher.group(1))
+                r = self.__get_pool().request(
+                    method, '{prefix}/index.php/{path}'.format(prefix=prefix, path=path),
+                    body=payload,
+                    headers=headers,
+                    metrics=metrics,
+                )
+            except Exception as e:
+                metrics.record()
+                if breaker is not None:
+                    breaker.failure()
+                raise OpenUrlError('Failed to {m} {p}: {e}'.format(m=method, p=path, e=e))
+
+            if limiter is not None:
+                limiter.feedback(r.status, retry_after=retry_after(r))
+
+            delay = self._retry_delay(method, r, attempt)
+            if delay is None:
+                break
+
+            attempt += 1
+            metrics.retries += 1
+            with metrics.timer('throttle'):
+                time.sleep(delay)
+
+        if breaker is not None:
+            if r.status >= 500:
+                breaker.failure()
+            else:
+                breaker.success()
+
+        return self._decoded(r, metrics, decode=decode)
+
+    def _broker_request(self, method, path, body = None, page = None, decode = True):
+        """Send a request through the broker daemon shared by the forks (see broker.py)
+
+        Retries, rate limit and circuit breaker are applied by the broker,
+        the exchange with it is timed as a whole (wait).
+        """
+        metrics = TpmRequestMetrics(method, path, page=page)
+        try:
+            with metrics.timer('wait'):
+                r = broker_request(self.config.get('tpm_broker'), self.config, method, path,
+                                   body=body, page=page, upstream=TpmApiBase)
+        except CircuitOpenError:
+            metrics.record()
+            raise
+        except Exception as e:
+            metrics.record()
+            raise OpenUrlError('Failed to {m} {p}: {e}'.format(m=method, p=path, e=e))
 
-                return json.load(r) + next_page if next_page else json.load(r)
+        metrics.status = r.status
+        metrics.bytes_received = len(r.body)
+        return self._decoded(r, metrics, decode=decode)
 
-            except Exception:
-                return json.loads(r)
+    def _decoded(self, r, metrics, decode = True):
+        """Return the response once its JSON body is decoded and its metrics recorded"""
+        if decode and r.body:
+            with metrics.timer('decode'):
+                try:
+                    r.json()
+                except ValueError:
+                    pass
 
-        raise OpenUrlError('HTTP {s} - Failed to GET data'.format(s=r.status))
+        metrics.record()
+        return r
+
+    @staticmethod
+    def _next_page(r):
+        """Return the path of the page following the given GET response, if any"""
+        if r.status != 200:
+            raise OpenUrlError('HTTP {s} - Failed to GET data'.format(s=r.status))
+
+        matcher = NEXT_PAGE_LINK.search(r.getheader('Link') or '')
+        return matcher.group(1) if matcher else None
+
+    def _http_responses(self, path, decode = True):
+        """Yield the responses of a GET request, following 'Link: rel="next"' headers
+
+        A page is only requested once the previous one has been consumed.
+        """
+        page = 1
+        while path:
+            r = self._http_request('GET', path, page=page, decode=decode)
+            path = self._next_page(r)
+            page += 1
+
+            yield r
+
+    def _http_pages(self, path):
+        """Yield the decoded pages of a GET request"""
+        for r in self._http_responses(path):
+            yield r.json()
+
+    def _http_iter(self, path, fields = None):
+        """Yield the items of a paginated GET request, projected on `fields` if given
+
+        Items are decoded one at a time from the page body (see jsonstream.py):
+        only the raw body of the current page and the items kept by the caller
+        are held in memory.
+        """
+        for r in self._http_responses(path, decode=False):
+            for item in iter_array(r.body.decode('utf-8'), fields=fields):
+                yield item
+
+    def _negative_cache(self, kind, query_str):
+        """Return the negative cache of the TPM host and the digest of the given search in it"""
+        misses = get_negative_cache(self.config.get('tpm_hostname'), ttl=self.config.get('tpm_negative_cache_ttl', 10))
+        return misses, misses.digest(self.config.get('tpm_public_key') or self.config.get('tpm_username') or '',
+                                     kind, query_str)
+
+    def _search_iter(self, kind, query_str, fields = None):
+        """Yield the items of a TPM search of passwords or projects, projected on `fields` if given
+
+        A search matching nothing is remembered by every process of the
+        controller for tpm_negative_cache_ttl seconds, keyed by auth identity
+        and normalized query, until a write it could match (see
+        negative_cache.py).
+        """
+        misses, digest = self._negative_cache(kind, query_str)
+        if misses.ttl > 0 and misses.hit(digest):
+            return
+
+        since = time.time()
+        found = False
+        for item in self._http_iter(
+            path='api/v4/{k}/search/{q}.json'.format(k=kind, q=quote(query_str.encode('utf-8'))),
+            fields=fields,
+        ):
+            found = True
+            yield item
+
+        if not found:
+            misses.add(digest, kind, since=since)
+
+    def _http_get(self, path):
+        pages = self._http_pages(path)
+        data = next(pages)
+
+        if isinstance(data, list):
+            for page in pages:
+                data.extend(page)
+
+        return data
 
     def _http_post(self, path, body = None):
-        r = open_url(self.__get_url(path), method='POST',
-                     headers=self.__get_headers(path, data=body),
-                     data=body,
-                     url_username=self.config.get('tpm_username', None),
-                     url_password=self.config.get('tpm_password', None),
-                     force_basic_auth='tpm_username' in self.config,
-                     validate_certs=self.config.get('tpm_ssl_verify'),
-                     )
+        r = self._http_request('POST', path, body=body)
 
         if r.status == 201:
-            return json.load(r)
+            return r.json()
 
         raise OpenUrlError('HTTP {s} - Failed to POST data'.format(s=r.status))
 
     def _http_put(self, path, body = None):
-        r = open_url(self.__get_url(path), method='PUT',
-                     headers=self.__get_headers(path, data=body),
-                     data=body,
-                     url_username=self.config.get('tpm_username', None),
-                     url_password=self.config.get('tpm_password', None),
-                     force_basic_auth='tpm_username' in self.config,
-                     validate_certs=self.config.get('tpm_ssl_verify'),
-                     )
+        r = self._http_request('PUT', path, body=body)
 
         if r.status == 204:
             return {}
@@ -163,59 +406,213 @@ class TpmApiBase():
         raise OpenUrlError('HTTP {s} - Failed to PUT data'.format(s=r.status))
 
     def _http_delete(self, path):
-        r = open_url(self.__get_url(path), method='DELETE',
-                     headers=self.__get_headers(path),
-                     url_username=self.config.get('tpm_username', None),
-                     url_password=self.config.get('tpm_password', None),
-                     force_basic_auth='tpm_username' in self.config,
-                     validate_certs=self.config.get('tpm_ssl_verify'),
-                     )
+        r = self._http_request('DELETE', path)
 
         if r.status == 204:
             return {}
 
         raise OpenUrlError('HTTP {s} - Failed to DELETE data'.format(s=r.status))
 
+    def _as_entry(self, data):
+        """Return the submitted payload shaped like an entry read from TPM"""
+        return dict((k, v) for k, v in data.items() if v is not None)
+
+    def _current(self, entry):
+        """Return the comparable fields of an entry, normalized for diff"""
+        return dict(
+            name=entry.get('name'),
+            tags=set(t for t in (entry.get('tags') or '').split(',') if t),
+            notes=entry.get('notes'),
+        )
+
+    def diff(self, entry, **data):
+        """Return the fields of data that an update would change on the entry
+
+        None values leave a field untouched. Tags are added to the existing
+        ones, so only tags missing from the entry make a difference. Fields
+        that can not be updated are ignored.
+        """
+        current = self._current(entry)
+        changes = {}
+
+        for k, v in data.items():
+            if v is None or k not in current:
+                continue
+            if k == 'tags':
+                missing = set(t for t in v if t) - current['tags']
+                if missing:
+                    changes[k] = sorted(missing)
+            elif (v or '') != (current[k] or ''):
+                changes[k] = v
+
+        return changes
+
+    def _written(self, id, data, entry = None):
+        """Return the entry written with the given payload, as selected by tpm_return_mode
+
+        full: read back from TPM (one more request)
+        merged: the entry read before the write (if any), merged with the payload
+        id: only the id
+        """
+        mode = self.config.get('tpm_return_mode', 'full')
+        if mode == 'id':
+            return {'id': id}
+        if mode == 'merged':
+            return dict_merge(entry or {}, dict(self._as_entry(data), id=id))
+        return self.getById(id)
+
 
 class TpmPasswordApi(TpmApiBase):
     """TPM Password API implementation"""
 
+    FIELDS = ('access_info', 'username', 'email', 'expiry_date', 'notes') + tuple(
+        'custom_data{i}'.format(i=i) for i in range(1, 11))
+
+    @staticmethod
+    def _fields(**fields):
+        '''
+        Return the optional fields of a password, raise TypeError on unknown ones
+        '''
+        unknown = sorted(set(fields) - set(TpmPasswordApi.FIELDS))
+        if unknown:
+            raise TypeError('Unexpected password fields: {f}'.format(f=', '.join(unknown)))
+        return fields
+
+    def _create_payload(self, project_id, name, tags = None, password = None, **fields):
+        '''
+        Return the body of a password creation
+        '''
+        data = dict(project_id=project_id, name=name, tags=','.join(tags or []), password=password)
+        for k in TpmPasswordApi.FIELDS:
+            data[k] = fields.get(k)
+
+        # expiry_date is not sent on creation
+        data.pop('expiry_date')
+        return data
+
+    def _update_payload(self, entry, name = None, tags = None, password = None, **fields):
+        '''
+        Return the body of a password update, unset fields keep the value of the entry
+        The password is only sent when given: TPM keeps the current one otherwise
+        '''
+        data = dict(
+            name=name or entry.get('name'),
+            tags=','.join(set(entry.get('tags').split(',') + (tags or []))),
+        )
+        if password is not None:
+            data['password'] = password
+        for k in TpmPasswordApi.FIELDS:
+            if k.startswith('custom_data'):
+                current = entry.get(k.replace('custom_data', 'custom_field'), dict(data=None))['data']
+            else:
+                current = entry.get(k)
+            data[k] = fields.get(k) or current
+        return data
+
+    def _as_entry(self, data):
+        entry = TpmApiBase._as_entry(self, data)
+        if 'project_id' in entry:
+            entry['project'] = {'id': entry.pop('project_id')}
+        for i in range(1, 11):
+            if 'custom_data{i}'.format(i=i) in entry:
+                entry['custom_field{i}'.format(i=i)] = {'data': entry.pop('custom_data{i}'.format(i=i))}
+        return entry
+
+    def _current(self, entry):
+        current = TpmApiBase._current(self, entry)
+        for k in ('access_info', 'username', 'email', 'password', 'expiry_date'):
+            current[k] = entry.get(k)
+        for i in range(1, 11):
+            current['custom_data{i}'.format(i=i)] = (entry.get('custom_field{i}'.format(i=i)) or {}).get('data')
+        return current
+
+    def snapshot(self):
+        '''
+        Return the local snapshot of passwords configured with tpm_snapshot, if any
+        '''
+        if not self.config.get('tpm_snapshot'):
+            return None
+        return get_snapshot(self)
+
     def getById(self, id = 0):
         '''
         Return data found from TPM for the given ID
+        Served from the snapshot when configured and holding it
         '''
         try:
+            snapshot = self.snapshot()
+            entry = snapshot.get(id) if snapshot is not None else None
+            if entry is not None:
+                return entry
+
             return self._http_get(path='api/v4/passwords/{id}.json'.format(id=id))
         except Exception as e:
             raise GetError(e)
 
-    def find(self, query_str = ''):
+    def find(self, query_str = '', fields = None):
         '''
         Return data found from TPM for the given query string
         '''
+        return list(self.findIter(query_str, fields=fields))
+
+    def findIter(self, query_str = '', fields = None):
+        '''
+        Yield data found from TPM for the given query string, page by page
+        Items are reduced to the given fields, if any, as they are decoded
+        Evaluated offline when a snapshot is configured, unless the query uses
+        a search field the snapshot does not support
+        '''
         try:
-            return self._http_get(
-                path='api/v4/passwords/search/{q}.json'.format(
-                    q=quote(query_str.encode('utf-8'))),
-            )
+            snapshot = self.snapshot()
+            try:
+                items = snapshot.search(query_str) if snapshot is not None else None
+            except QueryError:
+                items = None
+
+            if items is None:
+                items = self._search_iter('passwords', query_str, fields=fields)
+            elif fields is not None:
+                items = (project(item, fields) for item in items)
+
+            for item in items:
+                yield item
         except Exception as e:
             raise FindError(e)
 
     def findFirst(self, query_str = '', default=None):
         '''
-        Return first find result
+        Return first find result, only the first page is fetched
         '''
-        return next((i for i in self.find(query_str)), default)
+        return next(self.findIter(query_str), default)
 
     def generate(self):
         '''
-        Return new generated password from TPM
+        Return new generated password
+
+        With tpm_generator=local, the password is generated locally following
+        tpm_password_policy. Otherwise it comes from the TPM generator, through
+        a pool refilled by batches of tpm_generator_batch concurrent requests.
         '''
         try:
-            return self._http_get(path='api/v4/generate_password.json')
+            if self.config.get('tpm_generator') == 'local':
+                return {'password': generate_password(self.config.get('tpm_password_policy'))}
+
+            return {'password': self.passwordPool().pop()}
         except Exception as e:
             raise GenerateError(e)
 
+    def passwordPool(self):
+        '''
+        Return the pool of passwords generated ahead of time by TPM
+        '''
+        return get_password_pool(
+            (self.config.get('tpm_hostname'),
+             self.config.get('tpm_public_key') or self.config.get('tpm_username')),
+            lambda: self._http_get(path='api/v4/generate_password.json')['password'],
+            batch_size=self.config.get('tpm_generator_batch', 1),
+            workers=self.config.get('tpm_pool_size', 4),
+        )
+
     def create(self, project_name, name,
                tags = None,
                access_info = None,
@@ -238,29 +635,19 @@ class TpmPasswordApi(TpmApiBase):
         '''
         Return newly created password
         '''
-        project_api = TpmProjectApi()
-        project = project_api.findFirst(project_name)
-
-        data = dict(
-            project_id=project.id,
+        data = self._create_payload(
+            project_id=self.projectId(project_name),
             name=name,
-            tags=','.join(tags),
-            access_info=access_info,
-            username=username,
-            email=email,
+            tags=tags,
             password=password or self.generate()['password'],
-            # expiry_date=expiry_date,
-            notes=notes,
-            custom_data1=custom_data1,
-            custom_data2=custom_data2,
-            custom_data3=custom_data3,
-            custom_data4=custom_data4,
-            custom_data5=custom_data5,
-            custom_data6=custom_data6,
-            custom_data7=custom_data7,
-            custom_data8=custom_data8,
-            custom_data9=custom_data9,
-            custom_data10=custom_data10,
+            **self._fields(
+                access_info=access_info, username=username, email=email,
+                expiry_date=expiry_date, notes=notes,
+                custom_data1=custom_data1, custom_data2=custom_data2,
+                custom_data3=custom_data3, custom_data4=custom_data4,
+                custom_data5=custom_data5, custom_data6=custom_data6,
+                custom_data7=custom_data7, custom_data8=custom_data8,
+                custom_data9=custom_data9, custom_data10=custom_data10)
         )
 
         try:
@@ -268,12 +655,15 @@ class TpmPasswordApi(TpmApiBase):
                 path='api/v4/passwords.json',
                 body=data
             )
-            return self.getById(r['id'])
+            invalidate_caches(self.config.get('tpm_hostname'))
+            forget_misses(self.config.get('tpm_hostname'), 'passwords')
+            return self._written(r['id'], data)
 
         except Exception as e:
             raise CreateError(e)
 
     def update(self, id, name,
+               project_name = None,
                tags = None,
                access_info = None,
                username = None,
@@ -291,53 +681,67 @@ class TpmPasswordApi(TpmApiBase):
                custom_data8 = None,
                custom_data9 = None,
                custom_data10 = None,
+               entry = None,
                ):
         '''
-        Return updated password
+        Return updated password, unchanged when no field differs
+        The project of an entry can not be changed, project_name is ignored
+        The password is only changed when given, it is never generated
+        The current entry is read from TPM unless given
         '''
-        entry = self.getById(id)
+        entry = entry or self.getById(id)
+        fields = self._fields(
+            access_info=access_info, username=username, email=email,
+            expiry_date=expiry_date, notes=notes,
+            custom_data1=custom_data1, custom_data2=custom_data2,
+            custom_data3=custom_data3, custom_data4=custom_data4,
+            custom_data5=custom_data5, custom_data6=custom_data6,
+            custom_data7=custom_data7, custom_data8=custom_data8,
+            custom_data9=custom_data9, custom_data10=custom_data10)
 
-        data = dict(
-            name=name or entry.get('name'),
-            tags=','.join(set(entry.get('tags').split(',') + tags)),
-            access_info=access_info or entry.get('access_info'),
-            username=username or entry.get('username'),
-            email=email or entry.get('email'),
-            password=password or self.generate().get('password'),
-            expiry_date=expiry_date or entry.get('expiry_date'),
-            notes=notes or entry.get('notes'),
-            custom_data1=custom_data1 or entry.get(
-                'custom_field1', dict(data=None))['data'],
-            custom_data2=custom_data2 or entry.get(
-                'custom_field2', dict(data=None))['data'],
-            custom_data3=custom_data3 or entry.get(
-                'custom_field3', dict(data=None))['data'],
-            custom_data4=custom_data4 or entry.get(
-                'custom_field4', dict(data=None))['data'],
-            custom_data5=custom_data5 or entry.get(
-                'custom_field5', dict(data=None))['data'],
-            custom_data6=custom_data6 or entry.get(
-                'custom_field6', dict(data=None))['data'],
-            custom_data7=custom_data7 or entry.get(
-                'custom_field7', dict(data=None))['data'],
-            custom_data8=custom_data8 or entry.get(
-                'custom_field8', dict(data=None))['data'],
-            custom_data9=custom_data9 or entry.get(
-                'custom_field9', dict(data=None))['data'],
-            custom_data10=custom_data10 or entry.get(
-                'custom_field10', dict(data=None))['data'],
-        )
+        if not self.diff(entry, name=name, tags=tags or [], password=password, **fields):
+            return entry
+
+        data = self._update_payload(entry, name=name, tags=tags, password=password, **fields)
 
         try:
             self._http_put(
                 path='api/v4/passwords/{id}.json'.format(id=id),
                 body=data
             )
-            return self.getById(id)
+            invalidate_caches(self.config.get('tpm_hostname'))
+            forget_misses(self.config.get('tpm_hostname'), 'passwords')
+            return self._written(id, data, entry)
 
         except Exception as e:
             raise UpdateError(e)
 
+    def delete(self, id):
+        '''
+        Delete specified password
+        '''
+        try:
+            self._http_delete(
+                path='api/v4/passwords/{id}.json'.format(id=id)
+            )
+            invalidate_caches(self.config.get('tpm_hostname'))
+            return "Successfully deleted password"
+
+        except Exception as e:
+            raise DeleteError(e)
+
+    def projectResolver(self):
+        '''
+        Return the project name to id resolver, configured like this instance
+        '''
+        return TpmProjectResolver(TpmProjectApi(self.config))
+
+    def projectId(self, project_name):
+        '''
+        Return the id of the named project, resolved once per process
+        '''
+        return self.projectResolver().resolve(project_name)
+
 
 class TpmProjectApi(TpmApiBase):
     """TPM Project API implementation"""
@@ -351,23 +755,63 @@ class TpmProjectApi(TpmApiBase):
         except Exception as e:
             raise GetError(e)
 
-    def find(self, query_str=''):
+    def find(self, query_str='', fields=None):
         '''
         Return data found from TPM for the given query string
         '''
+        return list(self.findIter(query_str, fields=fields))
+
+    def findIter(self, query_str='', fields=None):
+        '''
+        Yield data found from TPM for the given query string, page by page
+        Items are reduced to the given fields, if any, as they are decoded
+        '''
         try:
-            return self._http_get(
-                path='api/v4/projects/search/{q}.json'.format(
-                    q=quote(query_str.encode('utf-8')))
-            )
+            for item in self._search_iter('projects', query_str, fields=fields):
+                yield item
         except Exception as e:
             raise FindError(e)
 
     def findFirst(self, query_str='', default=None):
         '''
-        Return first find result
+        Return first find result, only the first page is fetched
+        '''
+        return next(self.findIter(query_str), default)
+
+    def listIter(self, fields=None):
+        '''
+        Yield every project, page by page
+        '''
+        try:
+            for item in self._http_iter(path='api/v4/projects.json', fields=fields):
+                yield item
+        except Exception as e:
+            raise FindError(e)
+
+    def projectTree(self, outdated=None):
+        '''
+        Return the project tree index, listed once per process (see TpmProjectResolver)
+        '''
+        return TpmProjectResolver(self).tree(outdated=outdated)
+
+    def getByPath(self, path):
+        '''
+        Return the project with the given path (parent/child) or name, its path included
+        '''
+        resolver = TpmProjectResolver(self)
+        id = resolver.resolve(path)
+        return resolver.tree().get(id)
+
+    def findChild(self, name, parent_id=0):
         '''
-        return next((i for i in self.find(query_str)), default)
+        Return the project with the given name under the given parent (the root for 0), None if none
+        The projects are listed again when it is missing from the project tree
+        '''
+        tree = self.projectTree()
+        project = tree.child(parent_id, name)
+        if project is None:
+            project = self.projectTree(outdated=tree).child(parent_id, name)
+        return project
 
     def create(self, name, parent_id, tags = None, notes = None):
         '''
@@ -386,17 +830,25 @@ class TpmProjectApi(TpmApiBase):
                 path='api/v4/projects.json',
                 body=data
             )
-            return self.getById(r['id'])
+            invalidate_caches(self.config.get('tpm_hostname'))
+            forget_misses(self.config.get('tpm_hostname'), 'projects')
+            TpmProjectResolver.invalidate(self.config.get('tpm_hostname'))
+            return self._written(r['id'], data)
 
         except Exception as e:
             raise CreateError(e)
 
-    def update(self, id, name, tags = None, notes = None):
+    def update(self, id, name, parent_id = None, tags = None, notes = None, entry = None):
         '''
-        Return updated project
+        Return updated project, unchanged when no field differs
+        The parent of a project can not be changed, parent_id is ignored
+        The current entry is read from TPM unless given
         '''
         tags = tags or []
-        entry = self.getById(id)
+        entry = entry or self.getById(id)
+
+        if not self.diff(entry, name=name, tags=tags, notes=notes):
+            return entry
 
         data = dict(
             name=name,
@@ -405,11 +857,14 @@ class TpmProjectApi(TpmApiBase):
         )
 
         try:
-            r = self._http_put(
+            self._http_put(
                 path='api/v4/projects/{id}.json'.format(id=id),
                 body=data
             )
-            return self.getById(r['id'])
+            invalidate_caches(self.config.get('tpm_hostname'))
+            forget_misses(self.config.get('tpm_hostname'), 'projects')
+            TpmProjectResolver.invalidate(self.config.get('tpm_hostname'))
+            return self._written(id, data, entry)
 
         except Exception as e:
             raise CreateError(e)
@@ -422,7 +877,74 @@ class TpmProjectApi(TpmApiBase):
             self._http_delete(
                 path='api/v4/projects/{id}.json'.format(id=id)
             )
+            invalidate_caches(self.config.get('tpm_hostname'))
+            TpmProjectResolver.invalidate(self.config.get('tpm_hostname'))
             return "Successfully deleted project"
 
         except Exception as e:
             raise DeleteError(e)
+
+
+class TpmProjectResolver():
+    """Project name or path to id resolver, memoized for the life of the process
+
+    Names are resolved from a project tree index (see project_tree.py),
+    built from a single project listing and shared by every resolver of the
+    same TPM host and auth identity. It is dropped whenever a project is
+    created, updated or deleted, and rebuilt once when a name is missing
+    from it (project created by another process).
+    """
+
+    _trees = {}
+    _lock = threading.Lock()
+
+    def __init__(self, api):
+        self.api = api
+        self.key = (api.config.get('tpm_hostname'),
+                    api.config.get('tpm_public_key') or api.config.get('tpm_username'))
+
+    @classmethod
+    def invalidate(cls, hostname=None):
+        with cls._lock:
+            for key in [k for k in cls._trees if hostname is None or k[0] == hostname]:
+                del cls._trees[key]
+
+    def cached(self):
+        '''
+        Return the project tree shared by the resolvers of this host and identity, None if not built yet
+        '''
+        with TpmProjectResolver._lock:
+            return TpmProjectResolver._trees.get(self.key)
+
+    def store(self, tree):
+        with TpmProjectResolver._lock:
+            TpmProjectResolver._trees[self.key] = tree
+        return tree
+
+    def tree(self, outdated=None):
+        '''
+        Return the project tree, listed from TPM when not built yet or when it is the outdated one
+        '''
+        tree = self.cached()
+        if tree is None or tree is outdated:
+            tree = self.store(TpmProjectTree(self.api.listIter()))
+        return tree
+
+    def resolve(self, name):
+        '''
+        Return the id of the project with the given path or name
+        '''
+        tree = self.tree()
+        if name not in tree:
+            tree = self.tree(outdated=tree)
+
+        try:
+            return tree.resolve(name)
+        except (ProjectNotFoundError, AmbiguousProjectError) as e:
+            raise FindError(e)
+
+    def resolve_many(self, names):
+        '''
+        Return a dict name -> id, from a single project listing
+        '''
+        return dict((name, self.resolve(name)) for name in names)
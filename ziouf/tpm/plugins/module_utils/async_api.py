@@ -0,0 +1,648 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+# asyncio client of the TPM API, for controller side tooling only (Python 3.6+):
+#
+#   async with TpmAsyncPasswordApi(config, concurrency=32) as api:
+#       entries = await asyncio.gather(*[api.getById(id) for id in ids])
+
+import ssl
+import json
+import time
+import codecs
+import asyncio
+import functools
+
+try:
+    from urllib import quote        # Python 2.x
+except ImportError:
+    from urllib.parse import quote  # Python 3+
+
+from .api import (
+    CreateError,
+    DeleteError,
+    FindError,
+    GenerateError,
+    GetError,
+    OpenUrlError,
+    TpmApiBase,
+    TpmPasswordApi,
+    TpmProjectApi,
+    TpmProjectResolver,
+    UpdateError,
+)
+from .cache import invalidate_caches
+from .connection import TpmResponse
+from .generator import generate_password
+from .jsonstream import iter_array, project
+from .metrics import TpmRequestMetrics
+from .negative_cache import forget_misses
+from .project_tree import AmbiguousProjectError, ProjectNotFoundError, TpmProjectTree
+from .snapshot import QueryError
+from .throttle import IDEMPOTENT_METHODS, retry_after
+
+
+async def read_response(reader, method='GET'):
+    """Return a tuple (TpmResponse, keep_alive) read from an HTTP/1.1 stream
+
+    The body is delimited by Content-Length, chunked transfer encoding or
+    the end of the stream.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError('Connection closed by server')
+
+    version, status = codecs.decode(status_line, 'latin-1').split(None, 2)[:2]
+    status = int(status)
+
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = codecs.decode(line, 'latin-1').split(':', 1)
+        headers.append((name.strip(), value.strip()))
+
+    response = TpmResponse(status, headers, b'')
+    keep_alive = version == 'HTTP/1.1' and (response.getheader('Connection') or '').lower() != 'close'
+
+    if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+        return response, keep_alive
+
+    if 'chunked' in (response.getheader('Transfer-Encoding') or '').lower():
+        chunks = []
+        while True:
+            size = int(codecs.decode(await reader.readline(), 'latin-1').split(';', 1)[0].strip(), 16)
+            if size == 0:
+                # Skip trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        response.body = b''.join(chunks)
+
+    elif response.getheader('Content-Length') is not None:
+        response.body = await reader.readexactly(int(response.getheader('Content-Length')))
+
+    else:
+        response.body = await reader.read()
+        keep_alive = False
+
+    return response, keep_alive
+
+
+class TpmAsyncConnectionPool():
+    """asyncio HTTP/1.1 keep-alive connections to a single host
+
+    At most `concurrency` requests are in flight at once, and as many idle
+    connections are kept for reuse. A request failing on a reused connection
+    (closed by the server meanwhile) is replayed on a new one, when it is
+    idempotent or failed before it was fully sent.
+    """
+
+    def __init__(self, host, port=None, ssl_verify=True, timeout=10, concurrency=16):
+        self.host = host
+        self.port = port or 443
+        self.ssl_verify = ssl_verify
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+        self._idle = []
+        self._semaphore = None
+
+    def _ssl_context(self):
+        context = ssl.create_default_context()
+        if not self.ssl_verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    async def _acquire(self):
+        """Return a tuple (reader, writer, reused)"""
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self._ssl_context())
+        return reader, writer, False
+
+    def _release(self, reader, writer, keep_alive):
+        if keep_alive and len(self._idle) < self.concurrency:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _send(self, writer, method, url, body, headers):
+        host = self.host if self.port == 443 else '{h}:{p}'.format(h=self.host, p=self.port)
+        lines = ['{m} {u} HTTP/1.1'.format(m=method, u=url), 'Host: {h}'.format(h=host),
+                 'Content-Length: {l}'.format(l=len(body or b''))]
+        lines += ['{k}: {v}'.format(k=k, v=v) for k, v in headers.items()]
+
+        writer.write(codecs.encode('\r\n'.join(lines) + '\r\n\r\n', 'latin-1') + (body or b''))
+        await writer.drain()
+
+    async def request(self, method, url, body=None, headers=None):
+        """Send a request and return the fully read TpmResponse"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        loop = asyncio.get_event_loop()
+        async with self._semaphore:
+            while True:
+                reader, writer, reused = await asyncio.wait_for(self._acquire(), self.timeout)
+                deadline = loop.time() + self.timeout
+                sent = False
+                try:
+                    await asyncio.wait_for(self._send(writer, method, url, body, headers or {}), self.timeout)
+                    sent = True
+                    response, keep_alive = await asyncio.wait_for(
+                        read_response(reader, method), max(deadline - loop.time(), 0))
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    # A POST the server may have received is never sent twice
+                    if reused and (method in IDEMPOTENT_METHODS or not sent):
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+
+                self._release(reader, writer, keep_alive)
+                return response
+
+    async def close(self):
+        while self._idle:
+            dummy, writer = self._idle.pop()
+            writer.close()
+
+
+class TpmAsyncApiBase():
+    """Base class for asyncio REST queries to TPM
+
+    Requests are signed and paginated like TpmApiBase does, on a connection
+    pool owned by the instance: close it (or use `async with`) once done.
+    Signatures, payloads and settings are those of a sync API of the
+    SYNC_API class, composed rather than inherited: none of its methods
+    sending requests can be called by mistake without being awaited.
+    Shared state, caches and negative cache are flock'd files, they are
+    read and written in the default executor, off the event loop.
+    """
+
+    SYNC_API = TpmApiBase
+
+    def __init__(self, config = None, concurrency = 16):
+        self._sync = self.SYNC_API(config)
+        self.config = self._sync.config
+        self.concurrency = concurrency
+        self._pool = None
+
+    @staticmethod
+    async def _blocking(fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), run in the default executor"""
+        return await asyncio.get_event_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    def __get_pool(self):
+        if self._pool is None:
+            hostname, port, dummy = self._sync._location()
+            self._pool = TpmAsyncConnectionPool(hostname, port,
+                                                ssl_verify=self.config.get('tpm_ssl_verify', True),
+                                                timeout=self.config.get('tpm_timeout', 10),
+                                                concurrency=self.concurrency)
+        return self._pool
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _http_request(self, method, path, body = None, page = None, decode = True):
+        """Send a request to TPM on a pooled keep-alive connection
+
+        Retried, rate limited, guarded by the circuit breaker, decoded, then
+        recorded, like TpmApiBase requests are. The exchange on the connection is timed as a whole (wait).
+        """
+        dummy, dummy, prefix = self._sync._location()
+        metrics = TpmRequestMetrics(method, path, page=page)
+        limiter = self._sync._rate_limiter()
+        breaker = self._sync._circuit_breaker()
+        payload = codecs.encode(json.dumps(body)) if body else None
+
+        attempt = 0
+        while True:
+            if breaker is not None:
+                await self._blocking(breaker.allow)
+            if limiter is not None:
+                with metrics.timer('throttle'):
+                    await asyncio.sleep(await self._blocking(limiter.reserve))
+
+            with metrics.timer('sign'):
+                headers = self._sync._request_headers(path, body=body)
+
+            try:
+                with metrics.timer('wait'):
+                    r = await self.__get_pool().request(
+                        method, '{prefix}/index.php/{path}'.format(prefix=prefix, path=path),
+                        body=payload,
+                        headers=headers,
+                    )
+            except Exception as e:
+                metrics.record()
+                if breaker is not None:
+                    await self._blocking(breaker.failure)
+                raise OpenUrlError('Failed to {m} {p}: {e}'.format(m=method, p=path, e=e))
+
+            metrics.status = r.status
+            metrics.bytes_sent += len(payload or b'')
+            metrics.bytes_received += len(r.body)
+            if limiter is not None:
+                await self._blocking(limiter.feedback, r.status, retry_after=retry_after(r))
+
+            delay = self._sync._retry_delay(method, r, attempt)
+            if delay is None:
+                break
+
+            attempt += 1
+            metrics.retries += 1
+            with metrics.timer('throttle'):
+                await asyncio.sleep(delay)
+
+        if breaker is not None:
+            if r.status >= 500:
+                await self._blocking(breaker.failure)
+            else:
+                await self._blocking(breaker.success)
+
+        return self._sync._decoded(r, metrics, decode=decode)
+
+    async def _http_responses(self, path, decode = True):
+        """Yield the responses of a GET request, following 'Link: rel="next"' headers"""
+        page = 1
+        while path:
+            r = await self._http_request('GET', path, page=page, decode=decode)
+            path = TpmApiBase._next_page(r)
+            page += 1
+
+            yield r
+
+    async def _http_pages(self, path):
+        async for r in self._http_responses(path):
+            yield r.json()
+
+    async def _http_iter(self, path, fields = None):
+        async for r in self._http_responses(path, decode=False):
+            for item in iter_array(r.body.decode('utf-8'), fields=fields):
+                yield item
+
+    async def _search_iter(self, kind, query_str, fields = None):
+        """Yield the items of a TPM search of passwords or projects, like TpmApiBase._search_iter"""
+        misses, digest = self._sync._negative_cache(kind, query_str)
+        if misses.ttl > 0 and await self._blocking(misses.hit, digest):
+            return
+
+        since = time.time()
+        found = False
+        async for item in self._http_iter(
+            path='api/v4/{k}/search/{q}.json'.format(k=kind, q=quote(query_str.encode('utf-8'))),
+            fields=fields,
+        ):
+            found = True
+            yield item
+
+        if not found:
+            await self._blocking(misses.add, digest, kind, since=since)
+
+    async def _http_get(self, path):
+        data = None
+        async for page in self._http_pages(path):
+            if data is None:
+                data = page
+            elif isinstance(data, list):
+                data.extend(page)
+        return data
+
+    async def _http_post(self, path, body = None):
+        r = await self._http_request('POST', path, body=body)
+
+        if r.status == 201:
+            return r.json()
+
+        raise OpenUrlError('HTTP {s} - Failed to POST data'.format(s=r.status))
+
+    async def _http_put(self, path, body = None):
+        r = await self._http_request('PUT', path, body=body)
+
+        if r.status == 204:
+            return {}
+
+        raise OpenUrlError('HTTP {s} - Failed to PUT data'.format(s=r.status))
+
+    async def _http_delete(self, path):
+        r = await self._http_request('DELETE', path)
+
+        if r.status == 204:
+            return {}
+
+        raise OpenUrlError('HTTP {s} - Failed to DELETE data'.format(s=r.status))
+
+    async def _written(self, id, data, entry = None):
+        if self.config.get('tpm_return_mode', 'full') == 'full':
+            return await self.getById(id)
+        return self._sync._written(id, data, entry)
+
+
+class TpmAsyncPasswordApi(TpmAsyncApiBase):
+    """TPM Password API implementation, asyncio flavour
+
+    Same requests as TpmPasswordApi, every method is a coroutine (findIter is
+    an async generator). Password fields are given as keyword arguments.
+    Helpers of the sync API (passwordPool, projectResolver...) are not provided.
+    """
+
+    SYNC_API = TpmPasswordApi
+
+    def __init__(self, config = None, concurrency = 16):
+        TpmAsyncApiBase.__init__(self, config, concurrency)
+        self._project_lock = None
+
+    async def getById(self, id = 0):
+        '''
+        Return data found from TPM for the given ID
+        '''
+        try:
+            return await self._http_get(path='api/v4/passwords/{id}.json'.format(id=id))
+        except Exception as e:
+            raise GetError(e)
+
+    async def find(self, query_str = '', fields = None):
+        '''
+        Return data found from TPM for the given query string
+        '''
+        return [item async for item in self.findIter(query_str, fields=fields)]
+
+    async def findIter(self, query_str = '', fields = None):
+        '''
+        Yield data found from TPM for the given query string, page by page
+        Items are reduced to the given fields, if any, as they are decoded
+        Evaluated offline when a snapshot is configured, like TpmPasswordApi.findIter
+        '''
+        try:
+            snapshot = await self._blocking(self._sync.snapshot)
+            try:
+                items = snapshot.search(query_str) if snapshot is not None else None
+            except QueryError:
+                items = None
+
+            if items is not None:
+                for item in items:
+                    yield project(item, fields) if fields is not None else item
+                return
+
+            async for item in self._search_iter('passwords', query_str, fields=fields):
+                yield item
+        except Exception as e:
+            raise FindError(e)
+
+    async def findFirst(self, query_str = '', default=None):
+        '''
+        Return first find result, only the first page is fetched
+        '''
+        async for item in self.findIter(query_str):
+            return item
+        return default
+
+    async def generate(self):
+        '''
+        Return new generated password, locally with tpm_generator=local
+        '''
+        try:
+            if self.config.get('tpm_generator') == 'local':
+                return {'password': generate_password(self.config.get('tpm_password_policy'))}
+
+            return {'password': (await self._http_get(path='api/v4/generate_password.json'))['password']}
+        except Exception as e:
+            raise GenerateError(e)
+
+    async def projectId(self, project_name):
+        '''
+        Return the id of the project with the given path or name, resolved
+        from the project tree shared with TpmProjectResolver
+        '''
+        resolver = TpmProjectResolver(self)
+        tree = resolver.cached()
+        if tree is None or project_name not in tree:
+            if self._project_lock is None:
+                self._project_lock = asyncio.Lock()
+
+            # Concurrent creations list the projects only once
+            async with self._project_lock:
+                current = resolver.cached()
+                if current is None or current is tree:
+                    current = resolver.store(TpmProjectTree(
+                        [p async for p in self._http_iter(path='api/v4/projects.json')]))
+                tree = current
+
+        try:
+            return tree.resolve(project_name)
+        except (ProjectNotFoundError, AmbiguousProjectError) as e:
+            raise FindError(e)
+
+    async def create(self, project_name, name, tags = None, password = None, **fields):
+        '''
+        Return newly created password
+        '''
+        fields = TpmPasswordApi._fields(**fields)
+        data = self._sync._create_payload(
+            project_id=await self.projectId(project_name),
+            name=name,
+            tags=tags,
+            password=password or (await self.generate())['password'],
+            **fields
+        )
+
+        try:
+            r = await self._http_post(
+                path='api/v4/passwords.json',
+                body=data
+            )
+            await self._blocking(invalidate_caches, self.config.get('tpm_hostname'))
+            await self._blocking(forget_misses, self.config.get('tpm_hostname'), 'passwords')
+            return await self._written(r['id'], data)
+
+        except Exception as e:
+            raise CreateError(e)
+
+    async def update(self, id, name, project_name = None, tags = None, password = None,
+                     entry = None, **fields):
+        '''
+        Return updated password, unchanged when no field differs
+        The project of an entry can not be changed, project_name is ignored
+        The password is only changed when given, it is never generated
+        The current entry is read from TPM unless given
+        '''
+        entry = entry or await self.getById(id)
+        fields = TpmPasswordApi._fields(**fields)
+
+        if not self._sync.diff(entry, name=name, tags=tags or [], password=password, **fields):
+            return entry
+
+        data = self._sync._update_payload(entry, name=name, tags=tags, password=password, **fields)
+
+        try:
+            await self._http_put(
+                path='api/v4/passwords/{id}.json'.format(id=id),
+                body=data
+            )
+            await self._blocking(invalidate_caches, self.config.get('tpm_hostname'))
+            await self._blocking(forget_misses, self.config.get('tpm_hostname'), 'passwords')
+            return await self._written(id, data, entry)
+
+        except Exception as e:
+            raise UpdateError(e)
+
+    async def delete(self, id):
+        '''
+        Delete specified password
+        '''
+        try:
+            await self._http_delete(
+                path='api/v4/passwords/{id}.json'.format(id=id)
+            )
+            await self._blocking(invalidate_caches, self.config.get('tpm_hostname'))
+            return "Successfully deleted password"
+
+        except Exception as e:
+            raise DeleteError(e)
+
+
+class TpmAsyncProjectApi(TpmAsyncApiBase):
+    """TPM Project API implementation, asyncio flavour
+
+    Same requests as TpmProjectApi, every method is a coroutine (findIter and
+    listIter are async generators). Project tree helpers of the sync API
+    (projectTree, getByPath...) are not provided.
+    """
+
+    SYNC_API = TpmProjectApi
+
+    async def getById(self, id):
+        '''
+        Return data found from TPM for the given ID
+        '''
+        try:
+            return await self._http_get(path='api/v4/projects/{id}.json'.format(id=id))
+        except Exception as e:
+            raise GetError(e)
+
+    async def find(self, query_str='', fields=None):
+        '''
+        Return data found from TPM for the given query string
+        '''
+        return [item async for item in self.findIter(query_str, fields=fields)]
+
+    async def findIter(self, query_str='', fields=None):
+        '''
+        Yield data found from TPM for the given query string, page by page
+        Items are reduced to the given fields, if any, as they are decoded
+        '''
+        try:
+            async for item in self._search_iter('projects', query_str, fields=fields):
+                yield item
+        except Exception as e:
+            raise FindError(e)
+
+    async def findFirst(self, query_str='', default=None):
+        '''
+        Return first find result, only the first page is fetched
+        '''
+        async for item in self.findIter(query_str):
+            return item
+        return default
+
+    async def listIter(self, fields=None):
+        '''
+        Yield every project, page by page
+        '''
+        try:
+            async for item in self._http_iter(path='api/v4/projects.json', fields=fields):
+                yield item
+        except Exception as e:
+            raise FindError(e)
+
+    async def create(self, name, parent_id, tags = None, notes = None):
+        '''
+        Return newly created project
+        '''
+        data = dict(
+            name=name,
+            parent_id=parent_id,
+            tags=','.join(tags or []),
+            notes=notes,
+        )
+
+        try:
+            r = await self._http_post(
+                path='api/v4/projects.json',
+                body=data
+            )
+            await self._blocking(invalidate_caches, self.config.get('tpm_hostname'))
+            await self._blocking(forget_misses, self.config.get('tpm_hostname'), 'projects')
+            TpmProjectResolver.invalidate(self.config.get('tpm_hostname'))
+            return await self._written(r['id'], data)
+
+        except Exception as e:
+            raise CreateError(e)
+
+    async def update(self, id, name, parent_id = None, tags = None, notes = None, entry = None):
+        '''
+        Return updated project, unchanged when no field differs
+        The parent of a project can not be changed, parent_id is ignored
+        The current entry is read from TPM unless given
+        '''
+        tags = tags or []
+        entry = entry or await self.getById(id)
+
+        if not self._sync.diff(entry, name=name, tags=tags, notes=notes):
+            return entry
+
+        data = dict(
+            name=name,
+            tags=','.join(set(entry.get('tags', '').split(',') + tags)),
+            notes=notes or entry.get('notes')
+        )
+
+        try:
+            await self._http_put(
+                path='api/v4/projects/{id}.json'.format(id=id),
+                body=data
+            )
+            await self._blocking(invalidate_caches, self.config.get('tpm_hostname'))
+            await self._blocking(forget_misses, self.config.get('tpm_hostname'), 'projects')
+            TpmProjectResolver.invalidate(self.config.get('tpm_hostname'))
+            return await self._written(id, data, entry)
+
+        except Exception as e:
+            raise UpdateError(e)
+
+    async def delete(self, id):
+        '''
+        Delete specified project
+        '''
+        try:
+            await self._http_delete(
+                path='api/v4/projects/{id}.json'.format(id=id)
+            )
+            await self._blocking(invalidate_caches, self.config.get('tpm_hostname'))
+            TpmProjectResolver.invalidate(self.config.get('tpm_hostname'))
+            return "Successfully deleted project"
+
+        except Exception as e:
+            raise DeleteError(e)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import threading
+
+from ansible import constants as C
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.common.parameters import remove_values
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+
+from .metrics import set_context
+
+try:                                # ansible-core 2.19+
+    from ansible.module_utils.common.json import Direction, get_module_encoder
+    _PROFILE = 'legacy'
+    _ENCODER = get_module_encoder(_PROFILE, Direction.CONTROLLER_TO_MODULE)
+except ImportError:
+    from ansible.module_utils.common.json import AnsibleJSONEncoder as _ENCODER
+    _PROFILE = None
+
+# Running a module in-process relies on private AnsibleModule internals
+IN_PROCESS_SUPPORTED = hasattr(basic, '_ANSIBLE_ARGS') and (
+    hasattr(AnsibleModule, '_record_module_result') or hasattr(AnsibleModule, '_return_formatted'))
+
+
+class ModuleExit(Exception):
+    """Module returned its result (in-process run)"""
+
+
+class TpmInProcessModule():
+    """Mixin returning the result of a module instead of printing it and exiting"""
+
+    def _log_invocation(self):
+        # Nothing to log on the controller syslog: the task result is the log
+        pass
+
+    def _record_module_result(self, o):
+        raise ModuleExit(o)
+
+    def _return_formatted(self, kwargs):
+        if hasattr(AnsibleModule, '_record_module_result'):
+            return super(TpmInProcessModule, self)._return_formatted(kwargs)
+
+        # Older ansible-core prints the result from here
+        kwargs.setdefault('invocation', {'module_args': self.params})
+        raise ModuleExit(remove_values(kwargs, self.no_log_values))
+
+
+class TpmActionBase(ActionBase):
+    """Run a TPM module in-process on the controller
+
+    `module` is the python module of a TPM module: its TpmModule class is run
+    with the task arguments, within the worker process. Nothing is sent to the
+    target host, and TPM is reached through the controller connection pool.
+
+    The module is sent to the target host as usual instead when the
+    tpm_run_on_controller variable is false, when the task is delegated to
+    another host than the controller, or when this ansible-core release lacks
+    the AnsibleModule internals an in-process run relies on.
+    """
+
+    TRANSFERS_FILES = False
+    # The module itself tells whether it supports check mode
+    _supports_check_mode = True
+
+    module = None
+
+    # Module parameters are process wide globals of AnsibleModule
+    _lock = threading.Lock()
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(TpmActionBase, self).run(tmp, task_vars)
+        del tmp
+
+        if not self.in_process(task_vars or {}):
+            wrap_async = self._task.async_val and not self._connection.has_native_async
+            result.update(self._execute_module(task_vars=task_vars, wrap_async=wrap_async))
+            if not wrap_async:
+                self._remove_tmp_path(self._connection._shell.tmpdir)
+            return result
+
+        set_context(host=(task_vars or {}).get('inventory_hostname'), plugin=self._task.action)
+
+        result.update(self.run_module(dict(
+            self._task.args,
+            _ansible_check_mode=self._task.check_mode,
+            _ansible_diff=self._task.diff,
+            _ansible_no_log=self._task.no_log,
+            _ansible_verbosity=self._display.verbosity,
+            _ansible_module_name=self._task.action,
+        )))
+        return result
+
+    def in_process(self, task_vars):
+        """Return whether the module is run on the controller, in-process"""
+        if not IN_PROCESS_SUPPORTED:
+            return False
+        if self._task.delegate_to is not None and self._task.delegate_to not in C.LOCALHOST:
+            return False
+        if 'tpm_run_on_controller' in task_vars:
+            return boolean(self._templar.template(task_vars['tpm_run_on_controller']), strict=False)
+        return True
+
+    def run_module(self, args):
+        """Return the result of the module run with the given arguments"""
+        module_cls = type('InProcess' + self.module.TpmModule.__name__,
+                          (TpmInProcessModule, self.module.TpmModule), {})
+
+        with TpmActionBase._lock:
+            saved = (basic._ANSIBLE_ARGS, getattr(basic, '_ANSIBLE_PROFILE', None))
+            basic._ANSIBLE_ARGS = json.dumps({'ANSIBLE_MODULE_ARGS': args}, cls=_ENCODER).encode('utf-8')
+            if _PROFILE:
+                basic._ANSIBLE_PROFILE = _PROFILE
+
+            try:
+                module_cls(**self.module.module_args()).run()
+            except ModuleExit as e:
+                result = e.args[0]
+            else:
+                result = dict(failed=True, msg='Module returned no result')
+            finally:
+                basic._ANSIBLE_ARGS = saved[0]
+                if _PROFILE:
+                    basic._ANSIBLE_PROFILE = saved[1]
+
+        return result
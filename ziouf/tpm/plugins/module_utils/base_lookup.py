@@ -3,6 +3,19 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 import os
+import copy
+import threading
+
+from ansible.errors import AnsibleError
+
+from .breaker import circuit_open
+from .cache import (
+    CacheBackendError,
+    TpmFileCache,
+    get_cache,
+    get_file_cache,
+)
+from .metrics import set_context
 
 
 class TpmLookupBase():
@@ -18,3 +31,97 @@ class TpmLookupBase():
             'password': 'TPM_PASS',
         }
         return {k: variables.get('tpm_{k}'.format(k=k), os.getenv(v)) for k, v in keys.items()}
+
+    def label_metrics(self, variables):
+        """Label the requests of this lookup with the host it runs for"""
+        set_context(host=(variables or {}).get('inventory_hostname'), plugin=self._load_name)
+
+    def cache_key(self, *parts):
+        """Cache key of a lookup: TPM host, auth identity, lookup name, then the given parts"""
+        identity = self.config.get('tpm_public_key') or self.config.get('tpm_username')
+        return (self.config.get('tpm_hostname'), identity, self._load_name) + parts
+
+    def get_cache(self):
+        """Return the cache backend selected by the lookup options"""
+        options = dict(ttl=self.get_option('cache_ttl'),
+                       max_entries=self.get_option('cache_max_entries'),
+                       stale_ttl=self.get_option('cache_stale_ttl'))
+
+        if self.get_option('cache_backend') == 'file':
+            try:
+                return get_file_cache(self.get_option('cache_dir') or TpmFileCache.default_path(),
+                                      self.config.get('tpm_private_key') or self.config.get('tpm_password'),
+                                      stretch=not self.config.get('tpm_private_key'),
+                                      **options)
+            except CacheBackendError as e:
+                raise AnsibleError(e)
+
+        return get_cache('lookup.{n}'.format(n=self._load_name), **options)
+
+    def cached(self, key, fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), memoized when the `cache` option is enabled
+
+        An expired entry still within `cache_stale_ttl` is returned as is while
+        a single background thread (per host, across forks) refreshes it, with
+        the options of this call (see detached).
+        While TPM is unavailable (circuit breaker open), any cached entry is
+        returned, however old.
+        """
+        if not self.get_option('cache'):
+            return fn(*args, **kwargs)
+
+        cache = self.get_cache()
+
+        hit, value = cache.get(key)
+        if hit:
+            self.display.vvv(msg='TPM lookup cache hit for {k}'.format(k=key[3:]))
+            return value
+
+        hit, value = cache.get_stale(key)
+        if hit:
+            self.display.vvv(msg='TPM lookup cache stale hit for {k}'.format(k=key[3:]))
+            if cache.lock(key):
+                # Not a daemon: the worker process waits for the refresh before exiting
+                threading.Thread(target=self.revalidate, args=(cache, key, self.detached(fn), args, kwargs)).start()
+            else:
+                cache.discard(key)
+            return value
+
+        try:
+            value = fn(*args, **kwargs)
+        except Exception as e:
+            hit, value = cache.get_fallback(key) if circuit_open(e) else (False, None)
+            if not hit:
+                raise
+            self.display.warning('{e}: using the cached result of {k}'.format(e=circuit_open(e), k=key[3:]))
+            return value
+        else:
+            cache.set(key, value)
+        finally:
+            cache.discard(key)
+
+        return value
+
+    def detached(self, fn):
+        """Return fn, bound to a copy of this lookup when it is one of its methods
+
+        The copy keeps the options and config of the current call: the next
+        run() of this lookup resets them while a background refresh may still
+        be running.
+        """
+        if getattr(fn, '__self__', None) is not self:
+            return fn
+
+        clone = copy.copy(self)
+        clone._options = dict(self._options)
+        clone.config = dict(self.config)
+        return fn.__func__.__get__(clone, type(clone))
+
+    def revalidate(self, cache, key, fn, args, kwargs):
+        try:
+            cache.set(key, fn(*args, **kwargs))
+        except Exception as e:
+            self.display.warning('Failed to refresh TPM lookup cache entry: {e}'.format(e=e))
+        finally:
+            cache.discard(key)
+            cache.unlock(key)
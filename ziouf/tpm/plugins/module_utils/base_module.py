@@ -9,14 +9,24 @@ from ansible.module_utils.basic import (
     env_fallback,
 )
 from ansible.module_utils.common.dict_transformations import dict_merge
+from ansible.module_utils.common.validation import check_required_if
 
 from .api import TpmApiBase, FindError
+from .concurrency import parallel_map
 
 
 class AlreadyExistsError(Exception):
     """Creation failed. Item already exists"""
 
 
+class AlreadyAbsentError(Exception):
+    """Deletion skipped. Item does not exist"""
+
+
+class AlreadyUpToDateError(Exception):
+    """Update skipped. Item already has the expected values"""
+
+
 class StateNotImplementedError(Exception):
     """Specified state is not implemented"""
 
@@ -29,7 +39,7 @@ class TpmModuleBase(AnsibleModule):
         state=dict(
             type='str',
             choices=['present', 'absent', 'update'],
-            required=True,
+            default='present',
         ),
         # Api connection informations
         tpm_hostname=dict(
@@ -62,6 +72,47 @@ class TpmModuleBase(AnsibleModule):
             fallback=(env_fallback, ['TPM_PRIVATE_KEY']),
             no_log=True,
         ),
+        # Result of create/update: full (read back), merged (no read back) or id
+        tpm_return_mode=dict(
+            type='str',
+            choices=['full', 'merged', 'id'],
+            default='full',
+        ),
+        # Retry of throttled (429) and failed (5xx) requests
+        tpm_retries=dict(
+            type='int',
+            default=3,
+        ),
+        # Requests per second to TPM, shared by every fork (0: unlimited)
+        tpm_rate_limit=dict(
+            type='float',
+            default=0,
+        ),
+        tpm_rate_burst=dict(
+            type='int',
+            default=10,
+        ),
+        # Circuit breaker: fail fast while TPM is unavailable (0: disabled)
+        tpm_breaker_threshold=dict(
+            type='int',
+            default=5,
+        ),
+        tpm_breaker_reset_timeout=dict(
+            type='int',
+            default=30,
+        ),
+        # Searches matching nothing, remembered until a write (0: disabled)
+        tpm_negative_cache_ttl=dict(
+            type='int',
+            default=10,
+        ),
+    )
+    # Bulk mode only
+    __arg_spec_bulk: dict = dict(
+        tpm_workers=dict(
+            type='int',
+            default=4,
+        ),
     )
     __mutually_exclusive: list = [
         ('tpm_username', 'tpm_public_key'),
@@ -86,7 +137,8 @@ class TpmModuleBase(AnsibleModule):
                  add_file_common_args=False,
                  supports_check_mode=False,
                  required_if=None,
-                 required_by=None):
+                 required_by=None,
+                 bulk_param=None):
         argument_spec = argument_spec or {}
         required_by = required_by or {}
         mutually_exclusive = mutually_exclusive or []
@@ -94,10 +146,21 @@ class TpmModuleBase(AnsibleModule):
         required_one_of = required_one_of or []
 
         argument_spec = dict_merge(TpmModuleBase.__arg_spec_base, argument_spec)
+        if bulk_param:
+            argument_spec = dict_merge(TpmModuleBase.__arg_spec_bulk, argument_spec)
         mutually_exclusive.extend(TpmModuleBase.__mutually_exclusive)
         required_together.extend(TpmModuleBase.__required_together)
         required_one_of.extend(TpmModuleBase.__required_one_of)
 
+        # In bulk mode, the conditional requirements apply to every item
+        # instead of the top level parameters
+        self.bulk_param = bulk_param
+        self.item_required_if = required_if or []
+        if bulk_param:
+            mutually_exclusive.append(('name', bulk_param))
+            required_one_of.append(('name', bulk_param))
+            required_if = None
+
         super().__init__(
             argument_spec,
             bypass_checks=bypass_checks,
@@ -111,28 +174,22 @@ class TpmModuleBase(AnsibleModule):
             required_by=required_by
         )
 
-        self.config = dict_merge(TpmApiBase.default_config(), {
-            'tpm_hostname': self.params.get('tpm_hostname'),
-            'tpm_public_key': self.params.get('tpm_public_key'),
-            'tpm_private_key': self.params.get('tpm_private_key'),
-            'tpm_username': self.params.get('tpm_username'),
-            'tpm_password': self.params.get('tpm_password'),
-            'tpm_ssl_verify': self.params.get('tpm_ssl_verify'),
-            'use_hmac': all(['tpm_public_key' in self.params, 'tpm_private_key' in self.params]),
-        })
+        # Every tpm_* parameter is API configuration
+        self.config = dict_merge(TpmApiBase.default_config(), dict(
+            (k, v) for k, v in self.params.items() if k.startswith('tpm_') and v is not None))
+        self.config['use_hmac'] = all([self.params.get('tpm_public_key'), self.params.get('tpm_private_key')])
 
     def run(self):
         """Run create/update actions"""
-        fn = {
-            'present': self.fn_present,
-            'absent': self.fn_absent,
-            'update': self.fn_update,
-        }.get(self.params.get('state', self.fn_default))
+        if self.bulk_param and self.params.get(self.bulk_param) is not None:
+            return self.run_bulk(self.params.get(self.bulk_param))
 
         try:
-            r = fn()
+            data = self.fn_data(self.params)
+            self.fn_check(dict(data, state=self.params.get('state')))
+            r = self.fn_state(self.params.get('state'))(data)
 
-        except AlreadyExistsError as e:
+        except (AlreadyExistsError, AlreadyAbsentError, AlreadyUpToDateError) as e:
             self.exit_json(
                 changed=False,
                 result={'tpm': e.args}
@@ -140,6 +197,7 @@ class TpmModuleBase(AnsibleModule):
 
         except Exception as e:
             self.fail_json(
+                msg=str(e),
                 changed=False,
                 error=str(e),
                 stacktrace=traceback.format_exc().splitlines(),
@@ -151,44 +209,128 @@ class TpmModuleBase(AnsibleModule):
                 result={'tpm': r},
             )
 
-    def fn_default(self) -> dict:
-        raise StateNotImplementedError()
+    def run_bulk(self, items):
+        """Run create/update actions of every item in a single invocation
+
+        Items are processed concurrently, except those sharing the same name
+        which run one after the other, in the given order.
+        """
+        items = [dict(self.fn_data(item), state=item.get('state') or self.params.get('state'))
+                 for item in items]
 
-    def fn_present(self) -> dict:
-        data: dict = self.params.get('data', {})
+        self.prefetch(items)
+
+        groups = {}
+        for item in items:
+            groups.setdefault(item.get('name'), []).append(item)
+
+        results = {}
+        for group in parallel_map(lambda group: [(id(i), self.run_item(i)) for i in group],
+                                  groups.values(), workers=self.params.get('tpm_workers')):
+            results.update(group)
+        results = [results[id(item)] for item in items]
+
+        changed = any(r['changed'] for r in results)
+        if any(r.get('failed') for r in results):
+            self.fail_json(
+                msg='{n} of {t} items failed'.format(n=len([r for r in results if r.get('failed')]),
+                                                     t=len(results)),
+                changed=changed,
+                results=results,
+            )
+
+        self.exit_json(
+            changed=changed,
+            results=results,
+        )
+
+    def run_item(self, item):
+        """Run the action of a single bulk item, and return its result"""
+        result = dict(name=item.get('name'), state=item.get('state'), changed=False)
+        data = dict((k, v) for k, v in item.items() if k != 'state')
 
+        try:
+            self.fn_check(item)
+            result['tpm'] = self.fn_state(item.get('state'))(data)
+            result['changed'] = True
+
+        except (AlreadyExistsError, AlreadyAbsentError, AlreadyUpToDateError) as e:
+            result['tpm'] = e.args
+
+        except Exception as e:
+            result['failed'] = True
+            result['error'] = str(e)
+
+        return result
+
+    def prefetch(self, items):
+        """Resolve once what several bulk items share (no-op by default)"""
+
+    def fn_data(self, params: dict) -> dict:
+        """Return the entry data held by the given parameters"""
+        return dict((k, v) for k, v in params.items()
+                    if k not in TpmModuleBase.__arg_spec_base and not k.startswith('tpm_')
+                    and k != self.bulk_param)
+
+    def fn_check(self, item: dict):
+        """Check the conditional requirements of an entry"""
+        check_required_if(self.item_required_if,
+                          dict((k, v) for k, v in item.items() if v is not None))
+
+    def fn_existing(self, data: dict) -> dict:
+        """Return the existing entry matching the given entry data, None if none"""
+        return self.findFirst(data.get('name'), default=None)
+
+    def fn_state(self, state: str):
+        return {
+            'present': self.fn_present,
+            'absent': self.fn_absent,
+            'update': self.fn_update,
+        }.get(state, self.fn_default)
+
+    def fn_default(self, data: dict) -> dict:
+        raise StateNotImplementedError()
+
+    def fn_present(self, data: dict) -> dict:
         try:
             # First find existing secret with the verysame name
-            item = self.findFirst(data.get('name'), default=None)
+            item = self.fn_existing(data)
 
         except FindError:
             return self.create(**data)
 
         else:
+            if item is None:
+                return self.create(**data)
             raise AlreadyExistsError(item)
 
-    def fn_absent(self) -> dict:
-        data: dict = self.params.get('data', {})
-
+    def fn_absent(self, data: dict) -> dict:
         try:
             # First find existing secret with the verysame name
-            item = self.findFirst(data.get('name'), default=None)
+            item = self.fn_existing(data)
 
         except FindError as e:
             raise e
 
         else:
+            if item is None:
+                raise AlreadyAbsentError(data.get('name'))
             return self.delete(item['id'])
 
-    def fn_update(self) -> dict:
-        data: dict = self.params.get('data', {})
-
+    def fn_update(self, data: dict) -> dict:
         try:
             # First find existing secret with the verysame name
-            item = self.findFirst(data.get('name'), default=None)
+            item = self.fn_existing(data)
 
         except FindError as e:
             raise e
 
         else:
-            return self.update(item['id'], **data)
+            if item is None:
+                raise FindError('No entry matches "{n}"'.format(n=data.get('name')))
+
+            # Only write (and generate a password) when a field differs
+            entry = self.getById(item['id'])
+            if not self.diff(entry, **data):
+                raise AlreadyUpToDateError(entry)
+            return self.update(item['id'], entry=entry, **data)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import time
+import threading
+
+from .shared_state import get_shared_state
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """TPM is unavailable, requests fail fast"""
+
+
+class TpmCircuitBreaker():
+    """Circuit breaker shared by every process sending requests to a TPM host
+
+    closed: requests are sent, `threshold` consecutive failures (connection
+    errors, timeouts, 5xx) open the circuit.
+    open: requests fail at once with CircuitOpenError for `reset_timeout`
+    seconds, then the circuit is half-open.
+    half-open: a single request, across every process, probes TPM while the
+    others keep failing fast. Its success closes the circuit, its failure
+    opens it again. A probe not concluded within `reset_timeout` (killed
+    process) is handed over to the next request.
+
+    While the circuit is closed and healthy, requests only read the state
+    under a shared lock: the exclusive lock is taken to record a failure,
+    the first success after failures, or to probe.
+    """
+
+    def __init__(self, state, hostname, threshold=5, reset_timeout=30):
+        self.state = state
+        self.hostname = hostname
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+    def _circuit(self, data):
+        return data.setdefault('circuit', {'state': CLOSED, 'failures': 0})
+
+    def _healthy(self):
+        circuit = self._circuit(self.state.read())
+        return circuit['state'] == CLOSED and not circuit['failures']
+
+    def allow(self):
+        """Raise CircuitOpenError unless a request can be sent now"""
+        if self._circuit(self.state.read())['state'] == CLOSED:
+            return
+
+        with self.state.transaction() as data:
+            circuit = self._circuit(data)
+            if circuit['state'] == CLOSED:
+                return
+
+            now = time.time()
+            if now >= circuit.get('retry_on', 0):
+                # Half-open: this request is the probe
+                circuit.update(state=HALF_OPEN, retry_on=now + self.reset_timeout)
+                return
+
+            raise CircuitOpenError('TPM {h} is unavailable ({n} consecutive failures), '
+                                   'requests fail fast for {s:.0f}s'.format(
+                                       h=self.hostname, n=circuit['failures'],
+                                       s=circuit['retry_on'] - now))
+
+    def success(self):
+        if self._healthy():
+            return
+
+        with self.state.transaction() as data:
+            circuit = self._circuit(data)
+            if circuit['state'] != CLOSED or circuit['failures']:
+                data['circuit'] = {'state': CLOSED, 'failures': 0}
+
+    def failure(self):
+        with self.state.transaction() as data:
+            circuit = self._circuit(data)
+            circuit['failures'] += 1
+            if circuit['state'] == HALF_OPEN or circuit['failures'] >= self.threshold:
+                circuit.update(state=OPEN, retry_on=time.time() + self.reset_timeout)
+
+    def status(self):
+        return self._circuit(self.state.read())['state']
+
+
+def circuit_open(e):
+    """Return the CircuitOpenError that caused the given exception, if any"""
+    while e is not None:
+        if isinstance(e, CircuitOpenError):
+            return e
+        e = getattr(e, '__cause__', None) or getattr(e, '__context__', None)
+    return None
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_circuit_breaker(hostname, threshold=5, reset_timeout=30):
+    """Return the circuit breaker of the given TPM host, shared with the other processes"""
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(hostname)
+        if breaker is None:
+            breaker = _BREAKERS[hostname] = TpmCircuitBreaker(get_shared_state(hostname), hostname)
+        breaker.state = get_shared_state(hostname)
+        breaker.threshold = threshold
+        breaker.reset_timeout = reset_timeout
+    return breaker
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+# Controller local broker of TPM requests, shared by every Ansible fork.
+#
+# Requests are sent, one JSON line per connection, to a daemon listening on a
+# Unix socket and started on demand by the first process needing it. The
+# daemon holds the connection pool and a cache of GET responses, and sends a
+# single upstream request for identical requests in flight (singleflight).
+
+import os
+import json
+import time
+import base64
+import codecs
+import signal
+import socket
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:                 # Not POSIX
+    fcntl = None
+
+from .breaker import CircuitOpenError
+from .cache import TpmMemoryCache
+from .connection import TpmResponse
+from .metrics import SPOOL_DIR_ENV
+from .shared_state import bump_generation, get_generation
+
+
+class BrokerError(Exception):
+    """Request through the TPM broker failed"""
+
+
+class TpmBroker():
+    """Daemon side of the broker: forwards requests to TPM with `upstream`
+
+    `upstream(config)` returns the TpmApiBase sending a request upstream.
+    GET responses (200) are cached for `cache_ttl` seconds, keyed by TPM host,
+    credentials and path: a write reported by any process of the controller
+    (see cache.invalidate_caches) makes them outdated. The daemon exits after
+    `idle_timeout` seconds without request.
+    """
+
+    def __init__(self, upstream, cache_ttl=60, idle_timeout=300):
+        self.upstream = upstream
+        self.cache = TpmMemoryCache(ttl=cache_ttl, max_entries=4096)
+        self.idle_timeout = idle_timeout
+        self.last_request = time.time()
+        self.upstream_requests = 0
+
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._active = 0
+
+    def serve(self, listener, path=None):
+        """Serve the connections of the listening socket until idle for idle_timeout"""
+        listener.settimeout(1.0)
+        while True:
+            try:
+                conn, dummy = listener.accept()
+            except socket.timeout:
+                if time.time() - self.last_request >= self.idle_timeout and not self._active:
+                    break
+                continue
+            self._spawn(conn)
+
+        # Clients from now on start another broker, those already connected are served
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        listener.settimeout(0.1)
+        while True:
+            try:
+                conn, dummy = listener.accept()
+            except socket.timeout:
+                break
+            self._spawn(conn)
+        while self._active:
+            time.sleep(0.05)
+        listener.close()
+
+    def _spawn(self, conn):
+        with self._lock:
+            self._active += 1
+            self.last_request = time.time()
+        thread = threading.Thread(target=self.handle, args=(conn,))
+        thread.daemon = True
+        thread.start()
+
+    def handle(self, conn):
+        try:
+            conn.settimeout(None)
+            reply = self.process(json.loads(codecs.decode(_read(conn))))
+            conn.sendall(codecs.encode(json.dumps(reply)))
+        except Exception:
+            # The client gets no answer: BrokerError
+            pass
+        finally:
+            conn.close()
+            with self._lock:
+                self._active -= 1
+                self.last_request = time.time()
+
+    def process(self, request):
+        config = dict(request['config'], tpm_broker=None)
+        method, path = request['method'], request['path']
+        hostname = config.get('tpm_hostname')
+
+        if method != 'GET':
+            reply = self.forward(config, request)
+            bump_generation(hostname)
+            return reply
+
+        key = (hostname, get_generation(hostname), _identity(config), path)
+        hit, reply = self.cache.get(key)
+        if hit:
+            return reply
+
+        reply = self.singleflight(key, lambda: self.forward(config, request))
+        # Not cached when a write was reported meanwhile
+        if reply.get('status') == 200 and get_generation(hostname) == key[1]:
+            self.cache.set(key, reply)
+        return reply
+
+    def singleflight(self, key, fn):
+        """Return fn(), called once for every caller asking for the same key meanwhile"""
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            return call.result
+
+        try:
+            call.result = fn()
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+        return call.result
+
+    def forward(self, config, request):
+        self.upstream_requests += 1
+        try:
+            # Relayed as is: decoded by the client
+            r = self.upstream(config)._http_request(request['method'], request['path'],
+                                                    body=request.get('body'), page=request.get('page'),
+                                                    decode=False)
+        except CircuitOpenError as e:
+            return {'error': str(e), 'circuit_open': True}
+        except Exception as e:
+            return {'error': str(e)}
+
+        return {
+            'status': r.status,
+            'headers': list(r.headers.items()),
+            'body': codecs.decode(base64.b64encode(r.body), 'ascii'),
+        }
+
+
+class _Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def _identity(config):
+    """Hash of the credentials: cached responses are only served to the same credentials"""
+    credentials = [config.get(k) or '' for k in ('tpm_public_key', 'tpm_private_key', 'tpm_username', 'tpm_password')]
+    return hashlib.sha256(codecs.encode('\n'.join(credentials))).hexdigest()
+
+
+def _read(conn):
+    data = b''
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+        if data.endswith(b'\n'):
+            return data
+
+
+def default_path():
+    return os.path.join('~', '.cache', 'ziouf.tpm.broker', 'broker.sock')
+
+
+def _connect(path, timeout):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(timeout)
+    try:
+        conn.connect(path)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def start(path, upstream, cache_ttl=60, idle_timeout=300):
+    """Start the broker daemon listening on path, unless another process did
+
+    The socket is bound here, before the daemon is detached (double fork),
+    so that it accepts connections as soon as this function returns.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+
+    lock = os.open('{p}.lock'.format(p=path), os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            _connect(path, 1).close()
+            return
+        except (IOError, OSError):
+            # Not started, or a socket left by a killed broker
+            if os.path.exists(path):
+                os.remove(path)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(128)
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.setsid()
+                if os.fork() == 0:
+                    _detach(listener.fileno())
+                    TpmBroker(upstream, cache_ttl=cache_ttl, idle_timeout=idle_timeout).serve(listener, path)
+            finally:
+                # Never run the handlers of the process the daemon was forked from
+                os._exit(0)
+
+        listener.close()
+        os.waitpid(pid, 0)
+    finally:
+        os.close(lock)
+
+
+def _detach(listener):
+    # Pipes to the Ansible processes included: only the listening socket is kept
+    os.closerange(3, listener)
+    os.closerange(listener + 1, 65536)
+    os.chdir('/')
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(null, fd)
+    os.close(null)
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_DFL)
+    # The requests of the daemon are not labelled with a task
+    os.environ.pop(SPOOL_DIR_ENV, None)
+
+
+def request(path, config, method, url_path, body=None, page=None, upstream=None):
+    """Send a request to TPM through the broker listening on path and return a TpmResponse
+
+    The broker is started when it does not answer, with the tpm_broker_cache_ttl
+    and tpm_broker_idle_timeout of the given config.
+    """
+    if fcntl is None:
+        raise BrokerError('The TPM broker requires a POSIX controller')
+
+    path = os.path.expanduser(path)
+    message = codecs.encode(json.dumps(dict(config=config, method=method, path=url_path,
+                                            body=body, page=page), default=str) + '\n')
+    # Long enough for every retry of the request by the broker
+    timeout = (config.get('tpm_timeout', 10) + config.get('tpm_retry_max_delay', 30)) * \
+        (config.get('tpm_retries', 3) + 1)
+
+    try:
+        conn = _connect(path, timeout)
+    except (IOError, OSError):
+        start(path, upstream,
+              cache_ttl=config.get('tpm_broker_cache_ttl', 60),
+              idle_timeout=config.get('tpm_broker_idle_timeout', 300))
+        conn = _connect(path, timeout)
+
+    try:
+        conn.sendall(message)
+        reply = json.loads(codecs.decode(_read(conn)))
+    except (IOError, OSError, ValueError) as e:
+        raise BrokerError('No answer from the TPM broker {p}: {e}'.format(p=path, e=e))
+    finally:
+        conn.close()
+
+    if 'error' in reply:
+        raise (CircuitOpenError if reply.get('circuit_open') else BrokerError)(reply['error'])
+    return TpmResponse(reply['status'], reply['headers'], base64.b64decode(reply['body']))
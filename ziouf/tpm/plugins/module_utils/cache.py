@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import copy
+import json
+import time
+import hmac
+import base64
+import codecs
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    HAS_CRYPTOGRAPHY = True
+except ImportError:
+    HAS_CRYPTOGRAPHY = False
+
+from .shared_state import bump_generation, get_generation
+
+
+class CacheBackendError(Exception):
+    """Cache backend can not be used"""
+
+
+class TpmMemoryCache():
+    """In-memory LRU cache with a time to live on every entry
+
+    Keys are tuples whose first item is the TPM hostname, so that every entry
+    related to an instance can be dropped at once after a write.
+    Expired entries are still served by `get_stale` for `stale_ttl` seconds.
+    """
+
+    def __init__(self, ttl=300, max_entries=1024, stale_ttl=0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._revalidating = set()
+
+    def _get(self, key, stale):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            expires, value = entry
+            now = time.time()
+            if now > expires + self.stale_ttl:
+                # Kept for get_fallback, until evicted
+                return False, None
+
+            # Most recently used entries are kept at the end
+            del self._entries[key]
+            self._entries[key] = entry
+            if (now > expires) != stale:
+                return False, None
+            return True, copy.deepcopy(value)
+
+    def get(self, key):
+        """Return a tuple (hit, value), only fresh entries are hits"""
+        return self._get(key, stale=False)
+
+    def get_stale(self, key):
+        """Return a tuple (hit, value), only expired entries still in their stale window are hits"""
+        return self._get(key, stale=True)
+
+    def get_fallback(self, key):
+        """Return a tuple (hit, value) whatever the age of the entry, used while TPM is unavailable"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            return True, copy.deepcopy(entry[1])
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, copy.deepcopy(value))
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lock(self, key):
+        """Claim the revalidation of an entry, return False if already claimed"""
+        with self._lock:
+            if key in self._revalidating:
+                return False
+            self._revalidating.add(key)
+            return True
+
+    def unlock(self, key):
+        with self._lock:
+            self._revalidating.discard(key)
+
+    def discard(self, key):
+        """Forget a miss of the given key, whose value was set or failed to be fetched"""
+
+    def invalidate(self, hostname=None):
+        """Drop every entry, or only those related to the given TPM host"""
+        with self._lock:
+            if hostname is None:
+                self._entries.clear()
+                return
+
+            for key in [k for k in self._entries if k[0] == hostname]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TpmFileCache():
+    """Encrypted on-disk cache with a time to live on every entry
+
+    Each entry is a Fernet token stored in its own file, under a directory
+    per TPM host. The encryption key is derived from the TPM private key (HMAC
+    auth) or password (Basic auth, stretched with PBKDF2), file names are
+    keyed hashes so that they do not leak the queries. Files are replaced
+    atomically, so concurrent readers from several forks always see a
+    complete entry.
+
+    Every entry records the write generation of its TPM host (see
+    shared_state.py) read before its value was fetched: an entry older than
+    a write reported by any process of the controller is a miss.
+    """
+
+    LOCK_TIMEOUT = 60
+
+    def __init__(self, path, secret, ttl=300, max_entries=1024, stale_ttl=0, stretch=False):
+        if not HAS_CRYPTOGRAPHY:
+            raise CacheBackendError('The file cache backend requires the python cryptography library')
+        if not secret:
+            raise CacheBackendError('The file cache backend requires a TPM private key or password')
+
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+
+        key = TpmFileCache.derive_key(secret, stretch=stretch)
+        self._fernet = Fernet(base64.urlsafe_b64encode(key))
+        self._name_key = hashlib.sha256(key + b'name').digest()
+        # key -> generation of the host when the entry was found missing or expired
+        self._fetched = {}
+
+    @staticmethod
+    def default_path():
+        return os.path.join('~', '.cache', 'ziouf.tpm')
+
+    @staticmethod
+    def derive_key(secret, stretch=False):
+        material = codecs.encode(secret)
+        if stretch:
+            # Low entropy secret (password): make brute forcing the cache expensive
+            material = hashlib.pbkdf2_hmac('sha256', material, b'ziouf.tpm.cache', 200000)
+
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=b'ziouf.tpm.cache',
+            info=b'lookup cache encryption',
+        ).derive(material)
+
+    @staticmethod
+    def host_dir(path, hostname):
+        digest = hashlib.sha256(codecs.encode(str(hostname))).hexdigest()
+        return os.path.join(os.path.expanduser(path), digest[:16])
+
+    def _entry_path(self, key):
+        name = hmac.new(self._name_key, codecs.encode(json.dumps(key[1:], default=str)),
+                        hashlib.sha256).hexdigest()
+        return os.path.join(TpmFileCache.host_dir(self.path, key[0]), name)
+
+    def _read(self, key):
+        try:
+            with open(self._entry_path(key), 'rb') as f:
+                return json.loads(codecs.decode(self._fernet.decrypt(f.read())))
+        except (IOError, OSError, ValueError, InvalidToken):
+            return None
+
+    def _get(self, key, stale):
+        generation = get_generation(key[0])
+        entry = self._read(key)
+        if entry is not None and entry.get('generation') == generation:
+            now = time.time()
+            if now <= entry['expires'] + self.stale_ttl and (now > entry['expires']) == stale:
+                return True, entry['value']
+
+        # The value about to be fetched is at least as recent as this generation
+        self._fetched[key] = generation
+        return False, None
+
+    def get(self, key):
+        """Return a tuple (hit, value), only fresh entries are hits"""
+        return self._get(key, stale=False)
+
+    def get_stale(self, key):
+        """Return a tuple (hit, value), only expired entries still in their stale window are hits"""
+        return self._get(key, stale=True)
+
+    def get_fallback(self, key):
+        """Return a tuple (hit, value) whatever the age of the entry, used while TPM is unavailable"""
+        entry = self._read(key)
+        if entry is None:
+            return False, None
+        return True, entry['value']
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        generation = self._fetched.pop(key, None)
+        if generation is None:
+            generation = get_generation(key[0])
+
+        path = self._entry_path(key)
+        directory = self._makedirs(os.path.dirname(path))
+
+        token = self._fernet.encrypt(codecs.encode(json.dumps({
+            'expires': time.time() + ttl,
+            'generation': generation,
+            'value': value,
+        })))
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(token)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        self._prune(directory)
+
+    def _makedirs(self, directory):
+        for d in (self.path, directory):
+            try:
+                os.makedirs(d, 0o700)
+            except OSError:
+                # Already created, possibly by a concurrent fork
+                if not os.path.isdir(d):
+                    raise
+        return directory
+
+    def _prune(self, directory):
+        entries = [os.path.join(directory, n) for n in os.listdir(directory)
+                   if not n.startswith('.') and not n.endswith('.lock')]
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort(key=lambda p: os.stat(p).st_mtime if os.path.exists(p) else 0)
+        for path in entries[:len(entries) - self.max_entries]:
+            _remove(path)
+
+    def lock(self, key):
+        """Claim the revalidation of an entry across processes, return False if already claimed"""
+        path = '{p}.lock'.format(p=self._entry_path(key))
+        self._makedirs(os.path.dirname(path))
+        try:
+            if time.time() - os.stat(path).st_mtime > TpmFileCache.LOCK_TIMEOUT:
+                _remove(path)
+        except OSError:
+            pass
+
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        except OSError:
+            return False
+        return True
+
+    def unlock(self, key):
+        _remove('{p}.lock'.format(p=self._entry_path(key)))
+
+    def discard(self, key):
+        """Forget a miss of the given key, whose value was set or failed to be fetched"""
+        self._fetched.pop(key, None)
+
+    def invalidate(self, hostname=None):
+        """Drop every entry, or only those related to the given TPM host"""
+        invalidate_file_cache(self.path, hostname)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def invalidate_file_cache(path, hostname=None):
+    """Remove on-disk entries of the given TPM host (or all of them) from a cache directory"""
+    path = os.path.expanduser(path)
+    if hostname is None:
+        directories = [os.path.join(path, n) for n in os.listdir(path)] if os.path.isdir(path) else []
+    else:
+        directories = [TpmFileCache.host_dir(path, hostname)]
+
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if not name.endswith('.lock'):
+                _remove(os.path.join(directory, name))
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_cache(name, ttl=300, max_entries=1024, stale_ttl=0):
+    """Return the process wide in-memory cache registered under the given name"""
+    with _CACHES_LOCK:
+        cache = _CACHES.get(name)
+        if cache is None:
+            cache = _CACHES[name] = TpmMemoryCache(ttl=ttl, max_entries=max_entries)
+        cache.ttl = ttl
+        cache.max_entries = max_entries
+        cache.stale_ttl = stale_ttl
+    return cache
+
+
+def get_file_cache(path, secret, ttl=300, max_entries=1024, stale_ttl=0, stretch=False):
+    """Return the process wide on-disk cache for the given directory and secret"""
+    key = ('file', os.path.expanduser(path), hashlib.sha256(codecs.encode(secret or '')).hexdigest())
+    with _CACHES_LOCK:
+        cache = _CACHES.get(key)
+        if cache is None:
+            cache = _CACHES[key] = TpmFileCache(path, secret, ttl=ttl, max_entries=max_entries,
+                                                stretch=stretch)
+        cache.ttl = ttl
+        cache.max_entries = max_entries
+        cache.stale_ttl = stale_ttl
+    return cache
+
+
+def invalidate_caches(hostname=None):
+    """Drop cached entries of the given TPM host from every registered cache
+
+    The default on-disk cache directory is cleaned up as well, and the write
+    is reported through the shared state of the host: on-disk entries of any
+    directory and the broker (see broker.py) tell outdated values from it.
+    """
+    with _CACHES_LOCK:
+        caches = list(_CACHES.values())
+
+    for cache in caches:
+        cache.invalidate(hostname)
+
+    invalidate_file_cache(TpmFileCache.default_path(), hostname)
+    if hostname is not None:
+        bump_generation(hostname)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    ThreadPoolExecutor,
+    wait,
+)
+
+
+def parallel_map(fn, items, workers=4):
+    """Return [fn(item) for item in items], computed on a bounded thread pool
+
+    Results keep the order of `items`. The first failure cancels every call
+    that has not started yet and is raised once running calls are over.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(items)))
+    try:
+        futures = [executor.submit(fn, item) for item in items]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+
+        for future in pending:
+            future.cancel()
+
+        for future in futures:
+            if future in done and future.exception() is not None:
+                raise future.exception()
+
+        return [future.result() for future in futures]
+
+    finally:
+        executor.shutdown(wait=True)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import ssl
+import json
+import time
+import base64
+import codecs
+import threading
+
+from socket import timeout as socket_timeout
+
+try:
+    import httplib as http_client       # Python 2.x
+    from urllib import getproxies, proxy_bypass, unquote
+    from urlparse import urlsplit
+except ImportError:
+    import http.client as http_client   # Python 3+
+    from urllib.parse import unquote, urlsplit
+    from urllib.request import getproxies, proxy_bypass
+
+from .throttle import IDEMPOTENT_METHODS
+
+
+class TpmResponse():
+    """Fully read HTTP response, detached from its (pooled) connection"""
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = dict((k.lower(), v) for k, v in headers)
+        self.body = body
+        self._json = None
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    def json(self):
+        """Return the decoded body, decoded only once"""
+        if self._json is None:
+            self._json = json.loads(self.body.decode('utf-8'))
+        return self._json
+
+
+class TpmConnectionPool():
+    """HTTP/1.1 keep-alive connection pool for a single host and TLS setting
+
+    Idle connections are kept up to `maxsize` and dropped once they have not
+    been used for `idle_timeout` seconds. Connections are never shared
+    between processes: the pool forgets every connection after a fork.
+    With a `proxy` URL, connections are tunnelled through it (CONNECT).
+    """
+
+    def __init__(self, host, port=None, ssl_verify=True, timeout=10,
+                 maxsize=4, idle_timeout=30, proxy=None):
+        self.host = host
+        self.port = port
+        self.proxy = proxy
+        self.ssl_verify = ssl_verify
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+
+    def _ssl_context(self):
+        context = ssl.create_default_context()
+        if not self.ssl_verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _new_connection(self):
+        if not self.proxy:
+            return http_client.HTTPSConnection(self.host, self.port,
+                                               timeout=self.timeout,
+                                               context=self._ssl_context())
+
+        proxy = urlsplit(self.proxy if '://' in self.proxy else 'http://{p}'.format(p=self.proxy))
+        conn = http_client.HTTPSConnection(proxy.hostname, proxy.port or 8080,
+                                           timeout=self.timeout,
+                                           context=self._ssl_context())
+        headers = {}
+        if proxy.username:
+            credentials = '{u}:{p}'.format(u=unquote(proxy.username), p=unquote(proxy.password or ''))
+            headers['Proxy-Authorization'] = 'Basic {c}'.format(
+                c=codecs.decode(base64.b64encode(codecs.encode(credentials))))
+        conn.set_tunnel(self.host, self.port, headers=headers)
+        return conn
+
+    def _connect(self, conn, metrics):
+        """Open a new connection, timing DNS and TCP apart from the TLS handshake"""
+        create_connection = conn._create_connection
+
+        def timed_create_connection(*args, **kwargs):
+            with metrics.timer('connect'):
+                return create_connection(*args, **kwargs)
+
+        conn._create_connection = timed_create_connection
+        start = time.time()
+        try:
+            conn.connect()
+        finally:
+            conn._create_connection = create_connection
+            metrics.timings['tls'] += time.time() - start - metrics.timings['connect']
+
+    def reset(self):
+        """Forget every idle connection (used after fork)"""
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+
+    def acquire(self):
+        """Return a tuple (connection, reused)"""
+        if self._pid != os.getpid():
+            self.reset()
+
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    return conn, True
+                conn.close()
+
+        return self._new_connection(), False
+
+    def release(self, conn):
+        """Give back a connection whose response has been fully read"""
+        if self._pid != os.getpid():
+            return
+
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.time()))
+                return
+
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for conn, dummy in idle:
+            conn.close()
+
+    def request(self, method, url, body=None, headers=None, metrics=None):
+        """Send a request on a pooled connection and return a TpmResponse
+
+        A request sent on a reused connection that the server closed in the
+        meantime is transparently replayed on a fresh connection, when it is
+        idempotent or failed before it was fully sent: a POST the server may
+        have received is never sent twice.
+        Phase timings and counters are added to the given TpmRequestMetrics.
+        """
+        headers = headers or {}
+
+        while True:
+            conn, reused = self.acquire()
+            sent = False
+            try:
+                if metrics is not None:
+                    metrics.reused = reused
+                    if getattr(conn, 'sock', None) is None:
+                        self._connect(conn, metrics)
+
+                with _timer(metrics, 'wait'):
+                    conn.request(method, url, body=body, headers=headers)
+                    sent = True
+                    r = conn.getresponse()
+                with _timer(metrics, 'transfer'):
+                    data = r.read()
+
+            except Exception as e:
+                conn.close()
+                if reused and (method in IDEMPOTENT_METHODS or not sent) \
+                        and isinstance(e, (http_client.HTTPException, IOError)) \
+                        and not isinstance(e, socket_timeout):
+                    if metrics is not None:
+                        metrics.retries += 1
+                    continue
+                raise
+
+            if metrics is not None:
+                metrics.status = r.status
+                metrics.bytes_sent += len(body or b'')
+                metrics.bytes_received += len(data)
+
+            if r.will_close:
+                conn.close()
+            else:
+                self.release(conn)
+
+            return TpmResponse(r.status, r.getheaders(), data)
+
+
+class _NoTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def _timer(metrics, phase):
+    return _NoTimer() if metrics is None else metrics.timer(phase)
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+_POOLS_PID = [os.getpid()]
+
+
+def reset_pools():
+    """Drop every pool. Sockets inherited from a parent process are not reused"""
+    global _POOLS_LOCK
+    _POOLS.clear()
+    _POOLS_LOCK = threading.Lock()
+    _POOLS_PID[0] = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_pools)
+
+
+def get_proxy(host):
+    """Return the URL of the proxy HTTPS requests to the given host go through, None if none
+
+    Read from the environment (https_proxy, no_proxy...), like open_url does.
+    """
+    if proxy_bypass(host):
+        return None
+    return getproxies().get('https')
+
+
+def get_pool(host, port=None, ssl_verify=True, timeout=10, maxsize=4, idle_timeout=30):
+    """Return the process wide pool for the given host, TLS settings and proxy"""
+    if _POOLS_PID[0] != os.getpid():
+        reset_pools()
+
+    proxy = get_proxy(host)
+    key = (host, port, bool(ssl_verify), proxy)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = TpmConnectionPool(host, port,
+                                                   ssl_verify=ssl_verify,
+                                                   timeout=timeout,
+                                                   maxsize=maxsize,
+                                                   idle_timeout=idle_timeout,
+                                                   proxy=proxy)
+        pool.timeout = timeout
+        pool.maxsize = maxsize
+        pool.idle_timeout = idle_timeout
+    return pool
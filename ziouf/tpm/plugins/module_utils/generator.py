@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import string
+import threading
+
+from collections import deque
+
+try:
+    import secrets                          # Python 3.6+
+    _random = secrets.SystemRandom()
+except ImportError:
+    import random
+    _random = random.SystemRandom()
+
+from .concurrency import parallel_map
+
+
+DEFAULT_POLICY = {
+    'length': 16,
+    'lower': True,
+    'upper': True,
+    'digits': True,
+    'symbols': True,
+    'symbol_chars': '!#$%&()*+,-./:;<=>?@[]^_{|}~',
+}
+
+
+class PolicyError(Exception):
+    """Password policy can not be satisfied"""
+
+
+def generate_password(policy=None):
+    """Return a random password honouring the given policy
+
+    The policy (see DEFAULT_POLICY) sets the length and which character
+    classes are used. Every enabled class appears at least once.
+    """
+    policy = dict(DEFAULT_POLICY, **dict((k, v) for k, v in (policy or {}).items() if v is not None))
+
+    classes = [chars for enabled, chars in (
+        (policy.get('lower'), string.ascii_lowercase),
+        (policy.get('upper'), string.ascii_uppercase),
+        (policy.get('digits'), string.digits),
+        (policy.get('symbols'), policy.get('symbol_chars')),
+    ) if enabled and chars]
+
+    length = int(policy.get('length'))
+    if not classes:
+        raise PolicyError('Password policy enables no character class')
+    if length < len(classes):
+        raise PolicyError('Password length {l} is too short for {c} character classes'.format(
+            l=length, c=len(classes)))
+
+    alphabet = ''.join(classes)
+    password = [_random.choice(chars) for chars in classes]
+    password += [_random.choice(alphabet) for dummy in range(length - len(classes))]
+    _random.shuffle(password)
+
+    return ''.join(password)
+
+
+class TpmPasswordPool():
+    """Passwords generated ahead of time by TPM, handed out in O(1)
+
+    `fetch` returns a single new password. The pool is refilled by batches of
+    `batch_size` concurrent calls when empty, and `prefetch` fills it ahead
+    of a known number of password creations.
+    """
+
+    def __init__(self, fetch, batch_size=1, workers=4):
+        self.fetch = fetch
+        self.batch_size = batch_size
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._passwords = deque()
+
+    def prefetch(self, count):
+        """Make sure at least `count` passwords are available
+
+        Passwords are fetched without holding the lock of the pool.
+        """
+        with self._lock:
+            missing = count - len(self._passwords)
+        if missing > 0:
+            passwords = parallel_map(lambda dummy: self.fetch(), range(missing), workers=self.workers)
+            with self._lock:
+                self._passwords.extend(passwords)
+
+    def pop(self):
+        """Return a password that is never handed out again"""
+        while True:
+            with self._lock:
+                if self._passwords:
+                    return self._passwords.popleft()
+            self.prefetch(max(self.batch_size, 1))
+
+    def __len__(self):
+        return len(self._passwords)
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_password_pool(key, fetch, batch_size=1, workers=4):
+    """Return the process wide password pool registered under the given key"""
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = TpmPasswordPool(fetch, batch_size=batch_size, workers=workers)
+        pool.fetch = fetch
+        pool.batch_size = batch_size
+        pool.workers = workers
+    return pool
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+# Incremental decoding of the JSON arrays returned by TPM list and search
+# requests: records are decoded one at a time from the page text, so that
+# only the records kept by the caller, reduced to the fields it asked for,
+# stay in memory.
+
+import re
+import json
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_DECODER = json.JSONDecoder()
+
+
+def project(item, fields=None):
+    """Return the given record reduced to the given fields, if any"""
+    if fields is None or not isinstance(item, dict):
+        return item
+    return dict((k, item[k]) for k in fields if k in item)
+
+
+def iter_array(text, fields=None):
+    """Yield the items of the JSON array held by text, decoded one at a time
+
+    Items are projected on `fields` as soon as they are decoded. Raise
+    ValueError when text does not hold a JSON array.
+    """
+    end = WHITESPACE.match(text, 0).end()
+    if text[end:end + 1] != '[':
+        raise ValueError('Expecting a JSON array at char {c}'.format(c=end))
+
+    end = WHITESPACE.match(text, end + 1).end()
+    if text[end:end + 1] == ']':
+        end += 1
+    else:
+        while True:
+            item, end = _DECODER.raw_decode(text, end)
+            yield project(item, fields)
+
+            end = WHITESPACE.match(text, end).end()
+            separator = text[end:end + 1]
+            if separator == ']':
+                end += 1
+                break
+            if separator != ',':
+                raise ValueError('Expecting \',\' delimiter at char {c}'.format(c=end))
+            end = WHITESPACE.match(text, end + 1).end()
+
+    if WHITESPACE.match(text, end).end() != len(text):
+        raise ValueError('Extra data after the JSON array at char {c}'.format(c=end))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import json
+import time
+import threading
+
+# Set by the ziouf.tpm.metrics callback: every request is appended as a
+# JSON line to a file of this directory, labelled with the current task
+SPOOL_DIR_ENV = 'ZIOUF_TPM_METRICS_DIR'
+TASK_ENV = 'ZIOUF_TPM_METRICS_TASK'
+TASK_NAME_ENV = 'ZIOUF_TPM_METRICS_TASK_NAME'
+
+_LISTENERS = []
+_CONTEXT = {}
+_LOCK = threading.Lock()
+
+
+class TpmRequestMetrics():
+    """Timings (seconds) by phase and counters of a single request sent to TPM
+
+    Phases are throttle (rate limit and retry backoff), connect (DNS and
+    TCP), tls (handshake), sign (request headers), wait (send until the
+    response headers), transfer (response body) and decode (JSON). Connect
+    and tls are only spent on new connections.
+    """
+
+    PHASES = ('throttle', 'connect', 'tls', 'sign', 'wait', 'transfer', 'decode')
+
+    def __init__(self, method, path, page=None):
+        self.method = method
+        self.path = path
+        self.page = page
+        self.status = None
+        self.reused = None
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timings = dict((phase, 0.0) for phase in TpmRequestMetrics.PHASES)
+
+    def timer(self, phase):
+        """Return a context manager adding the time spent within to the given phase"""
+        return _Timer(self, phase)
+
+    def as_dict(self):
+        return dict(
+            _CONTEXT,
+            method=self.method,
+            path=self.path,
+            page=self.page,
+            status=self.status,
+            reused=self.reused,
+            retries=self.retries,
+            bytes_sent=self.bytes_sent,
+            bytes_received=self.bytes_received,
+            timings=dict(self.timings),
+            total=sum(self.timings.values()),
+            time=time.time(),
+            pid=os.getpid(),
+            task=os.environ.get(TASK_ENV),
+            task_name=os.environ.get(TASK_NAME_ENV),
+        )
+
+    def record(self):
+        """Hand the request over to the registered listeners and the callback spool"""
+        if not _LISTENERS and not os.environ.get(SPOOL_DIR_ENV):
+            return
+
+        data = self.as_dict()
+        for listener in list(_LISTENERS):
+            listener(data)
+
+        if os.environ.get(SPOOL_DIR_ENV):
+            _spool(os.environ.get(SPOOL_DIR_ENV), data)
+
+
+class _Timer():
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.timings[self.phase] += time.time() - self.start
+
+
+def _spool(directory, data):
+    # A single O_APPEND write per line: concurrent writers never interleave
+    line = (json.dumps(data, default=str) + '\n').encode('utf-8')
+    try:
+        fd = os.open(os.path.join(directory, '{p}.jsonl'.format(p=os.getpid())),
+                     os.O_CREAT | os.O_APPEND | os.O_WRONLY, 0o600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError:
+        # Metrics never break a request
+        pass
+
+
+def add_listener(fn):
+    """Call fn(dict) for every request sent to TPM by this process"""
+    with _LOCK:
+        _LISTENERS.append(fn)
+
+
+def remove_listener(fn):
+    with _LOCK:
+        if fn in _LISTENERS:
+            _LISTENERS.remove(fn)
+
+
+def set_context(**labels):
+    """Label the requests sent from now on by this process (host, plugin, ...)"""
+    with _LOCK:
+        _CONTEXT.clear()
+        _CONTEXT.update(labels)
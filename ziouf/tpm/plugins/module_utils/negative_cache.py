@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import json
+import time
+import codecs
+import hashlib
+import tempfile
+
+from .snapshot import normalize_query
+
+# Directory of the misses, ~/.cache/ziouf.tpm.misses by default
+CACHE_DIR_ENV = 'TPM_NEGATIVE_CACHE_DIR'
+
+
+class TpmNegativeCache():
+    """Searches known to match nothing, shared by every process of the controller
+
+    Each miss is a small file of its own, named after the digest of the
+    identity, kind and normalized query, under a directory per TPM host. It
+    is replaced atomically, so that reading one takes no lock and recording
+    one does not touch the others, nor the shared state of the host.
+
+    A write done by this collection forgets the misses it could turn into
+    matches: a created or updated password forgets every password search,
+    a project write forgets every miss of the host. Whether a password
+    matches a search is only known to TPM: none is assumed not to.
+    Deleting an entry can not make a search match, it forgets nothing.
+    A search sent before a write is not recorded after it.
+    """
+
+    MAX_ENTRIES = 1024
+
+    def __init__(self, path, hostname, ttl=10):
+        self.path = os.path.expanduser(path)
+        self.hostname = hostname
+        self.ttl = ttl
+
+    @staticmethod
+    def default_path():
+        return os.environ.get(CACHE_DIR_ENV) or os.path.join('~', '.cache', 'ziouf.tpm.misses')
+
+    @staticmethod
+    def digest(identity, kind, query_str):
+        return hashlib.sha256(codecs.encode('\n'.join((identity, kind, normalize_query(query_str))))).hexdigest()[:32]
+
+    def _directory(self):
+        digest = hashlib.sha256(codecs.encode(str(self.hostname))).hexdigest()
+        return os.path.join(self.path, digest[:16])
+
+    def _makedirs(self):
+        directory = self._directory()
+        for d in (self.path, directory):
+            try:
+                os.makedirs(d, 0o700)
+            except OSError:
+                # Already created, possibly by a concurrent fork
+                if not os.path.isdir(d):
+                    raise
+        return directory
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return json.loads(codecs.decode(f.read()))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(codecs.encode(json.dumps(data)))
+            os.rename(tmp_path, path)
+        except Exception:
+            _remove(tmp_path)
+            raise
+
+    def _entries(self):
+        """Yield (path, miss) of every recorded miss, removing the expired ones"""
+        directory = self._directory()
+        names = os.listdir(directory) if os.path.isdir(directory) else []
+        now = time.time()
+        for name in names:
+            if name.startswith('.'):
+                continue
+            path = os.path.join(directory, name)
+            miss = self._read(path)
+            if miss is None or miss['expires'] <= now:
+                _remove(path)
+                continue
+            yield path, miss
+
+    def hit(self, digest):
+        """Return whether a search with the given digest is known to match nothing"""
+        miss = self._read(os.path.join(self._directory(), digest))
+        return miss is not None and miss['expires'] > time.time()
+
+    def add(self, digest, kind, since=None):
+        """Record that a search of the given kind, sent at `since`, matched nothing"""
+        if self.ttl <= 0:
+            return
+
+        try:
+            directory = self._makedirs()
+        except OSError:
+            # Read-only home...: misses are not remembered
+            return
+
+        forgotten = self._read(os.path.join(directory, '.forgotten'))
+        if since is not None and forgotten is not None and forgotten['on'] >= since:
+            # Misses were forgotten meanwhile: the result may predate a write
+            return
+
+        self._write(os.path.join(directory, digest), dict(expires=time.time() + self.ttl, kind=kind))
+
+        if len(os.listdir(directory)) > self.MAX_ENTRIES:
+            # Those expiring first are dropped first
+            entries = sorted(self._entries(), key=lambda e: e[1]['expires'])
+            for path, dummy in entries[:max(len(entries) - self.MAX_ENTRIES, 0)]:
+                _remove(path)
+
+    def forget(self, kind=None):
+        """Forget the misses of the given kind, all kinds by default"""
+        try:
+            self._write(os.path.join(self._makedirs(), '.forgotten'), dict(on=time.time()))
+        except (IOError, OSError):
+            # Read-only home...: no miss is remembered
+            return
+
+        for path, miss in list(self._entries()):
+            if kind is None or miss.get('kind') == kind:
+                _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_negative_cache(hostname, ttl=10):
+    """Return the cache of searches matching nothing on the given TPM host"""
+    return TpmNegativeCache(TpmNegativeCache.default_path(), hostname, ttl=ttl)
+
+
+def forget_misses(hostname, kind):
+    """Report a write of the given kind to the negative cache of the given TPM host"""
+    if kind == 'projects':
+        # A project write can change the results of password searches on project as well
+        get_negative_cache(hostname).forget()
+    else:
+        get_negative_cache(hostname).forget(kind)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+# Index of the project hierarchy of a TPM instance, built from a single
+# project listing. Projects are addressed by path, the names of their
+# ancestors and their own joined with '/' (infra/prod/nexus).
+
+SEPARATOR = '/'
+
+ROOT = 0
+
+
+class ProjectNotFoundError(Exception):
+    """No project matches the given name or path"""
+
+
+class AmbiguousProjectError(Exception):
+    """Several projects match the given name"""
+
+
+class TpmProjectTree():
+    """Parent -> children index of every listed project
+
+    Lookups by id, path and name are dict lookups. Projects whose parent is
+    not listed (not readable) hang from the root. `get`, `children` and
+    `subtree` return the listed records with their `path` added.
+    """
+
+    def __init__(self, projects):
+        self._projects = {}
+        self._parents = {}
+        self._children = {ROOT: []}
+        self._names = {}
+        self._paths = {}
+        self._named_children = {}
+
+        for project in projects:
+            id = project['id']
+            self._projects[id] = project
+            self._parents[id] = project.get('parent_id') or ROOT
+            self._names.setdefault(project.get('name'), []).append(id)
+
+        for id, parent in self._parents.items():
+            if parent not in self._projects:
+                parent = self._parents[id] = ROOT
+            self._children.setdefault(parent, []).append(id)
+            self._named_children.setdefault((parent, self._projects[id].get('name')), id)
+
+        # Top down, so that the path of a parent is known before its children's
+        pending = list(self._children[ROOT])
+        while pending:
+            id = pending.pop()
+            parent = self._parents[id]
+            name = self._projects[id].get('name')
+            self._paths[id] = name if parent == ROOT else SEPARATOR.join((self._paths[parent], name))
+            pending.extend(self._children.get(id, []))
+        self._ids = dict((path, id) for id, path in self._paths.items())
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, name):
+        return name in self._ids or name in self._names
+
+    def path(self, id):
+        return self._paths[id]
+
+    def get(self, id):
+        return dict(self._projects[id], path=self._paths[id])
+
+    def byPath(self, path):
+        '''
+        Return the project at the given path, None if none
+        '''
+        id = self._ids.get(path.strip(SEPARATOR))
+        return self.get(id) if id is not None else None
+
+    def resolve(self, name):
+        '''
+        Return the id of the project at the given path, or else with the given name
+        A name shared by several projects is ambiguous: their paths tell them apart
+        '''
+        id = self._ids.get(name.strip(SEPARATOR))
+        if id is not None:
+            return id
+
+        ids = self._names.get(name, [])
+        if len(ids) > 1:
+            raise AmbiguousProjectError('Project name "{n}" is ambiguous, use one of the paths: {p}'.format(
+                n=name, p=', '.join(sorted(self._paths[i] for i in ids))))
+        if not ids:
+            raise ProjectNotFoundError('Project "{n}" not found'.format(n=name))
+        return ids[0]
+
+    def named(self, name):
+        '''
+        Return the projects with the given name, wherever they are in the tree
+        '''
+        return [self.get(i) for i in self._names.get(name, [])]
+
+    def child(self, parent, name):
+        '''
+        Return the child of the given project (the root for 0) with the given name, None if none
+        '''
+        id = self._named_children.get((parent or ROOT, name))
+        return self.get(id) if id is not None else None
+
+    def children(self, id=ROOT):
+        '''
+        Return the direct children of the given project (of the root by default)
+        '''
+        return [self.get(i) for i in self._children.get(id, [])]
+
+    def subtree(self, id=ROOT):
+        '''
+        Yield the given project, then every descendant, parents before their children
+        '''
+        pending = [id] if id != ROOT else list(reversed(self._children[ROOT]))
+        while pending:
+            id = pending.pop()
+            yield self.get(id)
+            pending.extend(reversed(self._children.get(id, [])))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import json
+import codecs
+import hashlib
+import threading
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:                 # Not POSIX
+    fcntl = None
+
+# Directory of the shared states, ~/.cache/ziouf.tpm.state by default
+STATE_DIR_ENV = 'TPM_STATE_DIR'
+
+
+class TpmSharedState():
+    """Small JSON document shared by every process of the controller
+
+    `with state.transaction() as data:` reads, modifies and writes it back
+    under an exclusive flock() of the file, released by the kernel even when
+    a process is killed. `state.read()` only reads it, under a shared lock,
+    so that readers do not wait for each other. An unreadable document
+    starts over empty. Without fcntl, the state is only shared by the
+    threads of the process.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._local = {}
+
+    @staticmethod
+    def default_path(hostname):
+        digest = hashlib.sha256(codecs.encode(hostname or '')).hexdigest()
+        directory = os.environ.get(STATE_DIR_ENV) or os.path.join('~', '.cache', 'ziouf.tpm.state')
+        return os.path.join(directory, '{d}.json'.format(d=digest[:16]))
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            fd = self.__open()
+            if fd is None:
+                yield self._local
+                return
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                raw, data = self.__read(fd)
+
+                yield data
+
+                updated = codecs.encode(json.dumps(data, sort_keys=True))
+                if updated != raw:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.ftruncate(fd, 0)
+                    os.write(fd, updated)
+            finally:
+                os.close(fd)
+
+    def read(self):
+        """Return a copy of the document, without locking out the other readers"""
+        with self._lock:
+            fd = self.__open()
+            if fd is None:
+                return json.loads(json.dumps(self._local))
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                return self.__read(fd)[1]
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def __read(fd):
+        raw = b''
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            raw += chunk
+        try:
+            return raw, json.loads(raw.decode('utf-8')) if raw else {}
+        except ValueError:
+            return raw, {}
+
+    def __open(self):
+        if fcntl is None:
+            return None
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            return os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            # Read-only home...: not shared with the other processes
+            return None
+
+
+_STATES = {}
+_STATES_LOCK = threading.Lock()
+
+
+def reset_states():
+    """Forget every state: its lock may have been held by another thread of the parent process"""
+    global _STATES_LOCK
+    _STATES.clear()
+    _STATES_LOCK = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_states)
+
+
+def get_shared_state(hostname):
+    """Return the state shared by every process talking to the given TPM host"""
+    path = TpmSharedState.default_path(hostname)
+    with _STATES_LOCK:
+        state = _STATES.get(path)
+        if state is None:
+            state = _STATES[path] = TpmSharedState(path)
+    return state
+
+
+def get_generation(hostname):
+    """Return the number of writes to the given TPM host reported by the processes of the controller"""
+    return get_shared_state(hostname).read().get('generation', 0)
+
+
+def bump_generation(hostname):
+    """Report a write to the given TPM host: cached reads shared across processes are outdated"""
+    with get_shared_state(hostname).transaction() as data:
+        data['generation'] = data.get('generation', 0) + 1
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import re
+import copy
+import json
+import time
+import zlib
+import base64
+import codecs
+import hashlib
+import tempfile
+import threading
+
+from .cache import (
+    HAS_CRYPTOGRAPHY,
+    TpmFileCache,
+)
+from .concurrency import parallel_map
+from .shared_state import get_generation
+
+if HAS_CRYPTOGRAPHY:
+    from cryptography.fernet import Fernet, InvalidToken
+
+
+class SnapshotError(Exception):
+    """Snapshot can not be used"""
+
+
+class QueryError(Exception):
+    """Query can not be evaluated offline"""
+
+
+# field:value, field:"quoted value", "quoted value" or value
+QUERY_TERM = re.compile(r'(?:(\w+):)?("[^"]*"|\S+)')
+
+# TPM search fields, and the entry field they search in
+QUERY_FIELDS = {
+    'name': 'name',
+    'username': 'username',
+    'email': 'email',
+    'access': 'access_info',
+    'notes': 'notes',
+    'tag': 'tags',
+    'project': 'project',
+}
+
+
+def parse_query(query_str):
+    """Return the terms of a TPM search query as a list of (field, value)
+
+    Values are lowercased, field is None for a plain word. The value of a
+    tag term is the list of tags an entry must all have.
+    """
+    terms = []
+    for field, value in QUERY_TERM.findall(query_str or ''):
+        field = field or None
+        if field is not None and field not in QUERY_FIELDS:
+            raise QueryError('Search field "{f}" is not supported offline'.format(f=field))
+
+        value = value.strip('"').lower()
+        if field == 'tag':
+            value = [t.strip() for t in value.split(',') if t.strip()]
+        terms.append((field, value))
+
+    return terms
+
+
+def normalize_query(query_str):
+    """Return a canonical form of a TPM search query, equal for equivalent queries
+
+    Terms are lowercased, unquoted and sorted, and so are the tags of a tag term.
+    """
+    terms = set()
+    for field, value in QUERY_TERM.findall(query_str or ''):
+        value = value.strip('"').lower()
+        if field.lower() == 'tag':
+            value = ','.join(sorted(set(t.strip() for t in value.split(',') if t.strip())))
+        terms.add('{f}:{v}'.format(f=field.lower(), v=json.dumps(value)))
+
+    return ' '.join(sorted(terms))
+
+
+class TpmSnapshot():
+    """Offline copy of the passwords readable by a TPM identity
+
+    Entries are the full password details, in listing order. Inverted indexes
+    on name, username, project and tags (lowercased value -> entry positions)
+    evaluate the TPM search syntax without touching the server: tags match
+    exactly, other fields and plain words match as case insensitive
+    substrings, and every term must match.
+    """
+
+    INDEXED = ('name', 'username', 'project', 'tags')
+
+    def __init__(self, entries, taken_on=None, generation=None):
+        self.entries = list(entries)
+        self.taken_on = taken_on or time.time()
+        # Write generation of the TPM host (see shared_state.py) when taken
+        self.generation = generation
+        self.changes = None
+
+        self._positions = {}
+        self._indexes = dict((field, {}) for field in TpmSnapshot.INDEXED)
+        self._text = []
+
+        for position, entry in enumerate(self.entries):
+            self._positions[entry.get('id')] = position
+            for field in TpmSnapshot.INDEXED:
+                for value in TpmSnapshot.values(entry, field):
+                    self._indexes[field].setdefault(value, set()).add(position)
+            self._text.append('\n'.join(
+                v for field in set(QUERY_FIELDS.values()) for v in TpmSnapshot.values(entry, field)))
+
+    @staticmethod
+    def values(entry, field):
+        """Return the lowercased searchable values of an entry field"""
+        if field == 'tags':
+            return [t.strip().lower() for t in (entry.get('tags') or '').split(',') if t.strip()]
+        if field == 'project':
+            value = (entry.get('project') or {}).get('name')
+        else:
+            value = entry.get(field)
+        return [str(value).lower()] if value else []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def age(self):
+        return time.time() - self.taken_on
+
+    def get(self, id):
+        """Return the entry of the given id, None when not in the snapshot"""
+        position = self._positions.get(int(id))
+        return None if position is None else copy.deepcopy(self.entries[position])
+
+    def __lookup(self, field, value):
+        index = self._indexes[field]
+        if field == 'tags':
+            return index.get(value, set())
+        # Substring match: scan the distinct values, not the entries
+        return set().union(*[p for k, p in index.items() if value in k])
+
+    def search(self, query_str):
+        """Return the entries matching a TPM search query, in listing order"""
+        candidates = None
+        plain = []
+
+        for field, value in parse_query(query_str):
+            field = QUERY_FIELDS.get(field)
+            if field is None:
+                plain.append(value)
+                continue
+
+            values = value if field == 'tags' else [value]
+            for v in values:
+                if field in self._indexes:
+                    positions = self.__lookup(field, v)
+                else:
+                    positions = set(p for p in (range(len(self.entries)) if candidates is None else candidates)
+                                    if any(v in x for x in TpmSnapshot.values(self.entries[p], field)))
+                candidates = positions if candidates is None else candidates & positions
+
+        positions = range(len(self.entries)) if candidates is None else sorted(candidates)
+        return [copy.deepcopy(self.entries[p]) for p in positions
+                if all(word in self._text[p] for word in plain)]
+
+    @staticmethod
+    def pull(api, workers=4):
+        """Return a new snapshot of every password readable with the given api
+
+        The listing only holds summaries: details are fetched concurrently.
+        """
+        return TpmSnapshot([]).refresh(api, workers=workers)
+
+    def refresh(self, api, workers=4):
+        """Return a new snapshot, with the changes made since this one merged in
+
+        The listing summaries carry updated_on: details are only fetched for
+        entries that are new or whose updated_on differs from the stored one.
+        Entries missing from the listing have been deleted (or are no longer
+        readable) and are dropped. TPM has no server side filter on
+        updated_on, so the listing itself is always read in full.
+        """
+        taken_on = time.time()
+        # Summaries reduced to what is compared: one small dict per password
+        summaries = list(api._http_iter(path='api/v4/passwords.json', fields=('id', 'updated_on')))
+
+        changed = [s['id'] for s in summaries
+                   if s['id'] not in self._positions or s.get('updated_on') is None
+                   or s.get('updated_on') != self.entries[self._positions[s['id']]].get('updated_on')]
+        fetched = dict(zip(changed, parallel_map(
+            lambda id: api._http_get(path='api/v4/passwords/{id}.json'.format(id=id)),
+            changed, workers=workers)))
+
+        snapshot = TpmSnapshot(
+            [fetched.get(s['id']) or self.entries[self._positions[s['id']]] for s in summaries],
+            taken_on=taken_on,
+        )
+        snapshot.changes = dict(
+            fetched=len(changed),
+            deleted=len(set(self._positions) - set(s['id'] for s in summaries)),
+        )
+        return snapshot
+
+
+class TpmSnapshotStore():
+    """Encrypted snapshot file
+
+    The snapshot is stored as a single zlib compressed Fernet token, with a
+    key derived from the TPM private key or password, like the file cache.
+    The file is replaced atomically, and pulls are serialized across
+    processes through an O_EXCL lock file.
+    """
+
+    LOCK_TIMEOUT = 600
+
+    def __init__(self, path, secret, stretch=False):
+        if not HAS_CRYPTOGRAPHY:
+            raise SnapshotError('Snapshots require the python cryptography library')
+        if not secret:
+            raise SnapshotError('Snapshots require a TPM private key or password')
+
+        self.path = os.path.expanduser(path)
+        self._fernet = Fernet(base64.urlsafe_b64encode(TpmFileCache.derive_key(secret, stretch=stretch)))
+
+    @staticmethod
+    def default_path(hostname, identity):
+        digest = hashlib.sha256(codecs.encode('{h}\n{i}'.format(h=hostname, i=identity))).hexdigest()
+        return os.path.join('~', '.cache', 'ziouf.tpm.snapshots', digest[:16])
+
+    def mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def load(self):
+        """Return the stored snapshot, None when missing or unreadable"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(codecs.decode(zlib.decompress(self._fernet.decrypt(f.read()))))
+        except (IOError, OSError, ValueError, zlib.error, InvalidToken):
+            return None
+        return TpmSnapshot(data['entries'], taken_on=data['taken_on'], generation=data.get('generation'))
+
+    def save(self, snapshot):
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+        token = self._fernet.encrypt(zlib.compress(codecs.encode(json.dumps({
+            'taken_on': snapshot.taken_on,
+            'generation': snapshot.generation,
+            'entries': snapshot.entries,
+        }, separators=(',', ':')))))
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(token)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def lock(self):
+        """Claim the pull of the snapshot across processes, return False if already claimed"""
+        path = '{p}.lock'.format(p=self.path)
+        try:
+            os.makedirs(os.path.dirname(path), 0o700)
+        except OSError:
+            pass
+        try:
+            if time.time() - os.stat(path).st_mtime > TpmSnapshotStore.LOCK_TIMEOUT:
+                os.remove(path)
+        except OSError:
+            pass
+
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        except OSError:
+            return False
+        return True
+
+    def unlock(self):
+        try:
+            os.remove('{p}.lock'.format(p=self.path))
+        except OSError:
+            pass
+
+
+_STORES = {}
+_SNAPSHOTS = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def get_snapshot(api):
+    """Return the snapshot configured on the given api, pulled when missing or expired
+
+    tpm_snapshot is the snapshot file, tpm_snapshot_max_age the age (seconds)
+    after which it is refreshed: only the changes since the previous one are
+    fetched, unless tpm_snapshot_sync is full. A snapshot taken before a write
+    reported by a process of the controller (see shared_state.py) is refreshed
+    the same way, whatever its age. Loaded snapshots are kept for the life of
+    the process, and reloaded when another process replaced the file. While
+    another process pulls, the previous snapshot is used, if any, unless it
+    predates a write: None is returned then, so that TPM is queried instead.
+    """
+    path = os.path.expanduser(api.config.get('tpm_snapshot'))
+    secret = api.config.get('tpm_private_key') or api.config.get('tpm_password')
+    max_age = api.config.get('tpm_snapshot_max_age', 3600)
+    generation = get_generation(api.config.get('tpm_hostname'))
+
+    def outdated(snapshot):
+        return snapshot.age() > max_age or snapshot.generation != generation
+
+    with _SNAPSHOTS_LOCK:
+        key = (path, hashlib.sha256(codecs.encode(secret or '')).hexdigest())
+        store = _STORES.get(key)
+        if store is None:
+            store = _STORES[key] = TpmSnapshotStore(path, secret, stretch=not api.config.get('tpm_private_key'))
+
+        mtime, snapshot = _SNAPSHOTS.get(key, (None, None))
+        if mtime is None or mtime != store.mtime():
+            mtime, snapshot = store.mtime(), store.load()
+
+        deadline = time.time() + TpmSnapshotStore.LOCK_TIMEOUT
+        while snapshot is None or outdated(snapshot):
+            if store.lock():
+                try:
+                    if store.mtime() != mtime:
+                        # Replaced by another process meanwhile
+                        mtime, snapshot = store.mtime(), store.load()
+                        if snapshot is not None and not outdated(snapshot):
+                            break
+
+                    workers = api.config.get('tpm_pool_size', 4)
+                    if snapshot is None or api.config.get('tpm_snapshot_sync') == 'full':
+                        snapshot = TpmSnapshot.pull(api, workers=workers)
+                    else:
+                        snapshot = snapshot.refresh(api, workers=workers)
+                    # Read before the pull: a write done meanwhile refreshes it again
+                    snapshot.generation = generation
+                    store.save(snapshot)
+                    mtime = store.mtime()
+                finally:
+                    store.unlock()
+            elif snapshot is None and time.time() < deadline:
+                # Wait for the pull of another process
+                time.sleep(0.5)
+                mtime, snapshot = store.mtime(), store.load()
+            elif snapshot is None:
+                raise SnapshotError('Timed out waiting for the snapshot {p}'.format(p=path))
+            else:
+                break
+
+        _SNAPSHOTS[key] = (mtime, snapshot)
+        if snapshot.generation != generation:
+            return None
+        return snapshot
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import time
+import random
+import threading
+
+from email.utils import mktime_tz, parsedate_tz
+
+from .shared_state import get_shared_state
+
+# TPM is overloaded: retried whatever the method, slows every process down
+THROTTLED_STATUSES = (429, 503)
+# Sent again on other 5xx statuses, POST could create an entry twice
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+
+class TpmRateLimiter():
+    """Token bucket shared by every process sending requests to a TPM host
+
+    Up to `burst` requests are sent at once, then `rate` per second. The
+    rate adapts to the server (AIMD): it is halved when TPM answers 429 or
+    5xx, at most once per DECREASE_INTERVAL however many processes see it,
+    and grows back by about INCREASE requests per second for every second
+    without error, up to `max_rate`. A Retry-After answer pauses every
+    process until the given date.
+    """
+
+    DECREASE = 0.5
+    DECREASE_INTERVAL = 1.0
+    INCREASE = 1.0
+
+    def __init__(self, state, max_rate, burst=10, min_rate=0.5):
+        self.state = state
+        self.max_rate = float(max_rate)
+        self.burst = max(1, burst)
+        self.min_rate = min(min_rate, self.max_rate)
+
+    def _bucket(self, data, now):
+        bucket = data.setdefault('bucket', {})
+        rate = min(bucket.get('rate', self.max_rate), self.max_rate)
+        tokens = bucket.get('tokens', self.burst) + (now - bucket.get('updated_on', now)) * rate
+        bucket.update(rate=rate, tokens=min(tokens, self.burst), updated_on=now)
+        return bucket
+
+    def reserve(self):
+        """Take a token, return the seconds to wait before sending the request"""
+        with self.state.transaction() as data:
+            now = time.time()
+            bucket = self._bucket(data, now)
+            bucket['tokens'] -= 1
+            return max(0.0, bucket.get('paused_until', 0) - now, -bucket['tokens'] / bucket['rate'])
+
+    def feedback(self, status, retry_after=None):
+        """Adapt the rate to the status of a response"""
+        with self.state.transaction() as data:
+            now = time.time()
+            bucket = self._bucket(data, now)
+            if status == 429 or status >= 500:
+                if now - bucket.get('decreased_on', 0) >= TpmRateLimiter.DECREASE_INTERVAL:
+                    bucket['rate'] = max(self.min_rate, bucket['rate'] * TpmRateLimiter.DECREASE)
+                    bucket['decreased_on'] = now
+                if retry_after:
+                    bucket['paused_until'] = max(bucket.get('paused_until', 0), now + retry_after)
+            elif bucket['rate'] < self.max_rate:
+                bucket['rate'] = min(self.max_rate, bucket['rate'] + TpmRateLimiter.INCREASE / bucket['rate'])
+
+    def rate(self):
+        with self.state.transaction() as data:
+            return self._bucket(data, time.time())['rate']
+
+
+def retry_after(r):
+    """Return the seconds asked by the Retry-After header of a response (delay or HTTP date), if any"""
+    value = r.getheader('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, mktime_tz(parsedate_tz(value)) - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def backoff_delay(attempt, base, cap):
+    """Return the delay before the given retry: exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(hostname, max_rate, burst=10):
+    """Return the rate limiter of the given TPM host, shared with the other processes"""
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(hostname)
+        if limiter is None:
+            limiter = _LIMITERS[hostname] = TpmRateLimiter(get_shared_state(hostname), max_rate, burst=burst)
+        limiter.state = get_shared_state(hostname)
+        limiter.max_rate = float(max_rate)
+        limiter.burst = max(1, burst)
+    return limiter
@@ -16,10 +16,10 @@ description: This module create or updates password entry in your Team Password
 version_added: "2.10.4"
 options:
     state:
-        description: ""
+        description: Expected state, also the default state of I(passwords) items
         choices: [present, absent, update]
         type: str
-        required: true
+        default: present
     tpm_hostname:
         description: |
             TeamPasswordManager api hostname (ex: my.compagny.com/tpm)
@@ -50,12 +50,102 @@ options:
         description: Validate or not SSL certificates on API connection
         type: bool
         default: true
+    tpm_return_mode:
+        description: |
+            Entry returned after a create or update
+            full reads it back from TPM, merged returns the entry read before the write merged with the submitted data
+            (no extra request), id only returns its id
+        type: str
+        choices: [full, merged, id]
+        default: full
+    tpm_retries:
+        description: |
+            Number of times a request is sent again when TPM answers 429 or 503, or another 5xx for reads, updates and deletes
+            Retries wait for an exponential backoff with jitter, or the delay asked by a Retry-After header
+        type: int
+        default: 3
+    tpm_rate_limit:
+        description: |
+            Maximum number of requests per second sent to TPM, shared by every fork of the controller (0 for unlimited)
+            The rate is halved whenever TPM answers 429 or 5xx, then grows back to this limit
+        type: float
+        default: 0
+    tpm_rate_burst:
+        description: Number of requests sent at once before I(tpm_rate_limit) applies
+        type: int
+        default: 10
+    tpm_breaker_threshold:
+        description: |
+            Number of consecutive failed requests (connection errors, timeouts, 5xx) after which TPM is considered unavailable,
+            shared by every fork of the controller: requests then fail at once for I(tpm_breaker_reset_timeout) seconds (0 to disable)
+            Its state is kept under the C(TPM_STATE_DIR) directory, C(~/.cache/ziouf.tpm.state) by default
+        type: int
+        default: 5
+    tpm_breaker_reset_timeout:
+        description: Seconds requests fail fast before a single one probes TPM again
+        type: int
+        default: 30
+    tpm_negative_cache_ttl:
+        description: |
+            Seconds a search matching nothing is remembered by every fork of the controller (0 to disable)
+            Passwords created or updated by this collection on the controller forget every password search,
+            project writes forget them all
+            Misses are kept under the C(TPM_NEGATIVE_CACHE_DIR) directory, C(~/.cache/ziouf.tpm.misses) by default
+        type: int
+        default: 10
+    tpm_workers:
+        description: Number of I(passwords) items processed concurrently
+        type: int
+        default: 4
+    tpm_generator:
+        description: |
+            How missing passwords are generated
+            remote asks the Team Password Manager generator, local generates them following I(tpm_password_policy)
+        type: str
+        choices: [remote, local]
+        default: remote
+    tpm_generator_batch:
+        description: |
+            Number of passwords requested concurrently from the Team Password Manager generator each time the pool is empty
+            In bulk mode, the passwords of every created entry are requested at once
+        type: int
+        default: 1
+    tpm_password_policy:
+        description: Policy of locally generated passwords, should match the one configured in Team Password Manager
+        type: dict
+        suboptions:
+            length:
+                description: Password length
+                type: int
+                default: 16
+            lower:
+                description: Use lowercase letters
+                type: bool
+                default: true
+            upper:
+                description: Use uppercase letters
+                type: bool
+                default: true
+            digits:
+                description: Use digits
+                type: bool
+                default: true
+            symbols:
+                description: Use symbols
+                type: bool
+                default: true
+            symbol_chars:
+                description: Symbols to use
+                type: str
     name:
-        description: Password name
+        description: |
+            Password name
+            Required unless I(passwords) is used
         type: str
-        required: true
     project_name:
-        description: Project name
+        description: |
+            Project name, or project path (parent/child) when several projects share the name
+            Resolved from an index of the project tree, built from a single project listing
         type: str
     tags:
         description: Tag list
@@ -71,7 +161,7 @@ options:
         description: email
         type: str
     password:
-        description: If not defined, the value is generated with Team Password Manager api
+        description: If not defined, the value of a created entry is generated, an existing entry keeps its password
         type: str
     expiry_date:
         description: "Expiration date (fmt: yyyy-mm-dd)"
@@ -109,13 +199,63 @@ options:
     custom_data10:
         description: Custom data field
         type: str
+    passwords:
+        description: |
+            Bulk mode: list of password entries handled in a single invocation
+            Each item accepts the same options as a single entry (I(name) required), plus its own I(state)
+            Projects are resolved once, items are processed concurrently (those sharing a name in order)
+        type: list
+        elements: dict
 '''
 
 EXAMPLES = r'''
+- name: Register new credential
+  ziouf.tpm.password:
+    name: secret-name
+    project_name: project-name
+    tags:
+      - tag1
+    username: username
 
+- name: Register many credentials at once
+  ziouf.tpm.password:
+    passwords:
+      - name: svc-app1
+        project_name: project-name
+        username: app1
+      - name: svc-app2
+        project_name: project-name
+        username: app2
+      - name: svc-legacy
+        state: absent
+  register: created_secrets
 '''
 
 RETURN = r'''
+results:
+    description: Bulk mode, result of every I(passwords) item in the given order
+    returned: when I(passwords) is used
+    type: list
+    elements: dict
+    contains:
+        name:
+            description: Name of the password entry
+            type: str
+        state:
+            description: State applied to the item
+            type: str
+        changed:
+            description: Whether the item changed
+            type: bool
+        failed:
+            description: Whether the item failed
+            type: bool
+        error:
+            description: Error message of a failed item
+            type: str
+        tpm:
+            description: Same as I(tpm) for a single entry
+            type: dict
 tpm:
     description: ''
     returned: success
@@ -211,36 +351,99 @@ tpm:
             type: str
 '''
 
-from ..module_utils.api import TpmPasswordApi
+from ..module_utils.api import FindError, TpmPasswordApi
 from ..module_utils.base_module import TpmModuleBase
+from ..module_utils.concurrency import parallel_map
+
+
+PASSWORD_SPEC = dict(
+    name=dict(type='str'),
+    project_name=dict(type='str'),
+    tags=dict(type='list', default=[], elements='str'),
+    access_info=dict(type='str', default=None),
+    username=dict(type='str', default=None),
+    email=dict(type='str', default=None),
+    password=dict(type='str', default=None, no_log=True),
+    expiry_date=dict(type='str', default=None),
+    notes=dict(type='str', default=None),
+    custom_data1=dict(type='str', default=None),
+    custom_data2=dict(type='str', default=None),
+    custom_data3=dict(type='str', default=None),
+    custom_data4=dict(type='str', default=None),
+    custom_data5=dict(type='str', default=None),
+    custom_data6=dict(type='str', default=None),
+    custom_data7=dict(type='str', default=None),
+    custom_data8=dict(type='str', default=None),
+    custom_data9=dict(type='str', default=None),
+    custom_data10=dict(type='str', default=None),
+)
 
 
 class TpmModule(TpmModuleBase, TpmPasswordApi):
-    pass
 
+    # Entry name -> existing entry (or None), looked up by prefetch
+    _prefetched = {}
 
-def main():
-    TpmModule(
+    def prefetch(self, items):
+        """Resolve every project of the entries to create only once, and generate their passwords at once
+
+        Entries to create without password are looked up concurrently first,
+        passwords are only generated for those that do not exist. The first
+        item of each name uses the entry looked up here instead of reading it
+        again.
+        """
+        created = [i for i in items if i.get('state') == 'present']
+
+        self.projectResolver().resolve_many(sorted(set(
+            i.get('project_name') for i in created if i.get('project_name'))))
+
+        if self.config.get('tpm_generator') != 'local':
+            names = sorted(set(i.get('name') for i in created if not i.get('password')))
+            found = parallel_map(self.__lookup, names, workers=self.params.get('tpm_workers'))
+            self._prefetched = dict((n, e) for n, (ok, e) in zip(names, found) if ok)
+            self.passwordPool().prefetch(len([n for n in names if self._prefetched.get(n, False) is None]))
+
+    def __lookup(self, name):
+        """Return (True, existing entry or None), (False, None) when the lookup failed"""
+        try:
+            return True, TpmModuleBase.fn_existing(self, dict(name=name))
+        except FindError:
+            return False, None
+
+    def fn_existing(self, data):
+        try:
+            return self._prefetched.pop(data.get('name'))
+        except KeyError:
+            return TpmModuleBase.fn_existing(self, data)
+
+
+def module_args():
+    """Return the TpmModule constructor arguments, shared with the action plugin"""
+    return dict(
         argument_spec=dict(
-            name=dict(type='str', required=True),
-            project_name=dict(type='str'),
-            tags=dict(type='list', default=[], elements='str'),
-            access_info=dict(type='str', default=None),
-            username=dict(type='str', default=None),
-            email=dict(type='str', default=None),
-            password=dict(type='str', default=None, no_log=True),
-            expiry_date=dict(type='str', default=None),
-            notes=dict(type='str', default=None),
-            custom_data1=dict(type='str', default=None),
-            custom_data2=dict(type='str', default=None),
-            custom_data3=dict(type='str', default=None),
-            custom_data4=dict(type='str', default=None),
-            custom_data5=dict(type='str', default=None),
-            custom_data6=dict(type='str', default=None),
-            custom_data7=dict(type='str', default=None),
-            custom_data8=dict(type='str', default=None),
-            custom_data9=dict(type='str', default=None),
-            custom_data10=dict(type='str', default=None),
+            PASSWORD_SPEC,
+            tpm_generator=dict(type='str', choices=['remote', 'local'], default='remote'),
+            tpm_generator_batch=dict(type='int', default=1),
+            tpm_password_policy=dict(
+                type='dict',
+                options=dict(
+                    length=dict(type='int', default=16),
+                    lower=dict(type='bool', default=True),
+                    upper=dict(type='bool', default=True),
+                    digits=dict(type='bool', default=True),
+                    symbols=dict(type='bool', default=True),
+                    symbol_chars=dict(type='str'),
+                ),
+            ),
+            passwords=dict(
+                type='list',
+                elements='dict',
+                options=dict(
+                    PASSWORD_SPEC,
+                    name=dict(type='str', required=True),
+                    state=dict(type='str', choices=['present', 'absent', 'update']),
+                ),
+            ),
         ),
         required_if=[
             ('state', 'present', ('name', 'project_name')),
@@ -248,7 +451,12 @@ def main():
             ('state', 'update', ('name',)),
         ],
         supports_check_mode=False,
-    ).run()
+        bulk_param='passwords',
+    )
+
+
+def main():
+    TpmModule(**module_args()).run()
 
 
 if __name__ == "__main__":
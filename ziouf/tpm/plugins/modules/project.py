@@ -16,10 +16,10 @@ description: This module create or updates password entry in TeamPasswordManager
 version_added: "2.10.4"
 options:
     state:
-        description: ""
+        description: Expected state
         choices: [present, absent, update]
         type: str
-        required: true
+        default: present
     tpm_hostname:
         description: |
             TeamPasswordManager api hostname (ex: my.compagny.com/tpm)
@@ -50,12 +50,60 @@ options:
         description: Validate or not SSL certificates on API connection
         type: bool
         default: true
+    tpm_return_mode:
+        description: |
+            Entry returned after a create or update
+            full reads it back from TPM, merged returns the entry read before the write merged with the submitted data
+            (no extra request), id only returns its id
+        type: str
+        choices: [full, merged, id]
+        default: full
+    tpm_retries:
+        description: |
+            Number of times a request is sent again when TPM answers 429 or 503, or another 5xx for reads, updates and deletes
+            Retries wait for an exponential backoff with jitter, or the delay asked by a Retry-After header
+        type: int
+        default: 3
+    tpm_rate_limit:
+        description: |
+            Maximum number of requests per second sent to TPM, shared by every fork of the controller (0 for unlimited)
+            The rate is halved whenever TPM answers 429 or 5xx, then grows back to this limit
+        type: float
+        default: 0
+    tpm_rate_burst:
+        description: Number of requests sent at once before I(tpm_rate_limit) applies
+        type: int
+        default: 10
+    tpm_breaker_threshold:
+        description: |
+            Number of consecutive failed requests (connection errors, timeouts, 5xx) after which TPM is considered unavailable,
+            shared by every fork of the controller: requests then fail at once for I(tpm_breaker_reset_timeout) seconds (0 to disable)
+            Its state is kept under the C(TPM_STATE_DIR) directory, C(~/.cache/ziouf.tpm.state) by default
+        type: int
+        default: 5
+    tpm_breaker_reset_timeout:
+        description: Seconds requests fail fast before a single one probes TPM again
+        type: int
+        default: 30
+    tpm_negative_cache_ttl:
+        description: |
+            Seconds a search matching nothing is remembered by every fork of the controller (0 to disable)
+            Passwords created or updated by this collection on the controller forget every password search,
+            project writes forget them all
+            Misses are kept under the C(TPM_NEGATIVE_CACHE_DIR) directory, C(~/.cache/ziouf.tpm.misses) by default
+        type: int
+        default: 10
     name:
-        description: Project name
+        description: |
+            Project name, or project path (parent/child) whose parent is then resolved, I(parent_id) being ignored
+            The existing project is looked up by name under its parent, in an index of the project tree built
+            from a single project listing
+            Without I(parent_id) nor path, it is looked up by name in the whole tree, the module failing when several
+            projects have that name, and created at the root when none has
         type: str
         required: true
     parent_id:
-        description: Project parent id
+        description: Project parent id (0 for a root project), the project is looked up under it only when set
         type: int
     tags:
         description: Tag list of the project
@@ -67,7 +115,9 @@ options:
 '''
 
 EXAMPLES = r'''
-
+- name: Create a sub project
+  ziouf.tpm.project:
+    name: infra/prod/nexus
 '''
 
 RETURN = r'''
@@ -114,22 +164,57 @@ tpm:
 
 from ..module_utils.api import TpmProjectApi
 from ..module_utils.base_module import TpmModuleBase
+from ..module_utils.project_tree import SEPARATOR, AmbiguousProjectError
 
 
 class TpmModule(TpmModuleBase, TpmProjectApi):
-    pass
 
+    def fn_data(self, params: dict) -> dict:
+        """Return the entry data, the parent of a project given by path resolved from it"""
+        data = super().fn_data(params)
+        name = (data.get('name') or '').strip(SEPARATOR)
+        if SEPARATOR in name:
+            parent_path, data['name'] = name.rsplit(SEPARATOR, 1)
+            data['parent_id'] = self.getByPath(parent_path)['id']
+        return data
 
-def main():
-    TpmModule(
+    def fn_existing(self, data: dict) -> dict:
+        """Return the project with the same name under the same parent, from the project tree
+
+        Without parent, the only project with that name, wherever it is.
+        """
+        if data.get('parent_id') is not None:
+            return self.findChild(data.get('name'), parent_id=data.get('parent_id'))
+
+        tree = self.projectTree()
+        projects = tree.named(data.get('name'))
+        if not projects:
+            projects = self.projectTree(outdated=tree).named(data.get('name'))
+        if len(projects) > 1:
+            raise AmbiguousProjectError('Project name "{n}" is ambiguous, set parent_id or use one of the paths: {p}'.format(
+                n=data.get('name'), p=', '.join(sorted(p['path'] for p in projects))))
+        return projects[0] if projects else None
+
+    def create(self, name, parent_id=None, **kwargs):
+        """Return newly created project, at the root unless a parent is given"""
+        return TpmProjectApi.create(self, name, parent_id or 0, **kwargs)
+
+
+def module_args():
+    """Return the TpmModule constructor arguments, shared with the action plugin"""
+    return dict(
         argument_spec=dict(
             name=dict(type='str', required=True),
-            parent_id=dict(type='int', default=0),
+            parent_id=dict(type='int', default=None),
             tags=dict(type='list', default=[], elements='str'),
             notes=dict(type='str', default=None),
         ),
         supports_check_mode=False,
-    ).run()
+    )
+
+
+def main():
+    TpmModule(**module_args()).run()
 
 
 if __name__ == "__main__":
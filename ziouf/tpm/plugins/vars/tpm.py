@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+DOCUMENTATION = r'''
+name: tpm
+author: Cyril Marin (@ziouf)
+version_added: "2.10.4"
+short_description: Resolve the Team Password Manager secrets of the whole inventory at once
+description:
+    - Reads the C(tpm_secrets) mapping of every host, variable name to TPM query, and sets each variable to the
+      matching password entry field, as a host variable.
+    - The mappings of every host of the inventory are templated when the first host is loaded, then each distinct
+      query is resolved once, concurrently, and kept for the whole run. Secret resolution costs one search per
+      distinct query, whatever the number of hosts.
+    - Mappings are templated with the inventory variables of the host, and those of the C(group_vars) and
+      C(host_vars) directories next to the inventory or the playbook.
+    - TPM connection settings are read from the C(tpm_hostname), C(tpm_public_key), C(tpm_private_key),
+      C(tpm_username) and C(tpm_password) variables of the host, or else the C(TPM_*) environment variables,
+      like lookups do.
+    - Resolved secrets are host variables, shown by C(ansible-inventory --list).
+requirements:
+    - enable in configuration, C(vars_plugins_enabled = host_group_vars,ziouf.tpm.tpm) in ansible.cfg
+extends_documentation_fragment:
+    - vars_plugin_staging
+options:
+    field:
+        description: Field of the first matching entry (by name) a variable is set to, unless its mapping sets one
+        type: str
+        default: password
+        env:
+            - name: TPM_VARS_FIELD
+        ini:
+            - section: vars_tpm
+              key: field
+    workers:
+        description: Number of queries resolved concurrently
+        type: int
+        default: 8
+        env:
+            - name: TPM_VARS_WORKERS
+        ini:
+            - section: vars_tpm
+              key: workers
+'''
+
+EXAMPLES = r'''
+# group_vars/all.yml
+tpm_secrets:
+  db_pass: "name:db tag:{{ env }}"
+  ldap_bind_dn:
+    query: "name:ldap tag:{{ env }}"
+    field: username
+  smtp_pass:
+    query: "name:smtp tag:{{ env }}"
+    # Set when nothing matches, instead of failing
+    default: ""
+'''
+
+import threading
+
+from ansible.errors import AnsibleError
+from ansible.inventory.helpers import get_group_vars, sort_groups
+from ansible.inventory.host import Host
+from ansible.module_utils.common.dict_transformations import dict_merge
+from ansible.plugins.loader import vars_loader
+from ansible.plugins.vars import BaseVarsPlugin
+from ansible.template import Templar
+from ansible.utils.unsafe_proxy import wrap_var
+from ansible.utils.vars import combine_vars
+
+from ..module_utils.api import TpmPasswordApi
+from ..module_utils.base_lookup import TpmLookupBase
+from ..module_utils.concurrency import parallel_map
+from ..module_utils.metrics import set_context
+
+# Default of a secret without default: a query matching nothing fails
+_REQUIRED = object()
+
+# TPM connection variables, read like lookups do
+CONNECTION_VARS = ('tpm_hostname', 'tpm_public_key', 'tpm_private_key', 'tpm_username', 'tpm_password')
+
+# Kept for the whole run: (TPM host, identity, query, field) -> (ok, value or error)
+_RESOLVED = {}
+# (path, host) -> variables set for the host
+_HOST_VARS = {}
+_LOCK = threading.Lock()
+
+
+class VarsModule(BaseVarsPlugin):
+
+    def get_vars(self, loader, path, entities, cache=True):
+        super(VarsModule, self).get_vars(loader, path, entities)
+        if not isinstance(entities, list):
+            entities = [entities]
+
+        data = {}
+        for host in [e for e in entities if isinstance(e, Host)]:
+            with _LOCK:
+                if (path, host.name) not in _HOST_VARS:
+                    self.resolve_inventory(loader, path, host)
+                data = combine_vars(data, self.host_vars(path, host))
+
+        return data
+
+    def resolve_inventory(self, loader, path, host):
+        """Resolve the secrets of every host of the inventory the given host belongs to"""
+        all_group = next((g for g in host.get_groups() if g.name == 'all'), None)
+        hosts = all_group.get_hosts() if all_group is not None else [host]
+
+        secrets = {}
+        for h in hosts:
+            secrets[h.name] = self.host_secrets(loader, path, h)
+
+        pending = {}
+        for name, (config, mapping) in secrets.items():
+            for var, (query, field, default) in mapping.items():
+                key = self.key(config, query, field)
+                if key not in _RESOLVED:
+                    pending.setdefault(key, config)
+
+        if pending:
+            set_context(plugin=self._load_name)
+            self._display.vv('Resolving {n} distinct TPM queries for {h} hosts'.format(n=len(pending), h=len(hosts)))
+            keys = list(pending)
+            results = parallel_map(lambda key: self.resolve(pending[key], key[2], key[3]), keys,
+                                   workers=self.get_option('workers'))
+            _RESOLVED.update(zip(keys, results))
+
+        for name, (config, mapping) in secrets.items():
+            _HOST_VARS[(path, name)] = (config, mapping)
+
+    def host_secrets(self, loader, path, host):
+        """Return the TPM config and the {variable: (query, field, default)} mapping of a host"""
+        variables = get_group_vars(host.get_groups())
+        variables = combine_vars(variables, host.get_vars())
+
+        # group_vars and host_vars files are loaded by another vars plugin: read them as well
+        files = vars_loader.get('host_group_vars')
+        if files is not None:
+            variables = combine_vars(variables, files.get_vars(loader, path, sort_groups(host.get_groups())))
+            variables = combine_vars(variables, files.get_vars(loader, path, [host]))
+
+        mapping = variables.get('tpm_secrets') or {}
+        if not isinstance(mapping, dict):
+            raise AnsibleError('tpm_secrets of {h} must be a mapping of variable names to TPM queries'.format(h=host.name))
+
+        templar = Templar(loader=loader, variables=variables)
+        secrets = {}
+        for var, spec in mapping.items():
+            if not isinstance(spec, dict):
+                spec = dict(query=spec)
+            if not spec.get('query'):
+                raise AnsibleError('tpm_secrets.{v} of {h} has no query'.format(v=var, h=host.name))
+            secrets[var] = (templar.template(spec['query']), spec.get('field') or self.get_option('field'),
+                            spec.get('default', _REQUIRED))
+
+        keys = TpmLookupBase.task_keys(dict(
+            (k, templar.template(v)) for k, v in variables.items() if k in CONNECTION_VARS))
+        config = dict_merge(TpmPasswordApi.default_config(), {
+            'tpm_hostname': keys.get('hostname'),
+            'tpm_public_key': keys.get('public_key'),
+            'tpm_private_key': keys.get('private_key'),
+            'tpm_username': keys.get('username'),
+            'tpm_password': keys.get('password'),
+            'use_hmac': all([keys.get('public_key'), keys.get('private_key')]),
+        })
+        return config, secrets
+
+    @staticmethod
+    def key(config, query, field):
+        identity = config.get('tpm_public_key') or config.get('tpm_username')
+        return (config.get('tpm_hostname'), identity, query, field)
+
+    @staticmethod
+    def resolve(config, query, field):
+        """Return (True, field of the first entry matching query) or (False, error), never raise"""
+        try:
+            api = TpmPasswordApi(config)
+            found = sorted(api.find(query, fields=('id', 'name')), key=lambda x: x.get('name') or '')
+            if not found:
+                return False, 'Query "{q}" did not match any result'.format(q=query)
+
+            entry = api.getById(found[0]['id'])
+            if field not in entry:
+                return False, 'Entry matching "{q}" has no field {f}'.format(q=query, f=field)
+            return True, entry[field]
+        except Exception as e:
+            return False, 'Query "{q}" failed: {e}'.format(q=query, e=e)
+
+    def host_vars(self, path, host):
+        config, mapping = _HOST_VARS[(path, host.name)]
+        data = {}
+        for var, (query, field, default) in mapping.items():
+            ok, value = _RESOLVED[self.key(config, query, field)]
+            if not ok:
+                if default is _REQUIRED:
+                    raise AnsibleError('tpm_secrets.{v} of {h}: {e}'.format(v=var, h=host.name, e=value))
+                value = default
+            data[var] = wrap_var(value)
+        return data
+
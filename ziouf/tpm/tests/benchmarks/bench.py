@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+# Benchmarks of the TPM client against the local mock server (mock_tpm.py)
+#
+#   python tests/benchmarks/bench.py --dataset 5000 --page-size 100 --latency 0.005
+#   python tests/benchmarks/bench.py --compare bench-<old commit>.json
+#
+# Every scenario reports lookups per second, p50/p99 latency, requests
+# issued to the server per operation and peak memory (tracemalloc). Results
+# are saved as JSON, named after the current commit, for comparison.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+COLLECTIONS_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', '..'))
+
+
+def install_collection_loader():
+    """Make ansible_collections.ziouf.* and the plugin loaders find this checkout"""
+    from ansible.utils.collection_loader._collection_finder import _AnsibleCollectionFinder
+
+    _AnsibleCollectionFinder(paths=[COLLECTIONS_ROOT])._install()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def measure(name, operation, iterations, tpm):
+    """Run operation(i) `iterations` times, return its statistics"""
+    operation(0)    # warm up: connections, caches, snapshot
+    requests = tpm.request_count()
+
+    latencies = []
+    tracemalloc.start()
+    started = time.time()
+    for i in range(iterations):
+        start = time.time()
+        operation(i)
+        latencies.append(time.time() - start)
+    elapsed = time.time() - started
+    dummy, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(
+        scenario=name,
+        iterations=iterations,
+        ops_per_second=iterations / elapsed if elapsed else None,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+        requests_per_op=(tpm.request_count() - requests) / float(iterations),
+        peak_memory_kb=peak / 1024.0,
+    )
+
+
+def scenarios(tpm, args):
+    """Return [(name, operation)], operation takes the iteration number"""
+    from ansible.plugins.loader import lookup_loader
+    from ansible_collections.ziouf.tpm.plugins.module_utils.api import TpmPasswordApi
+    from ansible_collections.ziouf.tpm.plugins.module_utils.cache import invalidate_caches
+    from ansible_collections.ziouf.tpm.plugins.action.password import ActionModule
+
+    config = tpm.config(tpm_rate_limit=args.rate_limit)
+    api = TpmPasswordApi(config)
+    ids = sorted(tpm.passwords)
+    lookup = lookup_loader.get('ziouf.tpm.password')
+    lookup_options = dict(hostname=config['tpm_hostname'], public_key=tpm.public_key,
+                          private_key=tpm.private_key, workers=args.workers, rate_limit=args.rate_limit)
+
+    def query(i):
+        return 'username:user{u} tag:env{e}'.format(u=i % 50, e=i % 4)
+
+    def lookup_query(i, **options):
+        invalidate_caches()
+        return lookup.run([query(i)], variables={}, field='password', **dict(lookup_options, **options))
+
+    def module_present(i):
+        return ActionModule(None, None, None, None, None, None).run_module(dict(
+            config, name='secret-{i}'.format(i=ids[i % len(ids)]), project_name='project-1'))
+
+    return [
+        ('api.getById', lambda i: api.getById(ids[i % len(ids)])),
+        ('api.findFirst', lambda i: api.findFirst(query(i))),
+        ('api.find', lambda i: api.find(query(i))),
+        ('api.list', lambda i: list(api._http_iter('api/v4/passwords.json'))),
+        ('lookup.password', lookup_query),
+        ('lookup.password.wantlist', lambda i: lookup_query(i, wantlist=True)),
+        ('lookup.password.snapshot', lambda i: lookup_query(i, source='snapshot', snapshot_path=args.snapshot)),
+        ('module.password.present', module_present),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, previous):
+    previous = dict((r['scenario'], r) for r in previous['results'])
+    for r in results['results']:
+        before = previous.get(r['scenario'])
+        if before is None or not before['ops_per_second']:
+            continue
+        print('{s:<28} {o:+7.1f}% ops/s  p99 {b:.2f} -> {a:.2f} ms  requests/op {rb:.2f} -> {ra:.2f}'.format(
+            s=r['scenario'], o=(r['ops_per_second'] / before['ops_per_second'] - 1) * 100,
+            b=before['p99_ms'], a=r['p99_ms'], rb=before['requests_per_op'], ra=r['requests_per_op']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ziouf.tpm client against a mock TPM server')
+    parser.add_argument('--dataset', type=int, default=1000, help='number of passwords served')
+    parser.add_argument('--page-size', type=int, default=100, help='items per page of lists and searches')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds waited by the server per request')
+    parser.add_argument('--iterations', type=int, default=100, help='operations per scenario')
+    parser.add_argument('--workers', type=int, default=4, help='lookup workers')
+    parser.add_argument('--server-rate-limit', type=int, help='requests per second served, 429 beyond')
+    parser.add_argument('--rate-limit', type=float, default=0, help='requests per second sent (tpm_rate_limit)')
+    parser.add_argument('--scenario', action='append', help='only run the given scenarios')
+    parser.add_argument('--output', help='results file, bench-<commit>.json by default')
+    parser.add_argument('--compare', help='previous results file to compare with')
+    args = parser.parse_args(argv)
+
+    install_collection_loader()
+    from ansible_collections.ziouf.tpm.tests.benchmarks.mock_tpm import MockTpmServer
+
+    results = dict(
+        commit=git_commit(),
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        parameters=dict(dataset=args.dataset, page_size=args.page_size, latency=args.latency,
+                        iterations=args.iterations, workers=args.workers,
+                        server_rate_limit=args.server_rate_limit, rate_limit=args.rate_limit),
+        results=[],
+    )
+
+    args.snapshot = os.path.join(os.path.abspath('.'), '.bench-snapshot')
+    with MockTpmServer(dataset_size=args.dataset, page_size=args.page_size, latency=args.latency,
+                       rate_limit=args.server_rate_limit) as tpm:
+        # The lookups verify TLS: trust the certificate of the mock server
+        os.environ['SSL_CERT_FILE'] = tpm.certfile
+        try:
+            for name, operation in scenarios(tpm, args):
+                if args.scenario and name not in args.scenario:
+                    continue
+                r = measure(name, operation, args.iterations, tpm)
+                results['results'].append(r)
+                print('{scenario:<28} {ops_per_second:9.1f} ops/s  p50 {p50_ms:7.2f} ms  p99 {p99_ms:7.2f} ms'
+                      '  {requests_per_op:6.2f} requests/op  {peak_memory_kb:9.1f} KiB peak'.format(**r))
+        finally:
+            for path in (args.snapshot, args.snapshot + '.lock'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    output = args.output or 'bench-{c}.json'.format(c=results['commit'])
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to {o}'.format(o=output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+# Local HTTPS mock of the TPM v4 API, for benchmarks and end to end tests:
+#
+#   with MockTpmServer(dataset_size=5000, page_size=100, latency=0.005) as tpm:
+#       api = TpmPasswordApi(tpm.config())
+
+import os
+import re
+import ssl
+import hmac
+import json
+import time
+import base64
+import codecs
+import shutil
+import hashlib
+import datetime
+import ipaddress
+import tempfile
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from ansible_collections.ziouf.tpm.plugins.module_utils.snapshot import QueryError, TpmSnapshot
+
+PUBLIC_KEY = 'bench-public-key'
+PRIVATE_KEY = 'bench-private-key'
+
+# Fields only returned by the detail of a password
+DETAIL_FIELDS = ('password',) + tuple('custom_field{i}'.format(i=i) for i in range(1, 11))
+
+ROUTES = [
+    ('GET', re.compile(r'^api/v4/generate_password\.json$'), 'generate'),
+    ('GET', re.compile(r'^api/v4/passwords(?:/page/(?P<page>\d+))?\.json$'), 'list_passwords'),
+    ('GET', re.compile(r'^api/v4/passwords/search/(?P<query>[^/]*)(?:/page/(?P<page>\d+))?\.json$'), 'search_passwords'),
+    ('GET', re.compile(r'^api/v4/passwords/(?P<id>\d+)\.json$'), 'get_password'),
+    ('POST', re.compile(r'^api/v4/passwords\.json$'), 'create_password'),
+    ('PUT', re.compile(r'^api/v4/passwords/(?P<id>\d+)\.json$'), 'update_password'),
+    ('DELETE', re.compile(r'^api/v4/passwords/(?P<id>\d+)\.json$'), 'delete_password'),
+    ('GET', re.compile(r'^api/v4/projects(?:/page/(?P<page>\d+))?\.json$'), 'list_projects'),
+    ('GET', re.compile(r'^api/v4/projects/search/(?P<query>[^/]*)(?:/page/(?P<page>\d+))?\.json$'), 'search_projects'),
+    ('GET', re.compile(r'^api/v4/projects/(?P<id>\d+)\.json$'), 'get_project'),
+]
+
+
+def self_signed_certificate(directory):
+    """Write a self-signed certificate for 127.0.0.1, return (certfile, keyfile)
+
+    Clients verifying TLS trust it with SSL_CERT_FILE=<certfile>.
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'127.0.0.1')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(
+        key.public_key()).serial_number(x509.random_serial_number()).not_valid_before(
+        now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1)).add_extension(
+        x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address(u'127.0.0.1'))]), critical=False).add_extension(
+        x509.BasicConstraints(ca=True, path_length=None), critical=True).sign(key, hashes.SHA256())
+
+    certfile, keyfile = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    with open(certfile, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+def dataset(size, projects=10):
+    """Return (passwords, projects) of a deterministic dataset"""
+    project_list = [{'id': p, 'name': 'project-{p}'.format(p=p), 'tags': 'bench', 'parent_id': 0}
+                    for p in range(1, projects + 1)]
+    passwords = []
+    for i in range(1, size + 1):
+        project = project_list[i % projects]
+        passwords.append({
+            'id': i,
+            'name': 'secret-{i}'.format(i=i),
+            'project': {'id': project['id'], 'name': project['name']},
+            'tags': 'bench,env{e}'.format(e=i % 4),
+            'access_info': 'https://host-{i}.example.com'.format(i=i),
+            'username': 'user{u}'.format(u=i % 50),
+            'email': 'user{u}@example.com'.format(u=i % 50),
+            'password': hashlib.sha256(codecs.encode(str(i))).hexdigest()[:20],
+            'notes': None,
+            'updated_on': '2024-01-01 00:00:00',
+        })
+    return passwords, project_list
+
+
+class MockTpmServer():
+    """Threaded HTTPS server answering like the TPM v4 API
+
+    Lists and searches are paginated by `page_size` with 'Link: rel="next"'
+    headers, every request waits `latency` seconds and must be signed with
+    the HMAC keys (or Basic credentials) of the server. Beyond `rate_limit`
+    requests per second, requests are answered 429 with a Retry-After
+    header. Searches are evaluated with the snapshot query engine.
+    `requests` counts the requests served, by route ('throttled' for 429).
+    """
+
+    def __init__(self, dataset_size=1000, page_size=100, latency=0.0, projects=10,
+                 public_key=PUBLIC_KEY, private_key=PRIVATE_KEY, username=None, password=None,
+                 rate_limit=None):
+        self.page_size = page_size
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.public_key = public_key
+        self.private_key = private_key
+        self.username = username
+        self.password = password
+
+        passwords, project_list = dataset(dataset_size, projects=projects)
+        self.passwords = dict((p['id'], p) for p in passwords)
+        self.projects = dict((p['id'], p) for p in project_list)
+        self.requests = {}
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._window = (0, 0)
+        self._tmpdir = None
+        self._server = None
+        self.certfile = None
+
+    def config(self, **extra):
+        """Return the api configuration (tpm_* keys) reaching this server"""
+        config = {
+            'tpm_hostname': '127.0.0.1:{p}'.format(p=self.port),
+            'tpm_ssl_verify': False,
+        }
+        if self.username:
+            config.update(tpm_username=self.username, tpm_password=self.password)
+        else:
+            config.update(tpm_public_key=self.public_key, tpm_private_key=self.private_key)
+        config.update(extra)
+        return config
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def request_count(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+    def start(self):
+        self._tmpdir = tempfile.mkdtemp()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.certfile, keyfile = self_signed_certificate(self._tmpdir)
+        context.load_cert_chain(self.certfile, keyfile)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(self))
+        self._server.daemon_threads = True
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def admit(self):
+        """Return whether a request fits in the rate limit of the current second"""
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            second, count = self._window
+            now = int(time.time())
+            count = count + 1 if second == now else 1
+            self._window = (now, count)
+            return count <= self.rate_limit
+
+    # Authentication
+
+    def authorized(self, path, headers, body):
+        if self.username:
+            expected = 'Basic {c}'.format(c=codecs.decode(base64.b64encode(
+                codecs.encode('{u}:{p}'.format(u=self.username, p=self.password)))))
+            return hmac.compare_digest(headers.get('Authorization') or '', expected)
+
+        timestamp = headers.get('X-Request-Timestamp') or ''
+        signature = hmac.new(codecs.encode(self.private_key),
+                             codecs.encode(path + timestamp + codecs.decode(body)),
+                             hashlib.sha256).hexdigest()
+        return headers.get('X-Public-Key') == self.public_key \
+            and hmac.compare_digest(headers.get('X-Request-Hash') or '', signature)
+
+    # Routes, return (status, body, next_page_path)
+
+    def paginate(self, items, path, page):
+        page = int(page or 1)
+        start = (page - 1) * self.page_size
+        next_page = None
+        if start + self.page_size < len(items):
+            next_page = re.sub(r'(?:/page/\d+)?\.json$', '/page/{p}.json'.format(p=page + 1), path)
+        return 200, items[start:start + self.page_size], next_page
+
+    @staticmethod
+    def summary(entry):
+        return dict((k, v) for k, v in entry.items() if k not in DETAIL_FIELDS)
+
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                self._index = TpmSnapshot(sorted(self.passwords.values(), key=lambda p: p['name']))
+            return self._index
+
+    def generate(self, path):
+        return 200, {'password': base64.b64encode(os.urandom(12)).decode('ascii')}, None
+
+    def list_passwords(self, path, page=None):
+        return self.paginate([self.summary(p) for p in self.index().entries], path, page)
+
+    def search_passwords(self, path, query, page=None):
+        try:
+            items = self.index().search(unquote(query))
+        except QueryError:
+            items = []
+        return self.paginate([self.summary(p) for p in items], path, page)
+
+    def get_password(self, path, id):
+        entry = self.passwords.get(int(id))
+        return (200, entry, None) if entry else (404, {'error': True}, None)
+
+    def create_password(self, path, body):
+        with self._lock:
+            id = max(self.passwords) + 1 if self.passwords else 1
+            project = self.projects.get(body.get('project_id')) or {}
+            entry = dict(body, id=id, project={'id': project.get('id'), 'name': project.get('name')},
+                         updated_on=time.strftime('%Y-%m-%d %H:%M:%S'))
+            entry.pop('project_id', None)
+            self.passwords[id] = entry
+            self._index = None
+        return 201, {'id': id}, None
+
+    def update_password(self, path, id, body):
+        with self._lock:
+            if int(id) not in self.passwords:
+                return 404, {'error': True}, None
+            self.passwords[int(id)].update(body, updated_on=time.strftime('%Y-%m-%d %H:%M:%S'))
+            self._index = None
+        return 204, None, None
+
+    def delete_password(self, path, id):
+        with self._lock:
+            if self.passwords.pop(int(id), None) is None:
+                return 404, {'error': True}, None
+            self._index = None
+        return 204, None, None
+
+    def list_projects(self, path, page=None):
+        return self.paginate(sorted(self.projects.values(), key=lambda p: p['name']), path, page)
+
+    def search_projects(self, path, query, page=None):
+        query = unquote(query).lower()
+        return self.paginate([p for p in sorted(self.projects.values(), key=lambda p: p['name'])
+                              if query in p['name'].lower()], path, page)
+
+    def get_project(self, path, id):
+        entry = self.projects.get(int(id))
+        return (200, entry, None) if entry else (404, {'error': True}, None)
+
+
+def _handler(tpm):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are separate writes: no Nagle / delayed ACK stall
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle_request(self, method):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            path = self.path.split('/index.php/', 1)[-1]
+
+            if tpm.latency:
+                time.sleep(tpm.latency)
+
+            for route_method, pattern, name in ROUTES:
+                matcher = pattern.match(path)
+                if route_method == method and matcher:
+                    break
+            else:
+                return self.respond(404, {'error': True})
+
+            if not tpm.admit():
+                name = 'throttled'
+            with tpm._lock:
+                tpm.requests[name] = tpm.requests.get(name, 0) + 1
+            if name == 'throttled':
+                return self.respond(429, {'error': True, 'message': 'Too many requests'}, retry_after=1)
+
+            if not tpm.authorized(path, self.headers, body):
+                return self.respond(401, {'error': True, 'message': 'Unauthorized'})
+
+            kwargs = dict((k, v) for k, v in matcher.groupdict().items() if v is not None)
+            if method in ('POST', 'PUT'):
+                kwargs['body'] = json.loads(codecs.decode(body))
+            status, data, next_page = getattr(tpm, name)(path, **kwargs)
+            self.respond(status, data, next_page)
+
+        def respond(self, status, data, next_page=None, retry_after=None):
+            payload = b'' if data is None else codecs.encode(json.dumps(data))
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            if retry_after:
+                self.send_header('Retry-After', str(retry_after))
+            if next_page:
+                self.send_header('Link', '<https://127.0.0.1:{p}/index.php/{n}>; rel="next"'.format(
+                    p=tpm.port, n=next_page))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self.handle_request('GET')
+
+        def do_POST(self):
+            self.handle_request('POST')
+
+        def do_PUT(self):
+            self.handle_request('PUT')
+
+        def do_DELETE(self):
+            self.handle_request('DELETE')
+
+    return Handler
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from unittest import TestCase
+
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import (
+    TpmPasswordApi,
+    FindError,
+)
+from ansible_collections.ziouf.tpm.tests.benchmarks.mock_tpm import MockTpmServer
+
+
+class TestMockTpm(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tpm = MockTpmServer(dataset_size=250, page_size=100).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tpm.stop()
+
+    def test_pages_are_followed(self):
+        api = TpmPasswordApi(self.tpm.config())
+        requests = self.tpm.request_count()
+
+        self.assertEqual(250, len(list(api._http_iter('api/v4/passwords.json'))))
+        self.assertEqual(3, self.tpm.request_count() - requests)
+
+    def test_search_and_detail(self):
+        api = TpmPasswordApi(self.tpm.config())
+
+        found = api.find('username:user7 tag:env3')
+        self.assertListEqual([7, 107, 207], sorted(p['id'] for p in found))
+        self.assertNotIn('password', found[0])
+        self.assertEqual(self.tpm.passwords[7]['password'], api.getById(7)['password'])
+
+    def test_signature_is_verified(self):
+        api = TpmPasswordApi(self.tpm.config(tpm_private_key='wrong'))
+
+        with self.assertRaises(FindError):
+            api.find('username:user7')
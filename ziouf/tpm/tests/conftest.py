@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import pytest
+
+from ansible_collections.ziouf.tpm.plugins.module_utils import negative_cache, shared_state
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Keep the states and misses shared by the processes of the controller out of the home directory"""
+    monkeypatch.setenv(shared_state.STATE_DIR_ENV, str(tmp_path / 'state'))
+    monkeypatch.setenv(negative_cache.CACHE_DIR_ENV, str(tmp_path / 'misses'))
+    shared_state.reset_states()
+    yield
+    shared_state.reset_states()
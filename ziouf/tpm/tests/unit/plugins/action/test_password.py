@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible.module_utils import basic
+from ansible_collections.ziouf.tpm.plugins.action.password import ActionModule
+from ansible_collections.ziouf.tpm.plugins.module_utils import base_action
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import TpmProjectResolver
+from ansible_collections.ziouf.tpm.plugins.modules import password
+
+CONNECTION_ARGS = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_username': 'user',
+    'tpm_password': 'pass',
+}
+
+
+class TestPasswordAction(TestCase):
+    def setUp(self):
+        TpmProjectResolver.invalidate()
+
+    def run_action(self, args, check_mode=False, task_vars=None, delegate_to=None):
+        task = MagicMock(args=dict(CONNECTION_ARGS, **args), action='ziouf.tpm.password',
+                         async_val=0, check_mode=check_mode, diff=False, no_log=False, delegate_to=delegate_to)
+        connection = MagicMock(has_native_async=False)
+        templar = MagicMock()
+        templar.template.side_effect = lambda value: value
+        action = ActionModule(task, connection, MagicMock(), MagicMock(), templar, MagicMock())
+
+        with patch.object(password.TpmModule, 'findFirst', return_value=None), \
+             patch.object(password.TpmModule, 'projectId', return_value=10), \
+             patch.object(password.TpmModule, '_http_post', return_value={'id': 100}) as post, \
+             patch.object(password.TpmModule, 'getById', return_value={'id': 100, 'name': 'new'}), \
+             patch.object(action, '_execute_module', return_value={'changed': True, 'remote': True}):
+            return action.run(task_vars=task_vars or {}), post, connection
+
+    def test_module_runs_on_controller(self):
+        args = basic._ANSIBLE_ARGS
+        result, post, connection = self.run_action({'name': 'new', 'project_name': 'project',
+                                                    'password': 'secret'})
+
+        self.assertTrue(result['changed'])
+        self.assertEqual(100, result['result']['tpm']['id'])
+        self.assertEqual(10, post.call_args[1]['body']['project_id'])
+        self.assertEqual([], connection.method_calls)
+        self.assertIs(args, basic._ANSIBLE_ARGS)
+
+    def test_no_log_parameters_are_masked(self):
+        result, dummy, dummy = self.run_action({'name': 'new', 'project_name': 'project',
+                                                'password': 'secret'})
+
+        self.assertNotIn('pass', result['invocation']['module_args'].values())
+
+    def test_failure(self):
+        result, dummy, dummy = self.run_action({'name': 'new'})
+
+        self.assertTrue(result['failed'])
+        self.assertIn('project_name', result['msg'])
+
+    def test_check_mode_is_not_supported(self):
+        result, post, dummy = self.run_action({'name': 'new', 'project_name': 'project'}, check_mode=True)
+
+        self.assertTrue(result['skipped'])
+        post.assert_not_called()
+
+    def test_module_runs_on_target_host(self):
+        for kwargs in (dict(task_vars={'tpm_run_on_controller': 'no'}), dict(delegate_to='bastion')):
+            result, post, dummy = self.run_action({'name': 'new', 'project_name': 'project'}, **kwargs)
+
+            self.assertTrue(result['remote'])
+            post.assert_not_called()
+
+    def test_module_runs_on_target_host_without_in_process_support(self):
+        with patch.object(base_action, 'IN_PROCESS_SUPPORTED', new=False):
+            result, post, dummy = self.run_action({'name': 'new', 'project_name': 'project'})
+
+        self.assertTrue(result['remote'])
+        post.assert_not_called()
+
+    def test_module_delegated_to_controller_runs_in_process(self):
+        result, post, dummy = self.run_action({'name': 'new', 'project_name': 'project', 'password': 'secret'},
+                                              delegate_to='localhost')
+
+        self.assertNotIn('remote', result)
+        post.assert_called_once()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import json
+import tempfile
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible_collections.ziouf.tpm.plugins.callback.metrics import CallbackModule
+from ansible_collections.ziouf.tpm.plugins.module_utils import metrics
+
+
+def request(host, total, page=1):
+    return {'host': host, 'task_name': 'lookup', 'method': 'GET', 'path': 'api/v4/passwords/1.json',
+            'page': page, 'retries': 0, 'bytes_sent': 0, 'bytes_received': 100, 'total': total,
+            'timings': {'wait': total}}
+
+
+class TestMetricsCallback(TestCase):
+    def setUp(self):
+        self.callback = CallbackModule()
+        self.callback._display = MagicMock()
+        self.output = tempfile.mktemp()
+        self.options = {'top': 1, 'output': self.output}
+
+    def tearDown(self):
+        self.callback.v2_playbook_on_stats(None)
+        if os.path.exists(self.output):
+            os.remove(self.output)
+
+    def spool(self, pid, requests):
+        with open(os.path.join(self.callback.spool, '{p}.jsonl'.format(p=pid)), 'w') as f:
+            for r in requests:
+                f.write(json.dumps(r) + '\n')
+
+    def test_spool_dir_is_exported(self):
+        self.assertEqual(self.callback.spool, os.environ[metrics.SPOOL_DIR_ENV])
+
+    def test_report(self):
+        self.spool(1, [request('web1', 0.5), request('web1', 0.1)])
+        self.spool(2, [request('web2', 2.0)])
+
+        with patch.object(self.callback, 'get_option', side_effect=self.options.get):
+            self.callback.report()
+
+        lines = [c[0][0] for c in self.callback._display.display.call_args_list]
+        self.assertIn('  web2: 1 requests, 1 pages, 0 retries, 100 bytes, 2.000s', lines)
+        self.assertIn('  web1: 2 requests, 2 pages, 0 retries, 200 bytes, 0.600s', lines)
+        self.assertEqual(1, len([line for line in lines if line.startswith('  2.000s')]))
+        self.assertEqual(0, len([line for line in lines if line.startswith('  0.500s')]))
+        self.assertListEqual([], os.listdir(self.callback.spool))
+
+        with open(self.output) as f:
+            self.assertEqual(3, len(f.readlines()))
@@ -23,6 +23,11 @@ except ImportError:                 # Python 2.x
 
 # from ansible_collections.ziouf.tpm.plugins.lookup import password
 from ansible.plugins.loader import lookup_loader
+from ansible_collections.ziouf.tpm.plugins.lookup import password as password_lookup
+from ansible_collections.ziouf.tpm.plugins.module_utils import cache
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import FindError
+from ansible_collections.ziouf.tpm.plugins.module_utils.breaker import CircuitOpenError
+from ansible_collections.ziouf.tpm.plugins.module_utils.cache import invalidate_caches
 
 MOCK_RESPONSE_FIND = [
     {
@@ -111,4 +116,122 @@ class TestLookupModule(TestCase):
                 [MOCK_RESPONSE_GET[0]], 
                 self.lookup.run(['test query'], {}, field='all')
             )
-    
\ No newline at end of file
+
+    def test_cached_query(self):
+        find = MagicMock(side_effect=mock_find)
+        with patch.object(self.lookup, 'find', new=find), \
+             patch.object(self.lookup, 'getById', new=mock_getById):
+
+            for dummy in range(2):
+                self.assertListEqual(
+                    [MOCK_RESPONSE_GET[0]['password']],
+                    self.lookup.run(['cached query'], {}, cache=True)
+                )
+
+        self.assertEqual(1, find.call_count)
+
+    def test_cache_invalidated_on_update(self):
+        find = MagicMock(side_effect=mock_find)
+        with patch.object(self.lookup, 'find', new=find), \
+             patch.object(self.lookup, 'getById', new=mock_getById):
+
+            self.lookup.run(['invalidated query'], {}, cache=True)
+            invalidate_caches(self.lookup.config.get('tpm_hostname'))
+            self.lookup.run(['invalidated query'], {}, cache=True)
+
+        self.assertEqual(2, find.call_count)
+
+    def test_cache_keys_are_per_lookup(self):
+        project = lookup_loader.get('ziouf.tpm.project')
+        self.lookup.config = project.config = dict(tpm_hostname='tpm', tpm_username='user')
+
+        # Shared by the lookups with the file cache backend
+        self.assertNotEqual(self.lookup.cache_key('find', 'query', False), project.cache_key('find', 'query', False))
+
+    def test_refresh_keeps_the_options_of_its_call(self):
+        self.lookup.config = dict(tpm_hostname='tpm')
+        self.lookup.set_options(direct=dict(field='name'))
+        refresh = self.lookup.detached(self.lookup.fn_map)
+
+        # Reset by the next run while the refresh is pending
+        self.lookup.set_options(direct=dict(field='password'))
+        self.assertEqual('test0', refresh(MOCK_RESPONSE_GET[0]))
+        self.assertEqual('My5uperP@$$w0rd', self.lookup.fn_map(MOCK_RESPONSE_GET[0]))
+
+    def test_failed_fetch_is_discarded(self):
+        backend = MagicMock()
+        backend.get.return_value = backend.get_stale.return_value = (False, None)
+        self.lookup.set_options(direct=dict(cache=True))
+
+        with patch.object(self.lookup, 'get_cache', return_value=backend):
+            with self.assertRaises(FindError):
+                self.lookup.cached(('tpm', 'user', 'password', 'q'), MagicMock(side_effect=FindError('failed')))
+
+        backend.discard.assert_called_once_with(('tpm', 'user', 'password', 'q'))
+        backend.set.assert_not_called()
+
+    def test_cached_result_while_tpm_is_unavailable(self):
+        def unavailable(query_str, fields=None):
+            try:
+                raise CircuitOpenError('TPM is unavailable')
+            except CircuitOpenError as e:
+                raise FindError(e)
+
+        with patch.object(self.lookup, 'find', new=MagicMock(side_effect=mock_find)), \
+             patch.object(self.lookup, 'getById', new=mock_getById):
+            self.lookup.run(['outage query'], {}, cache=True)
+
+        # Expired for long, still returned while the circuit is open
+        with patch.object(self.lookup, 'find', new=MagicMock(side_effect=unavailable)), \
+             patch.object(cache.time, 'time', return_value=cache.time.time() + 3600):
+            self.assertListEqual(
+                [MOCK_RESPONSE_GET[0]['password']],
+                self.lookup.run(['outage query'], {}, cache=True)
+            )
+
+            with self.assertRaises(Exception):
+                self.lookup.run(['uncached query'], {}, cache=True)
+
+    def test_get_several_queries(self):
+        find = MagicMock(side_effect=lambda query_str, fields=None: [MOCK_RESPONSE_FIND[int(query_str[-1])]])
+        with patch.object(self.lookup, 'find', new=find), \
+             patch.object(self.lookup, 'getById', new=mock_getById):
+
+            self.assertListEqual(
+                [MOCK_RESPONSE_GET[1]['password'], MOCK_RESPONSE_GET[0]['password'], MOCK_RESPONSE_GET[1]['password']],
+                self.lookup.run(['query 1', 'query 0', 'query 1'], {})
+            )
+
+        self.assertEqual(2, find.call_count)
+
+    def test_get_several_ids(self):
+        getById = MagicMock(side_effect=mock_getById)
+        with patch.object(self.lookup, 'getById', new=getById):
+
+            self.assertListEqual(
+                [MOCK_RESPONSE_GET[1], MOCK_RESPONSE_GET[0], MOCK_RESPONSE_GET[1]],
+                self.lookup.run([], {}, id=[1, 0, 1])
+            )
+
+        self.assertEqual(2, getById.call_count)
+
+    def test_get_several_ids_field(self):
+        with patch.object(self.lookup, 'getById', new=mock_getById):
+            self.assertListEqual(
+                [MOCK_RESPONSE_GET[1], MOCK_RESPONSE_GET[0]],
+                self.lookup.run([], {}, id=[1, 0])
+            )
+            self.assertListEqual(
+                [MOCK_RESPONSE_GET[1]['password'], MOCK_RESPONSE_GET[0]['password']],
+                self.lookup.run([], {}, id=[1, 0], field='password')
+            )
+
+    def test_workers_are_shared_out_between_queries(self):
+        with patch.object(self.lookup, 'find', new=mock_find), \
+             patch.object(self.lookup, 'getById', new=mock_getById), \
+             patch('ansible_collections.ziouf.tpm.plugins.lookup.password.parallel_map',
+                   wraps=password_lookup.parallel_map) as pmap:
+            self.lookup.run(['query 0', 'query 1'], {}, workers=4)
+
+        # 2 queries at once, 2 details at once for each of them
+        self.assertListEqual([4, 2, 2], sorted([c[1]['workers'] for c in pmap.call_args_list], reverse=True))
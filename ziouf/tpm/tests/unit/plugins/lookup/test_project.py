@@ -23,6 +23,7 @@ except ImportError:                 # Python 2.x
 
 # from ansible_collections.ziouf.tpm.plugins.lookup import password
 from ansible.plugins.loader import lookup_loader
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import TpmProjectResolver
 
 MOCK_RESPONSE_FIND = [
     {
@@ -90,4 +91,17 @@ class TestLookupModule(TestCase):
                 [MOCK_RESPONSE_FIND[0]], 
                 self.lookup.run(['test query'], {}, field='all')
             )
-    
\ No newline at end of file
+    
+    def test_get_path_subtree(self):
+        projects = [
+            {'id': 1, 'name': 'infra', 'parent_id': 0},
+            {'id': 2, 'name': 'prod', 'parent_id': 1},
+            {'id': 3, 'name': 'nexus', 'parent_id': 2},
+        ]
+        TpmProjectResolver.invalidate()
+        with patch.object(self.lookup, 'listIter', side_effect=lambda: iter(projects)):
+            self.assertListEqual([3], self.lookup.run(['infra/prod/nexus'], {}, path=True))
+            self.assertListEqual(
+                ['infra/prod', 'infra/prod/nexus'],
+                self.lookup.run(['infra/prod'], {}, path=True, subtree=True, field='path')
+            )
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import json
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import (
+    FindError,
+    TpmPasswordApi,
+    TpmProjectApi,
+    TpmProjectResolver,
+)
+from ansible_collections.ziouf.tpm.plugins.module_utils import negative_cache
+from ansible_collections.ziouf.tpm.plugins.module_utils.connection import TpmResponse
+
+CONFIG = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_username': 'user',
+    'tpm_password': 'pass',
+    'tpm_negative_cache_ttl': 0,
+}
+
+
+def mock_pages(pages):
+    """Return a _http_request mock serving the given pages, chained by Link headers"""
+    responses = {}
+    for i, page in enumerate(pages):
+        path = 'api/v4/passwords/search/q.json' if i == 0 else 'api/v4/passwords/search/q/page/{p}.json'.format(p=i + 1)
+        headers = []
+        if i + 1 < len(pages):
+            headers.append(('Link', '<https://tpm.example.com/index.php/api/v4/passwords/search/q/page/{p}.json>; rel="next"'.format(p=i + 2)))
+        responses[path] = TpmResponse(200, headers, json.dumps(page).encode('utf-8'))
+
+    return MagicMock(side_effect=lambda method, path, body=None, page=None, decode=True: responses[path])
+
+
+class TestTpmApiBasePagination(TestCase):
+    def setUp(self):
+        self.api = TpmPasswordApi(dict(CONFIG))
+        self.pages = [[{'id': 3 * p + i} for i in range(3)] for p in range(4)]
+
+    def test_find_follows_every_page(self):
+        with patch.object(self.api, '_http_request', new=mock_pages(self.pages)) as request:
+            self.assertListEqual([{'id': i} for i in range(12)], self.api.find('q'))
+
+        self.assertEqual(4, request.call_count)
+
+    def test_find_first_fetches_first_page_only(self):
+        with patch.object(self.api, '_http_request', new=mock_pages(self.pages)) as request:
+            self.assertDictEqual({'id': 0}, self.api.findFirst('q'))
+
+        self.assertEqual(1, request.call_count)
+
+    def test_find_iter_is_lazy(self):
+        with patch.object(self.api, '_http_request', new=mock_pages(self.pages)) as request:
+            items = self.api.findIter('q')
+            self.assertEqual(0, request.call_count)
+            [next(items) for dummy in range(4)]
+            self.assertEqual(2, request.call_count)
+
+    def test_find_projects_fields(self):
+        pages = [[{'id': 3 * p + i, 'name': 'n', 'password': 'secret'} for i in range(3)] for p in range(2)]
+        with patch.object(self.api, '_http_request', new=mock_pages(pages)):
+            self.assertListEqual([{'id': i} for i in range(6)], self.api.find('q', fields=('id',)))
+
+    def test_find_first_default(self):
+        with patch.object(self.api, '_http_request', new=mock_pages([[]])):
+            self.assertIsNone(self.api.findFirst('q'))
+
+    def test_find_error(self):
+        response = TpmResponse(500, [], b'')
+        with patch.object(self.api, '_http_request', return_value=response):
+            self.assertRaises(FindError, self.api.find, 'q')
+
+
+def mock_empty_searches():
+    """Return a _http_request mock answering every search with no result"""
+    return MagicMock(side_effect=lambda method, path, body=None, page=None, decode=True: TpmResponse(200, [], b'[]'))
+
+
+class TestNegativeCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patch = patch.dict(negative_cache.os.environ, {negative_cache.CACHE_DIR_ENV: self.tmpdir})
+        self.patch.start()
+        self.api = TpmPasswordApi(dict(CONFIG, tpm_negative_cache_ttl=10))
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_miss_is_remembered(self):
+        with patch.object(self.api, '_http_request', new=mock_pages([[]])) as request:
+            self.assertIsNone(self.api.findFirst('q'))
+            self.assertListEqual([], self.api.find('q'))
+
+        self.assertEqual(1, request.call_count)
+
+    def test_miss_expires(self):
+        with patch.object(self.api, '_http_request', new=mock_pages([[]])) as request:
+            self.api.findFirst('q')
+            with patch.object(negative_cache.time, 'time', return_value=negative_cache.time.time() + 11):
+                self.api.findFirst('q')
+
+        self.assertEqual(2, request.call_count)
+
+    def test_password_write_forgets_every_password_miss(self):
+        projects = TpmProjectApi(dict(CONFIG, tpm_negative_cache_ttl=10))
+        with patch.object(self.api, '_http_request', new=mock_empty_searches()) as request, \
+             patch.object(projects, '_http_request', new=mock_empty_searches()) as project_request:
+            for query in ('name:db tag:prod', 'ldap'):
+                self.api.findFirst(query)
+            projects.findFirst('infra')
+            # Another fork creates a password: only TPM knows which searches it matches
+            negative_cache.forget_misses(CONFIG['tpm_hostname'], 'passwords')
+            for query in ('name:db tag:prod', 'ldap'):
+                self.api.findFirst(query)
+            projects.findFirst('infra')
+
+        self.assertEqual(4, request.call_count)
+        self.assertEqual(1, project_request.call_count)
+
+    def test_miss_directory_is_configurable(self):
+        with patch.object(self.api, '_http_request', new=mock_pages([[]])):
+            self.api.findFirst('q')
+
+        self.assertEqual(1, len(os.listdir(self.tmpdir)))
+
+    def test_project_write_forgets_every_miss(self):
+        with patch.object(self.api, '_http_request', new=mock_empty_searches()) as request:
+            self.api.findFirst('project:infra')
+            negative_cache.forget_misses(CONFIG['tpm_hostname'], 'projects')
+            self.api.findFirst('project:infra')
+
+        self.assertEqual(2, request.call_count)
+
+    def test_search_sent_before_a_write_is_not_remembered(self):
+        def written_meanwhile(method, path, body=None, page=None, decode=True):
+            negative_cache.forget_misses(CONFIG['tpm_hostname'], 'passwords')
+            return TpmResponse(200, [], b'[]')
+
+        with patch.object(self.api, '_http_request', new=MagicMock(side_effect=written_meanwhile)) as request:
+            self.api.findFirst('q')
+            self.api.findFirst('q')
+
+        self.assertEqual(2, request.call_count)
+
+    def test_hits_are_not_remembered(self):
+        with patch.object(self.api, '_http_request', new=mock_pages([[{'id': 1}]])) as request:
+            self.api.findFirst('q')
+            self.api.findFirst('q')
+
+        self.assertEqual(2, request.call_count)
+
+
+class TestTpmProjectResolver(TestCase):
+    def setUp(self):
+        TpmProjectResolver.invalidate()
+        self.api = TpmProjectApi(dict(CONFIG))
+        self.projects = [
+            {'id': 1, 'name': 'infra'},
+            {'id': 2, 'name': 'infra-prd'},
+            {'id': 3, 'name': 'apps'},
+        ]
+
+    def test_resolve_from_one_listing(self):
+        listing = MagicMock(side_effect=lambda: iter(self.projects))
+        find = MagicMock()
+        with patch.object(self.api, 'listIter', new=listing), \
+             patch.object(self.api, 'findIter', new=find):
+            self.assertEqual(1, TpmProjectResolver(self.api).resolve('infra'))
+            self.assertDictEqual(
+                {'infra': 1, 'apps': 3},
+                TpmProjectResolver(self.api).resolve_many(['infra', 'apps'])
+            )
+
+        self.assertEqual(1, listing.call_count)
+        self.assertEqual(0, find.call_count)
+
+    def test_resolve_unknown_project(self):
+        listing = MagicMock(side_effect=lambda: iter(self.projects))
+        with patch.object(self.api, 'listIter', new=listing):
+            self.assertRaises(FindError, TpmProjectResolver(self.api).resolve, 'unknown')
+
+        # Listed again, in case the project was created meanwhile
+        self.assertEqual(2, listing.call_count)
+
+    def test_resolve_path(self):
+        projects = self.projects + [
+            {'id': 4, 'name': 'nexus', 'parent_id': 1},
+            {'id': 5, 'name': 'nexus', 'parent_id': 3},
+        ]
+        with patch.object(self.api, 'listIter', side_effect=lambda: iter(projects)):
+            self.assertEqual(4, TpmProjectResolver(self.api).resolve('infra/nexus'))
+            self.assertEqual(5, self.api.getByPath('apps/nexus')['id'])
+            self.assertRaises(FindError, TpmProjectResolver(self.api).resolve, 'nexus')
+
+    def test_password_create_resolves_project_once(self):
+        passwords = TpmPasswordApi(dict(CONFIG))
+        find = MagicMock(side_effect=lambda: iter(self.projects))
+        post = MagicMock(return_value={'id': 100})
+
+        with patch.object(TpmProjectApi, 'listIter', new=find), \
+             patch.object(passwords, '_http_post', new=post), \
+             patch.object(passwords, 'getById', return_value={'id': 100}):
+            for i in range(3):
+                passwords.create('infra', 'entry{i}'.format(i=i), password='secret')
+
+        self.assertEqual(1, find.call_count)
+        self.assertEqual(1, post.call_args[1]['body']['project_id'])
+
+    def test_invalidated_by_project_write(self):
+        find = MagicMock(side_effect=lambda: iter(self.projects))
+        with patch.object(self.api, 'listIter', new=find), \
+             patch.object(self.api, '_http_delete', return_value={}):
+            TpmProjectResolver(self.api).resolve('infra')
+            self.api.delete(1)
+            TpmProjectResolver(self.api).resolve('infra')
+
+        self.assertEqual(2, find.call_count)
+
+
+class TestTpmPasswordApiReturnMode(TestCase):
+    ENTRY = {
+        'id': 1,
+        'name': 'entry',
+        'tags': 'a,b',
+        'username': 'admin',
+        'password': 'old',
+        'custom_field1': {'type': 'Text', 'label': 'Label', 'data': 'old'},
+    }
+
+    def update(self, return_mode):
+        api = TpmPasswordApi(dict(CONFIG, tpm_return_mode=return_mode))
+        getById = MagicMock(return_value=dict(self.ENTRY))
+        with patch.object(api, 'getById', new=getById), \
+             patch.object(api, '_http_put', return_value={}):
+            return api.update(1, 'entry', username='root', password='new', custom_data1='new'), getById
+
+    def test_full(self):
+        dummy, getById = self.update('full')
+        self.assertEqual(2, getById.call_count)
+
+    def test_merged(self):
+        entry, getById = self.update('merged')
+
+        self.assertEqual(1, getById.call_count)
+        self.assertEqual('root', entry['username'])
+        self.assertEqual('new', entry['password'])
+        self.assertDictEqual({'type': 'Text', 'label': 'Label', 'data': 'new'}, entry['custom_field1'])
+        self.assertNotIn('custom_data1', entry)
+
+    def test_id(self):
+        entry, getById = self.update('id')
+
+        self.assertEqual(1, getById.call_count)
+        self.assertDictEqual({'id': 1}, entry)
+
+
+class TestTpmPasswordApiDiff(TestCase):
+    ENTRY = TestTpmPasswordApiReturnMode.ENTRY
+
+    def setUp(self):
+        self.api = TpmPasswordApi(dict(CONFIG))
+
+    def test_no_difference(self):
+        self.assertDictEqual({}, self.api.diff(
+            self.ENTRY, name='entry', project_name='other', tags=['b'], username='admin',
+            password=None, custom_data1='old', custom_data2=None))
+
+    def test_differences(self):
+        self.assertDictEqual(
+            {'tags': ['c'], 'password': 'new', 'custom_data1': 'new', 'email': 'admin@example.com'},
+            self.api.diff(self.ENTRY, name='entry', tags=['a', 'c'], password='new',
+                          custom_data1='new', email='admin@example.com'))
+
+    def test_update_without_difference_is_skipped(self):
+        put = MagicMock()
+        generate = MagicMock()
+        with patch.object(self.api, '_http_put', new=put), \
+             patch.object(self.api, 'generate', new=generate):
+            entry = self.api.update(1, 'entry', tags=['a'], entry=dict(self.ENTRY))
+
+        self.assertDictEqual(self.ENTRY, entry)
+        self.assertEqual(0, put.call_count)
+        self.assertEqual(0, generate.call_count)
+
+    def test_update_keeps_the_password(self):
+        put = MagicMock()
+        generate = MagicMock()
+        with patch.object(self.api, '_http_put', new=put), \
+             patch.object(self.api, 'generate', new=generate), \
+             patch.object(self.api, 'getById', return_value=dict(self.ENTRY)):
+            self.api.update(1, 'entry', tags=['c'], notes='rotated?', entry=dict(self.ENTRY))
+
+        self.assertNotIn('password', put.call_args[1]['body'])
+        self.assertEqual('rotated?', put.call_args[1]['body']['notes'])
+        self.assertEqual(0, generate.call_count)
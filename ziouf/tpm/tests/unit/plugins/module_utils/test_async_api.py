@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import json
+import asyncio
+import threading
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import TpmProjectResolver
+from ansible_collections.ziouf.tpm.plugins.module_utils.connection import TpmResponse
+from ansible_collections.ziouf.tpm.plugins.module_utils.async_api import (
+    TpmAsyncConnectionPool,
+    TpmAsyncPasswordApi,
+    TpmAsyncProjectApi,
+    read_response,
+)
+
+CONFIG = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_public_key': 'public',
+    'tpm_private_key': 'private',
+}
+
+
+def stream(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+async def read(data):
+    return await read_response(stream(data))
+
+
+async def drained():
+    pass
+
+
+def page(items, next_page=None):
+    headers = [('Link', '<https://tpm.example.com/index.php/{p}>; rel="next"'.format(p=next_page))] if next_page else []
+    return TpmResponse(200, headers, json.dumps(items).encode('utf-8'))
+
+
+class TestReadResponse(TestCase):
+    def test_content_length(self):
+        r, keep_alive = asyncio.run(read(
+            b'HTTP/1.1 200 OK\r\nContent-Length: 9\r\n\r\n{"id": 1}HTTP/1.1'))
+
+        self.assertEqual(200, r.status)
+        self.assertDictEqual({'id': 1}, r.json())
+        self.assertTrue(keep_alive)
+
+    def test_chunked(self):
+        r, keep_alive = asyncio.run(read(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n'
+            b'4\r\n[1, \r\n2;ext=1\r\n2]\r\n0\r\n\r\n'))
+
+        self.assertListEqual([1, 2], r.json())
+        self.assertFalse(keep_alive)
+
+    def test_no_content(self):
+        r, keep_alive = asyncio.run(read(b'HTTP/1.1 204 No Content\r\n\r\n'))
+
+        self.assertEqual(204, r.status)
+        self.assertEqual(b'', r.body)
+
+
+class TestTpmAsyncConnectionPool(TestCase):
+    def test_stale_connection_is_replayed(self):
+        pool = TpmAsyncConnectionPool('tpm.example.com')
+        stale_writer = MagicMock(drain=drained)
+        opened = []
+
+        async def open_connection(*args, **kwargs):
+            opened.append(args)
+            return stream(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}'), MagicMock(drain=drained)
+
+        async def request():
+            # The idle connection has been closed by the server without notice
+            stale_reader = asyncio.StreamReader()
+            stale_reader.readline = MagicMock(side_effect=ConnectionResetError('closed'))
+            pool._idle.append((stale_reader, stale_writer))
+            return await pool.request('GET', '/index.php/api/v4/passwords/1.json')
+
+        with patch.object(asyncio, 'open_connection', new=open_connection):
+            r = asyncio.run(request())
+
+        self.assertEqual(200, r.status)
+        self.assertEqual(1, len(opened))
+        stale_writer.close.assert_called_once_with()
+
+    def test_sent_post_is_not_replayed(self):
+        pool = TpmAsyncConnectionPool('tpm.example.com')
+        opened = []
+
+        async def open_connection(*args, **kwargs):
+            opened.append(args)
+            return stream(b''), MagicMock(drain=drained)
+
+        async def request():
+            # Closed by the server once the request was sent: it may have been handled
+            stale_reader = asyncio.StreamReader()
+            stale_reader.readline = MagicMock(side_effect=ConnectionResetError('closed'))
+            pool._idle.append((stale_reader, MagicMock(drain=drained)))
+            return await pool.request('POST', '/index.php/api/v4/passwords.json', body=b'{}')
+
+        with patch.object(asyncio, 'open_connection', new=open_connection):
+            with self.assertRaises(ConnectionResetError):
+                asyncio.run(request())
+
+        self.assertEqual(0, len(opened))
+
+
+class TestTpmAsyncPasswordApi(TestCase):
+    def setUp(self):
+        TpmProjectResolver.invalidate()
+
+    def run_api(self, fn, responses, api=None):
+        api = api or TpmAsyncPasswordApi(CONFIG)
+        paths = []
+
+        async def http_request(method, path, body=None, page=None, decode=True):
+            paths.append((method, path, body))
+            return responses.pop(0)
+
+        async def main():
+            async with api:
+                return await fn(api)
+
+        with patch.object(api, '_http_request', new=http_request):
+            return asyncio.run(main()), paths
+
+    def test_find_follows_pages(self):
+        result, paths = self.run_api(lambda api: api.find('tag:prd'), [
+            page([{'id': 1}], next_page='api/v4/passwords/search/tag%3Aprd/page/2.json'),
+            page([{'id': 2}]),
+        ])
+
+        self.assertListEqual([{'id': 1}, {'id': 2}], result)
+        self.assertEqual('api/v4/passwords/search/tag%3Aprd/page/2.json', paths[1][1])
+
+    def test_find_first_fetches_one_page(self):
+        result, paths = self.run_api(lambda api: api.findFirst('tag:prd'), [
+            page([{'id': 1}], next_page='api/v4/passwords/search/tag%3Aprd/page/2.json'),
+        ])
+
+        self.assertDictEqual({'id': 1}, result)
+        self.assertEqual(1, len(paths))
+
+    def test_concurrent_creates_resolve_project_once(self):
+        async def create_all(api):
+            return await asyncio.gather(*[api.create('project', 'p{i}'.format(i=i), password='x')
+                                          for i in range(3)])
+
+        with patch.object(TpmAsyncPasswordApi, '_written', new=lambda self, id, data, entry=None: asyncio.sleep(0, id)):
+            result, paths = self.run_api(create_all, [
+                page([{'id': 10, 'name': 'project'}]),
+                TpmResponse(201, [], b'{"id": 1}'),
+                TpmResponse(201, [], b'{"id": 2}'),
+                TpmResponse(201, [], b'{"id": 3}'),
+            ])
+
+        self.assertListEqual([1, 2, 3], result)
+        self.assertEqual(1, len([p for p in paths if 'projects' in p[1]]))
+        self.assertTrue(all(p[2]['project_id'] == 10 for p in paths if p[0] == 'POST'))
+
+    def test_update_unchanged_sends_nothing(self):
+        entry = {'id': 1, 'name': 'db', 'tags': 'a', 'username': 'admin'}
+        result, paths = self.run_api(lambda api: api.update(1, 'db', username='admin', entry=entry), [])
+
+        self.assertIs(entry, result)
+        self.assertListEqual([], paths)
+
+    def test_unknown_field(self):
+        with self.assertRaises(TypeError):
+            self.run_api(lambda api: api.create('project', 'p', password='x', colour='blue'), [])
+
+    def test_search_known_to_match_nothing_is_not_sent(self):
+        api = TpmAsyncPasswordApi(CONFIG)
+        misses = MagicMock(ttl=10)
+        misses.hit.side_effect = [False, True]
+
+        with patch.object(api._sync, '_negative_cache', return_value=(misses, 'digest')):
+            result, paths = self.run_api(lambda api: api.find('name:missing'), [page([])], api=api)
+            self.assertListEqual([], result)
+            self.assertEqual(('digest', 'passwords'), misses.add.call_args[0])
+
+            result, paths = self.run_api(lambda api: api.find('name:missing'), [], api=api)
+            self.assertListEqual([], paths)
+
+    def test_shared_state_is_used_off_the_event_loop(self):
+        api = TpmAsyncPasswordApi(dict(CONFIG, tpm_breaker_threshold=5))
+        breaker = MagicMock()
+        threads = []
+        breaker.allow.side_effect = breaker.success.side_effect = lambda: threads.append(threading.get_ident())
+
+        class Pool():
+            async def request(self, *args, **kwargs):
+                return TpmResponse(200, [], b'{"id": 1}')
+
+        async def main():
+            threads.append(threading.get_ident())
+            return await api.getById(1)
+
+        with patch.object(api._sync, '_circuit_breaker', return_value=breaker), \
+             patch.object(api, '_pool', new=Pool()):
+            self.assertDictEqual({'id': 1}, asyncio.run(main()))
+
+        self.assertEqual(3, len(threads))
+        self.assertNotIn(threads[0], threads[1:])
+
+    def test_sync_only_helpers_are_not_provided(self):
+        # They would send requests without being awaited
+        for name in ('passwordPool', 'snapshot', 'projectResolver'):
+            self.assertFalse(hasattr(TpmAsyncPasswordApi(CONFIG), name), name)
+        for name in ('projectTree', 'getByPath', 'findChild'):
+            self.assertFalse(hasattr(TpmAsyncProjectApi(CONFIG), name), name)
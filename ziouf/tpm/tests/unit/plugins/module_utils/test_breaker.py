@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import shutil
+import tempfile
+
+from socket import timeout as socket_timeout
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible_collections.ziouf.tpm.plugins.module_utils import breaker
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import (
+    GetError,
+    OpenUrlError,
+    TpmPasswordApi,
+)
+from ansible_collections.ziouf.tpm.plugins.module_utils.breaker import (
+    CircuitOpenError,
+    TpmCircuitBreaker,
+    circuit_open,
+    get_circuit_breaker,
+)
+from ansible_collections.ziouf.tpm.plugins.module_utils.connection import TpmResponse
+from ansible_collections.ziouf.tpm.plugins.module_utils import shared_state
+from ansible_collections.ziouf.tpm.plugins.module_utils.shared_state import TpmSharedState
+
+CONFIG = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_username': 'user',
+    'tpm_password': 'pass',
+    'tpm_retries': 0,
+    'tpm_breaker_threshold': 2,
+}
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'state', 'tpm.json')
+        breaker._BREAKERS.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        breaker._BREAKERS.clear()
+
+    def test_states(self):
+        first = TpmCircuitBreaker(TpmSharedState(self.path), 'tpm', threshold=2, reset_timeout=30)
+        # Another fork
+        second = TpmCircuitBreaker(TpmSharedState(self.path), 'tpm', threshold=2, reset_timeout=30)
+
+        with patch.object(breaker.time, 'time', return_value=1000.0):
+            first.failure()
+            second.allow()
+            second.failure()
+            self.assertEqual('open', first.status())
+            self.assertRaises(CircuitOpenError, first.allow)
+
+        with patch.object(breaker.time, 'time', return_value=1031.0):
+            # A single probe
+            first.allow()
+            self.assertRaises(CircuitOpenError, second.allow)
+            first.failure()
+            self.assertEqual('open', second.status())
+
+        with patch.object(breaker.time, 'time', return_value=1062.0):
+            second.allow()
+            second.success()
+            self.assertEqual('closed', first.status())
+            first.allow()
+
+    def test_requests_fail_fast(self):
+        api = TpmPasswordApi(dict(CONFIG))
+        pool = MagicMock()
+        pool.request.side_effect = socket_timeout('timed out')
+
+        with patch.object(breaker, 'get_shared_state', return_value=TpmSharedState(self.path)), \
+             patch.object(api, '_TpmApiBase__get_pool', return_value=pool):
+            for dummy in range(2):
+                self.assertRaises(OpenUrlError, api._http_request, 'GET', 'api/v4/passwords/1.json')
+            with self.assertRaises(GetError) as e:
+                api.getById(1)
+
+        self.assertEqual(2, pool.request.call_count)
+        self.assertIsNotNone(circuit_open(e.exception))
+
+    def test_success_resets_failures(self):
+        api = TpmPasswordApi(dict(CONFIG))
+        pool = MagicMock()
+        pool.request.side_effect = [
+            TpmResponse(502, [], b''),
+            TpmResponse(404, [], b''),
+            TpmResponse(502, [], b''),
+            TpmResponse(200, [], b'{}'),
+        ]
+
+        with patch.object(breaker, 'get_shared_state', return_value=TpmSharedState(self.path)), \
+             patch.object(api, '_TpmApiBase__get_pool', return_value=pool):
+            for dummy in range(4):
+                api._http_request('GET', 'api/v4/passwords/1.json')
+
+        self.assertEqual(4, pool.request.call_count)
+
+    def test_healthy_requests_only_read_the_state(self):
+        api = TpmPasswordApi(dict(CONFIG))
+        pool = MagicMock()
+        pool.request.side_effect = [
+            TpmResponse(200, [], b'{}'),
+            TpmResponse(200, [], b'{}'),
+            TpmResponse(502, [], b''),
+            TpmResponse(200, [], b'{}'),
+            TpmResponse(200, [], b'{}'),
+        ]
+        state = TpmSharedState(self.path)
+
+        with patch.object(breaker, 'get_shared_state', return_value=state), \
+             patch.object(api, '_TpmApiBase__get_pool', return_value=pool), \
+             patch.object(state, 'transaction', wraps=state.transaction) as transaction:
+            for dummy in range(2):
+                api._http_request('GET', 'api/v4/passwords/1.json')
+            self.assertEqual(0, transaction.call_count)
+
+            # The failure, then the success resetting it
+            for dummy in range(3):
+                api._http_request('GET', 'api/v4/passwords/1.json')
+            self.assertEqual(2, transaction.call_count)
+
+    def test_state_directory_is_configurable(self):
+        with patch.dict(os.environ, {shared_state.STATE_DIR_ENV: self.tmpdir}):
+            get_circuit_breaker('tpm.example.com').failure()
+
+        self.assertEqual(1, len(os.listdir(self.tmpdir)))
+        self.assertTrue(TpmSharedState.default_path('tpm.example.com').startswith(os.environ[shared_state.STATE_DIR_ENV]))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import patch
+except ImportError:                 # Python 2.x
+    from mock import patch
+
+from ansible_collections.ziouf.tpm.plugins.module_utils import api as api_utils
+from ansible_collections.ziouf.tpm.plugins.module_utils import broker
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import TpmPasswordApi
+from ansible_collections.ziouf.tpm.plugins.module_utils.broker import TpmBroker
+from ansible_collections.ziouf.tpm.plugins.module_utils.connection import TpmResponse
+
+CONFIG = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_username': 'user',
+    'tpm_password': 'pass',
+}
+
+
+class SlowUpstream():
+    """Answers every request after 200ms with the number of requests it received"""
+
+    calls = []
+
+    def __init__(self, config):
+        self.config = config
+
+    def _http_request(self, method, path, body=None, page=None, decode=True):
+        SlowUpstream.calls.append(path)
+        time.sleep(0.2)
+        return TpmResponse(200, [], json.dumps({'calls': len(SlowUpstream.calls), 'pid': os.getpid()}).encode('utf-8'))
+
+
+class TestBroker(TestCase):
+    def setUp(self):
+        SlowUpstream.calls = []
+        self.generation = [0]
+        self.patches = [
+            patch.object(broker, 'get_generation', side_effect=lambda hostname: self.generation[0]),
+            patch.object(broker, 'bump_generation', side_effect=lambda hostname: self.generation.__setitem__(0, self.generation[0] + 1)),
+        ]
+        for p in self.patches:
+            p.start()
+        self.broker = TpmBroker(SlowUpstream)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def request(self, method='GET', path='api/v4/passwords/1.json', config=None):
+        return self.broker.process(dict(config=config or CONFIG, method=method, path=path))
+
+    def test_identical_requests_are_coalesced(self):
+        replies = []
+        threads = [threading.Thread(target=lambda: replies.append(self.request())) for dummy in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(1, len(SlowUpstream.calls))
+        self.assertEqual(10, len(replies))
+
+    def test_responses_are_cached_per_credentials(self):
+        self.request()
+        self.request()
+        self.assertEqual(1, len(SlowUpstream.calls))
+
+        self.request(config=dict(CONFIG, tpm_password='other'))
+        self.assertEqual(2, len(SlowUpstream.calls))
+
+    def test_write_outdates_the_cache(self):
+        self.request()
+        self.request(method='PUT')
+        self.request()
+        self.assertListEqual(['api/v4/passwords/1.json'] * 3, SlowUpstream.calls)
+
+
+class TestBrokerDaemon(TestCase):
+    def setUp(self):
+        SlowUpstream.calls = []
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'broker.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_forks_share_the_daemon(self):
+        config = dict(CONFIG, tpm_broker=self.path, tpm_broker_idle_timeout=1)
+        replies = []
+
+        def get():
+            r = broker.request(self.path, config, 'GET', 'api/v4/passwords/1.json', upstream=SlowUpstream)
+            replies.append(r.json())
+
+        threads = [threading.Thread(target=get) for dummy in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # A single daemon, a single upstream request
+        self.assertEqual(10, len(replies))
+        self.assertEqual(1, len(set(r['pid'] for r in replies)))
+        self.assertNotEqual(os.getpid(), replies[0]['pid'])
+        self.assertSetEqual({1}, set(r['calls'] for r in replies))
+
+    def test_api_routes_through_the_broker(self):
+        api = TpmPasswordApi(dict(CONFIG, tpm_broker=self.path))
+        with patch.object(api_utils, 'broker_request', return_value=TpmResponse(200, [], b'{"id": 1}')) as request:
+            self.assertDictEqual({'id': 1}, api.getById(1))
+
+        self.assertEqual(self.path, request.call_args[0][0])
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import codecs
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import patch
+except ImportError:                 # Python 2.x
+    from mock import patch
+
+from ansible_collections.ziouf.tpm.plugins.module_utils import cache
+from ansible_collections.ziouf.tpm.plugins.module_utils.cache import (
+    TpmFileCache,
+    TpmMemoryCache,
+    get_cache,
+    invalidate_caches,
+)
+
+
+class TestTpmMemoryCache(TestCase):
+    def setUp(self):
+        self.cache = TpmMemoryCache(ttl=60, max_entries=2)
+
+    def test_miss_then_hit(self):
+        self.assertEqual((False, None), self.cache.get(('tpm', 'key', 'q')))
+        self.cache.set(('tpm', 'key', 'q'), [{'id': 1}])
+        self.assertEqual((True, [{'id': 1}]), self.cache.get(('tpm', 'key', 'q')))
+
+    def test_cached_values_are_copies(self):
+        self.cache.set(('tpm', 'key', 'q'), [{'id': 1}])
+        dummy, value = self.cache.get(('tpm', 'key', 'q'))
+        value.append({'id': 2})
+        self.assertEqual((True, [{'id': 1}]), self.cache.get(('tpm', 'key', 'q')))
+
+    def test_entry_expires(self):
+        self.cache.set(('tpm', 'key', 'q'), 'value')
+        with patch.object(cache.time, 'time', return_value=cache.time.time() + 61):
+            self.assertEqual((False, None), self.cache.get(('tpm', 'key', 'q')))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set(('tpm', 'key', 'a'), 'a')
+        self.cache.set(('tpm', 'key', 'b'), 'b')
+        self.cache.get(('tpm', 'key', 'a'))
+        self.cache.set(('tpm', 'key', 'c'), 'c')
+
+        self.assertTrue(self.cache.get(('tpm', 'key', 'a'))[0])
+        self.assertFalse(self.cache.get(('tpm', 'key', 'b'))[0])
+        self.assertTrue(self.cache.get(('tpm', 'key', 'c'))[0])
+
+    def test_invalidate_host(self):
+        self.cache.set(('tpm1', 'key', 'q'), 'value')
+        self.cache.set(('tpm2', 'key', 'q'), 'value')
+        self.cache.invalidate('tpm1')
+
+        self.assertFalse(self.cache.get(('tpm1', 'key', 'q'))[0])
+        self.assertTrue(self.cache.get(('tpm2', 'key', 'q'))[0])
+
+    def test_invalidate_registered_caches(self):
+        get_cache('test').set(('tpm', 'key', 'q'), 'value')
+        invalidate_caches('tpm')
+        self.assertFalse(get_cache('test').get(('tpm', 'key', 'q'))[0])
+
+    def test_stale_entry(self):
+        self.cache.stale_ttl = 60
+        self.cache.set(('tpm', 'key', 'q'), 'value')
+        with patch.object(cache.time, 'time', return_value=cache.time.time() + 61):
+            self.assertEqual((False, None), self.cache.get(('tpm', 'key', 'q')))
+            self.assertEqual((True, 'value'), self.cache.get_stale(('tpm', 'key', 'q')))
+
+
+class TestTpmFileCache(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = TpmFileCache(self.path, 'private-key', ttl=60, max_entries=2, stale_ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_miss_then_hit(self):
+        self.assertEqual((False, None), self.cache.get(('tpm', 'key', 'q')))
+        self.cache.set(('tpm', 'key', 'q'), [{'id': 1}])
+        self.assertEqual((True, [{'id': 1}]), self.cache.get(('tpm', 'key', 'q')))
+
+    def test_entries_are_encrypted(self):
+        self.cache.set(('tpm', 'key', 'username:admin'), [{'password': 'My5uperP@$$w0rd'}])
+
+        for root, dummy, files in os.walk(self.path):
+            for name in files:
+                with open(os.path.join(root, name), 'rb') as f:
+                    content = f.read()
+                self.assertNotIn(b'My5uperP@$$w0rd', content)
+                self.assertNotIn(b'admin', content)
+                self.assertNotIn(b'admin', codecs.encode(name))
+
+    def test_other_secret_can_not_read_entries(self):
+        self.cache.set(('tpm', 'key', 'q'), 'value')
+        other = TpmFileCache(self.path, 'other-key')
+        self.assertEqual((False, None), other.get(('tpm', 'key', 'q')))
+
+    def test_entry_shared_between_instances(self):
+        self.cache.set(('tpm', 'key', 'q'), 'value')
+        other = TpmFileCache(self.path, 'private-key')
+        self.assertEqual((True, 'value'), other.get(('tpm', 'key', 'q')))
+
+    def test_stale_entry(self):
+        self.cache.set(('tpm', 'key', 'q'), 'value')
+        with patch.object(cache.time, 'time', return_value=cache.time.time() + 61):
+            self.assertEqual((False, None), self.cache.get(('tpm', 'key', 'q')))
+            self.assertEqual((True, 'value'), self.cache.get_stale(('tpm', 'key', 'q')))
+        with patch.object(cache.time, 'time', return_value=cache.time.time() + 121):
+            self.assertEqual((False, None), self.cache.get_stale(('tpm', 'key', 'q')))
+
+    def test_revalidation_lock(self):
+        self.assertTrue(self.cache.lock(('tpm', 'key', 'q')))
+        self.assertFalse(self.cache.lock(('tpm', 'key', 'q')))
+        self.cache.unlock(('tpm', 'key', 'q'))
+        self.assertTrue(self.cache.lock(('tpm', 'key', 'q')))
+
+    def test_oldest_entries_are_pruned(self):
+        for q in ('a', 'b', 'c'):
+            self.cache.set(('tpm', 'key', q), q)
+
+        directory = TpmFileCache.host_dir(self.path, 'tpm')
+        self.assertEqual(2, len(os.listdir(directory)))
+
+    def test_invalidate_host(self):
+        self.cache.set(('tpm1', 'key', 'q'), 'value')
+        self.cache.set(('tpm2', 'key', 'q'), 'value')
+        self.cache.invalidate('tpm1')
+
+        self.assertFalse(self.cache.get(('tpm1', 'key', 'q'))[0])
+        self.assertTrue(self.cache.get(('tpm2', 'key', 'q'))[0])
+
+    def test_entry_older_than_a_write_is_a_miss(self):
+        with patch.object(cache, 'get_generation', return_value=3):
+            self.cache.set(('tpm', 'key', 'q'), 'value')
+            self.assertEqual((True, 'value'), self.cache.get(('tpm', 'key', 'q')))
+
+        # Written by another process, whatever the cache directory
+        with patch.object(cache, 'get_generation', return_value=4):
+            self.assertEqual((False, None), self.cache.get(('tpm', 'key', 'q')))
+            self.assertEqual((False, None), self.cache.get_stale(('tpm', 'key', 'q')))
+            self.assertEqual((True, 'value'), self.cache.get_fallback(('tpm', 'key', 'q')))
+
+    def test_entry_records_the_generation_before_the_fetch(self):
+        with patch.object(cache, 'get_generation', return_value=3):
+            self.cache.get(('tpm', 'key', 'q'))
+        # A write happened while the value was fetched: it may be outdated
+        with patch.object(cache, 'get_generation', return_value=4):
+            self.cache.set(('tpm', 'key', 'q'), 'value')
+            self.assertEqual((False, None), self.cache.get(('tpm', 'key', 'q')))
+
+    def test_discarded_miss_is_forgotten(self):
+        self.cache.get(('tpm', 'key', 'q'))
+        self.cache.discard(('tpm', 'key', 'q'))
+
+        self.assertDictEqual({}, self.cache._fetched)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import time
+import threading
+
+from unittest import TestCase
+
+from ansible_collections.ziouf.tpm.plugins.module_utils.concurrency import parallel_map
+
+
+class TestParallelMap(TestCase):
+    def test_results_keep_input_order(self):
+        def slow_identity(i):
+            time.sleep(0.01 * (5 - i))
+            return i
+
+        self.assertListEqual(list(range(5)), parallel_map(slow_identity, range(5), workers=5))
+
+    def test_calls_are_concurrent(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def wait_for_others(i):
+            barrier.wait()
+            return i
+
+        self.assertListEqual([0, 1, 2], parallel_map(wait_for_others, range(3), workers=3))
+
+    def test_failure_cancels_pending_calls(self):
+        calls = []
+
+        def fail_first(i):
+            calls.append(i)
+            if i == 0:
+                raise ValueError('boom')
+            time.sleep(0.05)
+            return i
+
+        with self.assertRaises(ValueError):
+            parallel_map(fail_first, range(20), workers=2)
+
+        self.assertLess(len(calls), 20)
+
+    def test_single_worker_is_serial(self):
+        self.assertListEqual([0, 2, 4], parallel_map(lambda i: i * 2, range(3), workers=1))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import string
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import MagicMock
+except ImportError:                 # Python 2.x
+    from mock import MagicMock
+
+from ansible_collections.ziouf.tpm.plugins.module_utils.generator import (
+    PolicyError,
+    TpmPasswordPool,
+    generate_password,
+)
+
+
+class TestGeneratePassword(TestCase):
+    def test_default_policy(self):
+        password = generate_password()
+
+        self.assertEqual(16, len(password))
+        for chars in (string.ascii_lowercase, string.ascii_uppercase, string.digits):
+            self.assertTrue(any(c in chars for c in password))
+
+    def test_disabled_classes_are_not_used(self):
+        password = generate_password({'length': 32, 'symbols': False, 'upper': False, 'symbol_chars': None})
+
+        self.assertEqual(32, len(password))
+        self.assertTrue(all(c in string.ascii_lowercase + string.digits for c in password))
+
+    def test_unsatisfiable_policy(self):
+        with self.assertRaises(PolicyError):
+            generate_password({'length': 2})
+        with self.assertRaises(PolicyError):
+            generate_password({'lower': False, 'upper': False, 'digits': False, 'symbols': False})
+
+
+class TestTpmPasswordPool(TestCase):
+    def test_pool_is_refilled_by_batch(self):
+        fetch = MagicMock(side_effect=['a', 'b', 'c', 'd'])
+        pool = TpmPasswordPool(fetch, batch_size=3, workers=1)
+
+        self.assertEqual('a', pool.pop())
+        self.assertEqual(3, fetch.call_count)
+        self.assertEqual(['b', 'c'], [pool.pop(), pool.pop()])
+        self.assertEqual(3, fetch.call_count)
+
+    def test_prefetch_only_fetches_missing_passwords(self):
+        fetch = MagicMock(return_value='secret')
+        pool = TpmPasswordPool(fetch, workers=2)
+
+        pool.prefetch(3)
+        pool.prefetch(2)
+
+        self.assertEqual(3, fetch.call_count)
+        self.assertEqual(3, len(pool))
+
+    def test_fetch_does_not_hold_the_lock(self):
+        def fetch():
+            self.assertFalse(pool._lock.locked())
+            return 'secret'
+        pool = TpmPasswordPool(fetch, batch_size=2, workers=1)
+
+        self.assertEqual('secret', pool.pop())
+        self.assertEqual(1, len(pool))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import json
+
+from unittest import TestCase
+
+from ansible_collections.ziouf.tpm.plugins.module_utils.jsonstream import iter_array
+
+ITEMS = [
+    {'id': 1, 'name': 'nexus-admin', 'project': {'id': 10, 'name': 'Infra'}},
+    {'id': 2, 'name': 'db, "root"', 'tags': ['a', ']']},
+]
+
+
+class TestIterArray(TestCase):
+    def test_items_are_decoded(self):
+        self.assertListEqual(ITEMS, list(iter_array(json.dumps(ITEMS))))
+        self.assertListEqual(ITEMS, list(iter_array(json.dumps(ITEMS, indent=2))))
+        self.assertListEqual([], list(iter_array(' [ ] ')))
+
+    def test_items_are_projected(self):
+        self.assertListEqual(
+            [{'id': 1, 'name': 'nexus-admin'}, {'id': 2, 'name': 'db, "root"'}],
+            list(iter_array(json.dumps(ITEMS), fields=('id', 'name', 'missing'))),
+        )
+
+    def test_items_are_decoded_lazily(self):
+        items = iter_array('[{"id": 1}, {"id": 2}, oops]')
+        self.assertDictEqual({'id': 1}, next(items))
+        self.assertDictEqual({'id': 2}, next(items))
+        self.assertRaises(ValueError, next, items)
+
+    def test_not_an_array(self):
+        for text in ('{"id": 1}', '[1 2]', '[1] 2', ''):
+            self.assertRaises(ValueError, list, iter_array(text))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import json
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible_collections.ziouf.tpm.plugins.module_utils import metrics
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import TpmPasswordApi
+from ansible_collections.ziouf.tpm.plugins.module_utils.connection import TpmConnectionPool
+
+CONFIG = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_public_key': 'public',
+    'tpm_private_key': 'private',
+}
+
+
+def mock_connection(body=b'{"id": 1}'):
+    conn = MagicMock(sock=None)
+    response = MagicMock(status=200, will_close=False)
+    response.read.return_value = body
+    response.getheaders.return_value = []
+    conn.getresponse.return_value = response
+    return conn
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.records = []
+        metrics.add_listener(self.records.append)
+        self.pool = TpmConnectionPool('tpm.example.com')
+
+    def tearDown(self):
+        metrics.remove_listener(self.records.append)
+        metrics.set_context()
+
+    def request(self, conn):
+        api = TpmPasswordApi(dict(CONFIG))
+        with patch.object(self.pool, '_new_connection', return_value=conn), \
+             patch.object(api, '_TpmApiBase__get_pool', return_value=self.pool):
+            return api.getById(1)
+
+    def test_request_is_recorded(self):
+        metrics.set_context(host='web1')
+        self.assertDictEqual({'id': 1}, self.request(mock_connection()))
+
+        self.assertEqual(1, len(self.records))
+        record = self.records[0]
+        self.assertEqual('web1', record['host'])
+        self.assertEqual('api/v4/passwords/1.json', record['path'])
+        self.assertEqual(1, record['page'])
+        self.assertEqual(200, record['status'])
+        self.assertEqual(9, record['bytes_received'])
+        self.assertFalse(record['reused'])
+        self.assertSetEqual(set(metrics.TpmRequestMetrics.PHASES), set(record['timings']))
+        self.assertGreater(record['timings']['sign'], 0)
+
+    def test_new_connection_is_timed(self):
+        conn = mock_connection()
+        self.request(conn)
+
+        conn.connect.assert_called_once_with()
+
+    def test_requests_are_spooled(self):
+        spool = tempfile.mkdtemp()
+        try:
+            with patch.dict(os.environ, {metrics.SPOOL_DIR_ENV: spool, metrics.TASK_ENV: 'uuid'}):
+                self.request(mock_connection())
+
+            with open(os.path.join(spool, '{p}.jsonl'.format(p=os.getpid()))) as f:
+                lines = [json.loads(line) for line in f]
+        finally:
+            shutil.rmtree(spool)
+
+        self.assertEqual(1, len(lines))
+        self.assertEqual('uuid', lines[0]['task'])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from unittest import TestCase
+
+from ansible_collections.ziouf.tpm.plugins.module_utils.project_tree import (
+    AmbiguousProjectError,
+    ProjectNotFoundError,
+    TpmProjectTree,
+)
+
+PROJECTS = [
+    {'id': 1, 'name': 'infra', 'parent_id': 0},
+    {'id': 2, 'name': 'prod', 'parent_id': 1},
+    {'id': 3, 'name': 'nexus', 'parent_id': 2},
+    {'id': 4, 'name': 'dev', 'parent_id': 1},
+    {'id': 5, 'name': 'nexus', 'parent_id': 4},
+    {'id': 6, 'name': 'apps', 'parent_id': 0},
+    {'id': 7, 'name': 'orphan', 'parent_id': 99},
+]
+
+
+class TestTpmProjectTree(TestCase):
+    def setUp(self):
+        self.tree = TpmProjectTree(PROJECTS)
+
+    def test_paths(self):
+        self.assertEqual('infra/prod/nexus', self.tree.path(3))
+        self.assertEqual(3, self.tree.byPath('infra/prod/nexus')['id'])
+        self.assertEqual('infra/dev/nexus', self.tree.get(5)['path'])
+        self.assertIsNone(self.tree.byPath('infra/nexus'))
+        # Parent not readable: hangs from the root
+        self.assertEqual('orphan', self.tree.path(7))
+
+    def test_resolve(self):
+        self.assertEqual(5, self.tree.resolve('infra/dev/nexus'))
+        self.assertEqual(6, self.tree.resolve('apps'))
+        self.assertRaises(AmbiguousProjectError, self.tree.resolve, 'nexus')
+        self.assertRaises(ProjectNotFoundError, self.tree.resolve, 'unknown')
+
+    def test_children(self):
+        self.assertListEqual([2, 4], [p['id'] for p in self.tree.children(1)])
+        self.assertEqual(4, self.tree.child(1, 'dev')['id'])
+        self.assertIsNone(self.tree.child(0, 'dev'))
+
+    def test_named(self):
+        self.assertListEqual([3, 5], [p['id'] for p in self.tree.named('nexus')])
+        self.assertListEqual([], self.tree.named('unknown'))
+
+    def test_subtree(self):
+        self.assertListEqual([1, 2, 3, 4, 5], [p['id'] for p in self.tree.subtree(1)])
+        self.assertListEqual([1, 2, 3, 4, 5, 6, 7], [p['id'] for p in self.tree.subtree()])
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible_collections.ziouf.tpm.plugins.module_utils import snapshot as snapshot_utils
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import TpmPasswordApi
+from ansible_collections.ziouf.tpm.plugins.module_utils.snapshot import (
+    QueryError,
+    TpmSnapshot,
+    TpmSnapshotStore,
+    get_snapshot,
+    normalize_query,
+    parse_query,
+)
+
+ENTRIES = [
+    {'id': 1, 'name': 'nexus-admin', 'username': 'admin', 'tags': 'nexus,prd',
+     'project': {'id': 10, 'name': 'Infra'}, 'password': 'a'},
+    {'id': 2, 'name': 'nexus-admin', 'username': 'admin', 'tags': 'nexus,dev',
+     'project': {'id': 10, 'name': 'Infra'}, 'password': 'b'},
+    {'id': 3, 'name': 'db root', 'username': 'root', 'tags': 'postgres,prd', 'notes': 'Primary cluster',
+     'project': {'id': 11, 'name': 'Databases'}, 'password': 'c'},
+]
+
+
+class TestQuery(TestCase):
+    def test_parse(self):
+        self.assertListEqual(
+            [('username', 'admin'), ('tag', ['nexus', 'prd']), ('name', 'db root'), (None, 'cluster')],
+            parse_query('username:admin tag:nexus,prd name:"db root" Cluster'))
+
+    def test_normalize(self):
+        self.assertEqual(normalize_query('name:db tag:a,b'), normalize_query('tag:B,a  name:"DB"'))
+        self.assertNotEqual(normalize_query('"a b"'), normalize_query('"b a"'))
+
+    def test_unsupported_field(self):
+        with self.assertRaises(QueryError):
+            parse_query('custom1:value')
+
+    def test_search(self):
+        snapshot = TpmSnapshot(ENTRIES)
+
+        def ids(query):
+            return [e['id'] for e in snapshot.search(query)]
+
+        self.assertListEqual([1], ids('username:admin tag:nexus,prd'))
+        self.assertListEqual([1, 2], ids('name:NEXUS'))
+        self.assertListEqual([3], ids('project:data cluster'))
+        self.assertListEqual([1, 3], ids('tag:prd'))
+        self.assertListEqual([], ids('tag:pr'))
+        self.assertListEqual([1, 2, 3], ids(''))
+
+    def test_get(self):
+        snapshot = TpmSnapshot(ENTRIES)
+
+        self.assertEqual('c', snapshot.get('3')['password'])
+        self.assertIsNone(snapshot.get(4))
+
+
+class TestSnapshotStore(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'snapshots', 'tpm')
+        snapshot_utils._SNAPSHOTS.clear()
+        self.generation = patch.object(snapshot_utils, 'get_generation', return_value=0)
+        self.generation.start()
+
+    def tearDown(self):
+        self.generation.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_snapshot_is_encrypted(self):
+        TpmSnapshotStore(self.path, 'private').save(TpmSnapshot(ENTRIES))
+
+        with open(self.path, 'rb') as f:
+            self.assertNotIn(b'nexus-admin', f.read())
+        self.assertEqual(3, len(TpmSnapshotStore(self.path, 'private').load()))
+        self.assertIsNone(TpmSnapshotStore(self.path, 'other').load())
+
+    def test_snapshot_is_pulled_once(self):
+        api = TpmPasswordApi({'tpm_hostname': 'tpm.example.com', 'tpm_public_key': 'public',
+                              'tpm_private_key': 'private', 'tpm_snapshot': self.path})
+
+        with patch.object(TpmSnapshot, 'pull', return_value=TpmSnapshot(ENTRIES)) as pull, \
+             patch.object(api, '_http_iter', return_value=iter([{'id': 4}])) as http_iter:
+            self.assertListEqual([1], [e['id'] for e in api.find('username:admin tag:prd')])
+            self.assertEqual('b', api.getById(2)['password'])
+            # Not supported offline: sent to TPM
+            self.assertListEqual([{'id': 4}], api.find('custom1:value'))
+
+        pull.assert_called_once_with(api, workers=4)
+        self.assertEqual(1, http_iter.call_count)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_expired_snapshot_is_refreshed(self):
+        api = MagicMock(config={'tpm_snapshot': self.path, 'tpm_private_key': 'private',
+                                'tpm_snapshot_max_age': 60})
+        TpmSnapshotStore(self.path, 'private').save(TpmSnapshot(ENTRIES, taken_on=1))
+
+        with patch.object(TpmSnapshot, 'refresh', return_value=TpmSnapshot(ENTRIES[:1])) as refresh, \
+             patch.object(TpmSnapshot, 'pull') as pull:
+            self.assertEqual(1, len(get_snapshot(api)))
+            self.assertEqual(1, len(get_snapshot(api)))
+
+        self.assertEqual(1, refresh.call_count)
+        pull.assert_not_called()
+
+    def test_snapshot_taken_before_a_write_is_refreshed(self):
+        api = MagicMock(config={'tpm_snapshot': self.path, 'tpm_private_key': 'private'})
+        TpmSnapshotStore(self.path, 'private').save(TpmSnapshot(ENTRIES, generation=0))
+
+        with patch.object(TpmSnapshot, 'refresh', return_value=TpmSnapshot(ENTRIES[:1])) as refresh:
+            self.assertEqual(3, len(get_snapshot(api)))
+            # Written by another process
+            with patch.object(snapshot_utils, 'get_generation', return_value=1):
+                self.assertEqual(1, len(get_snapshot(api)))
+                self.assertEqual(1, len(get_snapshot(api)))
+
+        self.assertEqual(1, refresh.call_count)
+
+    def test_snapshot_taken_before_a_write_is_not_used_while_refreshed(self):
+        api = MagicMock(config={'tpm_snapshot': self.path, 'tpm_private_key': 'private'})
+        store = TpmSnapshotStore(self.path, 'private')
+        store.save(TpmSnapshot(ENTRIES, generation=0))
+        # Refreshed by another process
+        store.lock()
+
+        with patch.object(snapshot_utils, 'get_generation', return_value=1):
+            self.assertIsNone(get_snapshot(api))
+
+    def test_full_sync(self):
+        api = MagicMock(config={'tpm_snapshot': self.path, 'tpm_private_key': 'private',
+                                'tpm_snapshot_max_age': 60, 'tpm_snapshot_sync': 'full'})
+        TpmSnapshotStore(self.path, 'private').save(TpmSnapshot(ENTRIES, taken_on=1))
+
+        with patch.object(TpmSnapshot, 'pull', return_value=TpmSnapshot(ENTRIES[:1])) as pull:
+            self.assertEqual(1, len(get_snapshot(api)))
+
+        self.assertEqual(1, pull.call_count)
+
+
+class TestSnapshotRefresh(TestCase):
+    def test_only_changes_are_fetched(self):
+        entries = [dict(e, updated_on='2024-01-01 00:00:00') for e in ENTRIES]
+        snapshot = TpmSnapshot(entries)
+
+        api = MagicMock()
+        api._http_iter.return_value = iter([
+            {'id': 1, 'updated_on': '2024-01-01 00:00:00'},
+            {'id': 3, 'updated_on': '2024-02-01 00:00:00'},
+            {'id': 4, 'updated_on': '2024-02-01 00:00:00'},
+        ])
+        api._http_get.side_effect = lambda path: {
+            'api/v4/passwords/3.json': dict(ENTRIES[2], password='new', updated_on='2024-02-01 00:00:00'),
+            'api/v4/passwords/4.json': {'id': 4, 'name': 'new entry', 'updated_on': '2024-02-01 00:00:00'},
+        }[path]
+
+        refreshed = snapshot.refresh(api, workers=1)
+
+        self.assertEqual(2, api._http_get.call_count)
+        self.assertListEqual([1, 3, 4], [e['id'] for e in refreshed.entries])
+        self.assertEqual('new', refreshed.get(3)['password'])
+        self.assertIsNone(refreshed.get(2))
+        self.assertDictEqual({'fetched': 2, 'deleted': 1}, refreshed.changes)
+        # The previous snapshot is left untouched
+        self.assertEqual(3, len(snapshot))
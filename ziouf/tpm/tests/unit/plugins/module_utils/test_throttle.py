@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible_collections.ziouf.tpm.plugins.module_utils import throttle
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import (
+    CreateError,
+    TpmPasswordApi,
+)
+from ansible_collections.ziouf.tpm.plugins.module_utils.connection import TpmResponse
+from ansible_collections.ziouf.tpm.plugins.module_utils.shared_state import TpmSharedState
+from ansible_collections.ziouf.tpm.plugins.module_utils.throttle import (
+    TpmRateLimiter,
+    retry_after,
+)
+
+CONFIG = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_username': 'user',
+    'tpm_password': 'pass',
+    'tpm_breaker_threshold': 0,
+}
+
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'state', 'tpm.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_bucket_is_shared(self):
+        # Two states on the same file, as two forks would have
+        first = TpmRateLimiter(TpmSharedState(self.path), 10, burst=2)
+        second = TpmRateLimiter(TpmSharedState(self.path), 10, burst=2)
+
+        with patch.object(throttle.time, 'time', return_value=1000.0):
+            self.assertEqual(0, first.reserve())
+            self.assertEqual(0, second.reserve())
+            self.assertAlmostEqual(0.1, first.reserve())
+            self.assertAlmostEqual(0.2, second.reserve())
+
+    def test_rate_adapts_to_errors(self):
+        limiter = TpmRateLimiter(TpmSharedState(self.path), 10)
+
+        with patch.object(throttle.time, 'time', return_value=1000.0):
+            limiter.feedback(429)
+            # Decreased once per interval, whatever the number of errors
+            limiter.feedback(503)
+            self.assertEqual(5, limiter.rate())
+            limiter.feedback(200)
+            self.assertAlmostEqual(5.2, limiter.rate())
+
+        with patch.object(throttle.time, 'time', return_value=1002.0):
+            limiter.feedback(500, retry_after=30)
+            self.assertAlmostEqual(2.6, limiter.rate())
+            self.assertAlmostEqual(30, limiter.reserve())
+
+    def test_retry_after(self):
+        def response(value):
+            return TpmResponse(429, [('Retry-After', value)] if value else [], b'')
+
+        self.assertEqual(120, retry_after(response('120')))
+        self.assertEqual(0, retry_after(response('Wed, 21 Oct 2015 07:28:00 GMT')))
+        self.assertIsNone(retry_after(response('soon')))
+        self.assertIsNone(retry_after(response(None)))
+
+
+class TestRetry(TestCase):
+    def test_throttled_get_is_retried(self):
+        api = TpmPasswordApi(dict(CONFIG))
+        pool = MagicMock()
+        pool.request.side_effect = [
+            TpmResponse(429, [('Retry-After', '2')], b''),
+            TpmResponse(502, [], b''),
+            TpmResponse(200, [], b'{"id": 1}'),
+        ]
+
+        with patch.object(api, '_TpmApiBase__get_pool', return_value=pool), \
+             patch.object(throttle.random, 'uniform', return_value=0.1), \
+             patch('time.sleep') as sleep:
+            self.assertDictEqual({'id': 1}, api.getById(1))
+
+        self.assertEqual(3, pool.request.call_count)
+        self.assertListEqual([2, 0.1], [c[0][0] for c in sleep.call_args_list])
+
+    def test_failed_post_is_not_retried(self):
+        api = TpmPasswordApi(dict(CONFIG, tpm_return_mode='id'))
+        pool = MagicMock()
+        pool.request.return_value = TpmResponse(500, [], b'')
+
+        with patch.object(api, 'projectId', return_value=1), \
+             patch.object(api, '_TpmApiBase__get_pool', return_value=pool), \
+             patch('time.sleep'):
+            with self.assertRaises(CreateError):
+                api.create('project', 'name', password='secret')
+
+        self.assertEqual(1, pool.request.call_count)
+
+    def test_retries_are_bounded(self):
+        api = TpmPasswordApi(dict(CONFIG, tpm_retries=2))
+        pool = MagicMock()
+        pool.request.return_value = TpmResponse(503, [], b'')
+
+        with patch.object(api, '_TpmApiBase__get_pool', return_value=pool), \
+             patch('time.sleep') as sleep:
+            self.assertEqual(503, api._http_request('GET', 'api/v4/passwords/1.json').status)
+
+        self.assertEqual(3, pool.request.call_count)
+        self.assertEqual(2, sleep.call_count)
+
+    def test_long_retry_after_is_not_waited(self):
+        api = TpmPasswordApi(dict(CONFIG))
+        pool = MagicMock()
+        pool.request.return_value = TpmResponse(503, [('Retry-After', '3600')], b'')
+
+        with patch.object(api, '_TpmApiBase__get_pool', return_value=pool), \
+             patch('time.sleep') as sleep:
+            self.assertEqual(503, api._http_request('GET', 'api/v4/passwords/1.json').status)
+
+        self.assertEqual(1, pool.request.call_count)
+        sleep.assert_not_called()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import json
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible.module_utils import basic
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import (
+    TpmProjectApi,
+    TpmProjectResolver,
+)
+from ansible_collections.ziouf.tpm.plugins.modules import password
+
+try:
+    from ansible.module_utils.testing import patch_module_args
+except ImportError:
+    def patch_module_args(args):
+        return patch.object(basic, '_ANSIBLE_ARGS', json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8'))
+
+CONNECTION_ARGS = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_username': 'user',
+    'tpm_password': 'pass',
+}
+
+EXISTING = {
+    'existing': {'id': 1, 'name': 'existing', 'tags': 'a', 'username': 'admin'},
+}
+
+
+class ExitJson(Exception):
+    pass
+
+
+class FailJson(Exception):
+    pass
+
+
+def exit_json(self, **kwargs):
+    raise ExitJson(kwargs)
+
+
+def fail_json(self, **kwargs):
+    raise FailJson(kwargs)
+
+
+def mock_create(self, **data):
+    return dict(data, id=100, project_id=self.projectId(data['project_name']))
+
+
+def mock_getById(self, id=0):
+    return dict(next(e for e in EXISTING.values() if e['id'] == id))
+
+
+def mock_update(self, id, entry=None, **data):
+    return dict(entry, **data)
+
+
+def mock_delete(self, id):
+    return "Successfully deleted password"
+
+
+class TestPasswordModule(TestCase):
+    def setUp(self):
+        TpmProjectResolver.invalidate()
+
+    def run_module(self, args):
+        project_find = MagicMock(side_effect=lambda: iter([{'id': 10, 'name': 'project'}]))
+        self.password_pool = MagicMock()
+        self.findFirst = MagicMock(side_effect=lambda query_str='', default=None: EXISTING.get(query_str, default))
+
+        with patch_module_args(dict(CONNECTION_ARGS, **args)), \
+             patch.object(password.TpmModule, 'exit_json', new=exit_json), \
+             patch.object(password.TpmModule, 'fail_json', new=fail_json), \
+             patch.object(password.TpmModule, 'findFirst', new=self.findFirst), \
+             patch.object(password.TpmModule, 'create', new=mock_create), \
+             patch.object(password.TpmModule, 'delete', new=mock_delete), \
+             patch.object(password.TpmModule, 'getById', new=mock_getById), \
+             patch.object(password.TpmModule, 'update', new=mock_update), \
+             patch.object(password.TpmModule, 'passwordPool', return_value=self.password_pool), \
+             patch.object(TpmProjectApi, 'listIter', new=project_find):
+
+            try:
+                password.main()
+            except (ExitJson, FailJson) as e:
+                return e.__class__, e.args[0], project_find
+
+    def test_single_entry(self):
+        result, out, dummy = self.run_module({'name': 'new', 'project_name': 'project'})
+
+        self.assertIs(ExitJson, result)
+        self.assertTrue(out['changed'])
+        self.assertEqual(100, out['result']['tpm']['id'])
+
+    def test_single_entry_already_exists(self):
+        result, out, dummy = self.run_module({'name': 'existing', 'project_name': 'project'})
+
+        self.assertIs(ExitJson, result)
+        self.assertFalse(out['changed'])
+
+    def test_single_entry_requirements(self):
+        result, out, dummy = self.run_module({'name': 'new'})
+
+        self.assertIs(FailJson, result)
+
+    def test_bulk(self):
+        result, out, project_find = self.run_module({'passwords': [
+            {'name': 'new{i}'.format(i=i), 'project_name': 'project'} for i in range(10)
+        ] + [
+            {'name': 'existing', 'project_name': 'project'},
+            {'name': 'existing', 'state': 'absent'},
+        ]})
+
+        self.assertIs(ExitJson, result)
+        self.assertTrue(out['changed'])
+        self.assertListEqual(
+            ['new{i}'.format(i=i) for i in range(10)] + ['existing', 'existing'],
+            [r['name'] for r in out['results']]
+        )
+        self.assertListEqual([True] * 10 + [False, True], [r['changed'] for r in out['results']])
+        self.assertEqual(1, project_find.call_count)
+        # Passwords are only generated for the entries that do not exist
+        self.password_pool.prefetch.assert_called_once_with(10)
+        # Read once by the prefetch, then again by the absent item after the present one
+        self.assertEqual(12, self.findFirst.call_count)
+
+    def test_bulk_converged(self):
+        result, out, dummy = self.run_module({'passwords': [
+            {'name': 'existing', 'project_name': 'project'},
+        ]})
+
+        self.assertIs(ExitJson, result)
+        self.assertFalse(out['changed'])
+        self.assertEqual(1, self.findFirst.call_count)
+        self.password_pool.prefetch.assert_called_once_with(0)
+
+    def test_bulk_item_failure(self):
+        result, out, dummy = self.run_module({'passwords': [
+            {'name': 'new', 'project_name': 'project'},
+            {'name': 'missing-project'},
+        ]})
+
+        self.assertIs(FailJson, result)
+        self.assertTrue(out['changed'])
+        self.assertListEqual([None, True], [r.get('failed') for r in out['results']])
+
+    def test_bulk_and_name_are_exclusive(self):
+        result, dummy, dummy = self.run_module({'name': 'new', 'passwords': [{'name': 'new'}]})
+
+        self.assertIs(FailJson, result)
+
+    def test_update_unchanged(self):
+        result, out, dummy = self.run_module({'name': 'existing', 'state': 'update', 'tags': ['a'], 'username': 'admin'})
+
+        self.assertIs(ExitJson, result)
+        self.assertFalse(out['changed'])
+
+    def test_update_changed(self):
+        result, out, dummy = self.run_module({'name': 'existing', 'state': 'update', 'username': 'root'})
+
+        self.assertIs(ExitJson, result)
+        self.assertTrue(out['changed'])
+        self.assertEqual('root', out['result']['tpm']['username'])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import json
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import (
+        patch,
+        MagicMock,
+    )
+except ImportError:                 # Python 2.x
+    from mock import (
+        patch,
+        MagicMock,
+    )
+
+from ansible.module_utils import basic
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import (
+    TpmProjectApi,
+    TpmProjectResolver,
+)
+from ansible_collections.ziouf.tpm.plugins.modules import project
+
+try:
+    from ansible.module_utils.testing import patch_module_args
+except ImportError:
+    def patch_module_args(args):
+        return patch.object(basic, '_ANSIBLE_ARGS', json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8'))
+
+CONNECTION_ARGS = {
+    'tpm_hostname': 'tpm.example.com',
+    'tpm_username': 'user',
+    'tpm_password': 'pass',
+}
+
+PROJECTS = [
+    {'id': 1, 'name': 'infra', 'parent_id': 0},
+    {'id': 2, 'name': 'prod', 'parent_id': 1},
+    {'id': 3, 'name': 'nexus', 'parent_id': 2},
+    {'id': 4, 'name': 'dev', 'parent_id': 1},
+    {'id': 5, 'name': 'nexus', 'parent_id': 4},
+]
+
+
+class ExitJson(Exception):
+    pass
+
+
+class FailJson(Exception):
+    pass
+
+
+def exit_json(self, **kwargs):
+    raise ExitJson(kwargs)
+
+
+def fail_json(self, **kwargs):
+    raise FailJson(kwargs)
+
+
+class TestProjectModule(TestCase):
+    def setUp(self):
+        TpmProjectResolver.invalidate()
+
+    def run_module(self, args):
+        self.post = MagicMock(return_value={'id': 100})
+        self.delete = MagicMock(return_value={})
+
+        with patch_module_args(dict(CONNECTION_ARGS, **args)), \
+             patch.object(project.TpmModule, 'exit_json', new=exit_json), \
+             patch.object(project.TpmModule, 'fail_json', new=fail_json), \
+             patch.object(project.TpmModule, '_http_post', new=self.post), \
+             patch.object(project.TpmModule, '_http_delete', new=self.delete), \
+             patch.object(project.TpmModule, '_written', new=lambda self, id, data, entry=None: dict(data, id=id)), \
+             patch.object(TpmProjectApi, 'listIter', new=lambda self, fields=None: iter(PROJECTS)):
+
+            try:
+                project.main()
+            except (ExitJson, FailJson) as e:
+                return e.__class__, e.args[0]
+
+    def test_nested_project_found_by_name(self):
+        result, out = self.run_module({'name': 'prod', 'state': 'present'})
+
+        self.assertIs(ExitJson, result)
+        self.assertFalse(out['changed'])
+        self.assertEqual(0, self.post.call_count)
+
+    def test_nested_project_deleted_by_name(self):
+        result, out = self.run_module({'name': 'prod', 'state': 'absent'})
+
+        self.assertIs(ExitJson, result)
+        self.assertTrue(out['changed'])
+        self.assertEqual('api/v4/projects/2.json', self.delete.call_args[1]['path'])
+
+    def test_ambiguous_name(self):
+        result, out = self.run_module({'name': 'nexus', 'state': 'present'})
+
+        self.assertIs(FailJson, result)
+        self.assertIn('infra/dev/nexus, infra/prod/nexus', out['msg'])
+        self.assertEqual(0, self.post.call_count)
+
+    def test_new_project_is_created_at_the_root(self):
+        result, out = self.run_module({'name': 'apps', 'state': 'present'})
+
+        self.assertIs(ExitJson, result)
+        self.assertEqual(0, self.post.call_args[1]['body']['parent_id'])
+
+    def test_project_under_parent(self):
+        result, out = self.run_module({'name': 'nexus', 'parent_id': 2, 'state': 'present'})
+        self.assertFalse(out['changed'])
+
+        # Looked up at the root only when asked to
+        result, out = self.run_module({'name': 'prod', 'parent_id': 0, 'state': 'present'})
+        self.assertTrue(out['changed'])
+        self.assertEqual(0, self.post.call_args[1]['body']['parent_id'])
+
+    def test_project_by_path(self):
+        result, out = self.run_module({'name': 'infra/dev/nexus', 'state': 'present'})
+        self.assertFalse(out['changed'])
+
+        result, out = self.run_module({'name': 'infra/dev/sonar', 'state': 'present'})
+        self.assertTrue(out['changed'])
+        self.assertEqual(4, self.post.call_args[1]['body']['parent_id'])
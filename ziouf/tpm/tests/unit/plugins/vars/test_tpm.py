@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+# Make coding more python3-ish
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import sys
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+try:                                # Python 3+
+    from unittest.mock import patch
+except ImportError:                 # Python 2.x
+    from mock import patch
+
+from ansible.errors import AnsibleError
+from ansible.inventory.data import InventoryData
+from ansible.parsing.dataloader import DataLoader
+from ansible.plugins.loader import vars_loader
+from ansible_collections.ziouf.tpm.plugins.module_utils.api import TpmPasswordApi
+
+GROUP_VARS = '''
+tpm_hostname: tpm.example.com
+tpm_username: user
+tpm_password: pass
+tpm_secrets:
+  db_pass: "name:db tag:{{ env }}"
+  smtp_user:
+    query: "name:smtp"
+    field: username
+  ldap_pass:
+    query: "name:ldap"
+    default: ""
+'''
+
+ENTRIES = {
+    'name:db tag:prd': [{'id': 1, 'name': 'db'}],
+    'name:db tag:dev': [{'id': 2, 'name': 'db'}],
+    'name:smtp': [{'id': 3, 'name': 'smtp'}],
+}
+
+
+def mock_find(self, query_str='', fields=None):
+    return list(ENTRIES.get(query_str, []))
+
+
+def mock_getById(self, id=0):
+    return {'id': id, 'username': 'user{i}'.format(i=id), 'password': 'secret{i}'.format(i=id)}
+
+
+class TestVarsModule(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmpdir, 'group_vars'))
+        with open(os.path.join(self.tmpdir, 'group_vars', 'all.yml'), 'w') as f:
+            f.write(GROUP_VARS)
+
+        self.inventory = InventoryData()
+        for group, env, hosts in (('prd', 'prd', ['web1', 'web2', 'web3']), ('dev', 'dev', ['web4'])):
+            self.inventory.add_group(group)
+            self.inventory.set_variable(group, 'env', env)
+            for host in hosts:
+                self.inventory.add_host(host, group=group)
+        self.inventory.reconcile_inventory()
+
+        self.plugin = vars_loader.get('ziouf.tpm.tpm')
+        module = sys.modules[type(self.plugin).__module__]
+        module._RESOLVED.clear()
+        module._HOST_VARS.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_vars(self, host):
+        return self.plugin.get_vars(DataLoader(), self.tmpdir, [self.inventory.get_host(host)])
+
+    def test_distinct_queries_are_resolved_once(self):
+        with patch.object(TpmPasswordApi, 'find', autospec=True, side_effect=mock_find) as find, \
+             patch.object(TpmPasswordApi, 'getById', new=mock_getById):
+            result = dict((host, self.get_vars(host)) for host in ('web1', 'web2', 'web3', 'web4'))
+
+        self.assertDictEqual({'db_pass': 'secret1', 'smtp_user': 'user3', 'ldap_pass': ''}, result['web1'])
+        self.assertDictEqual(result['web1'], result['web3'])
+        self.assertEqual('secret2', result['web4']['db_pass'])
+        # db for prd and dev, smtp, ldap: whatever the number of hosts
+        self.assertEqual(4, find.call_count)
+
+    def test_query_without_match_fails(self):
+        with open(os.path.join(self.tmpdir, 'group_vars', 'dev.yml'), 'w') as f:
+            f.write('tpm_secrets:\n  db_pass: "name:db tag:qa"\n')
+
+        with patch.object(TpmPasswordApi, 'find', new=mock_find), \
+             patch.object(TpmPasswordApi, 'getById', new=mock_getById):
+            self.assertEqual('secret1', self.get_vars('web1')['db_pass'])
+            self.assertRaises(AnsibleError, self.get_vars, 'web4')